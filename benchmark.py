@@ -0,0 +1,715 @@
+import asyncio
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from argparse import ArgumentParser
+from contextlib import redirect_stdout
+from itertools import chain, islice
+from statistics import median
+
+"""  Benchmarks for the iPod music library. Each benchmark prints its results
+        and exits with a non-zero status when it misses its budget, so it can
+        be used to hold the line against performance regressions. """
+
+COLD_START_BUDGET_MS = 150
+STRESS_MIN_OPS_PER_SECOND = 50
+SERVER_P99_BUDGET_MS = 100
+SUITE_SIZES = [1000, 10000, 100000]
+REGRESSION_TOLERANCE = 0.25
+MEMORY_BUDGET_BYTES = 400
+OPEN_BUDGET_MS = 1000
+NOISE_FLOOR_MS = 0.05
+HEAVY_MODULES = ['pandas', 'numpy', 'matplotlib']
+
+COLD_START_SCRIPT = """
+import sys
+import ipod
+playlist = ipod.Playlist(sys.argv[1])
+playlist.play_song(sys.argv[2])
+heavy = [m for m in sys.argv[3:] if m in sys.modules]
+print(','.join(heavy))
+"""
+
+def time_process(args, cwd=None):
+    """Runs a Python process to completion and times it.
+
+    Args:
+        args (list): the arguments to pass to the Python interpreter.
+        cwd (str, optional): the directory to run the process in. Defaults
+            to the directory of this file.
+
+    Returns:
+        tuple: the wall time in milliseconds and the process's output.
+    """
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable] + args, capture_output=True, \
+        text=True, check=True, cwd=cwd or os.path.dirname(__file__) or ".")
+    return (time.perf_counter() - start) * 1000, result.stdout.strip()
+
+def cold_start(playlist_path="songs.csv", title="Hotel", runs=20, \
+        budget=COLD_START_BUDGET_MS):
+    """Measures how long a fresh process takes to import ipod, load a playlist
+        and play one song, which is what launching the iPod costs before the
+        menu is usable.
+
+    The interpreter's own startup is timed separately and subtracted, so the
+        result only counts the library's cost. The median of several runs is
+        used to smooth out noise.
+
+    Args:
+        playlist_path (str, optional): the playlist to load. Defaults to
+            'songs.csv'.
+        title (str, optional): the song to play. Defaults to 'Hotel'.
+        runs (int, optional): the number of processes to time. Defaults to 20.
+        budget (float, optional): the most milliseconds the library may add
+            to startup. Defaults to COLD_START_BUDGET_MS.
+
+    Returns:
+        bool: True if the cold start stayed within budget and loaded none of
+            the heavy modules.
+    """
+    playlist_path = os.path.abspath(playlist_path)
+    interpreter = median(time_process(["-c", "pass"])[0] for _ in range(runs))
+
+    timings = []
+    heavy = ''
+    for _ in range(runs):
+        elapsed, heavy = time_process(["-c", COLD_START_SCRIPT, \
+            playlist_path, title] + HEAVY_MODULES)
+        timings.append(elapsed)
+    cost = median(timings) - interpreter
+
+    print(f"Interpreter startup: {interpreter:.1f} ms")
+    print(f"Cold start (import, load, play): {cost:.1f} ms "
+        f"over {runs} runs, budget {budget} ms")
+    print(f"Heavy modules loaded: {heavy or 'none'}")
+    return cost <= budget and not heavy
+
+def _stress_titles(worker, thread, operations):
+    """Returns the titles one stress thread uploads and the ones it deletes
+        again: every third song is deleted after the next one is uploaded."""
+    uploaded = [f"Stress {worker}-{thread}-{i}" for i in range(operations)]
+    deleted = [uploaded[i - 1] for i in range(2, operations, 3)]
+    return uploaded, deleted
+
+def _stress_worker(path, worker, threads, operations):
+    """Runs one stress process: several threads sharing one Playlist, each
+        uploading, deleting and playing its own songs."""
+    import ipod
+    sys.stdout = open(os.devnull, "w")
+    playlist = ipod.Playlist(path)
+
+    def run(thread):
+        uploaded, _ = _stress_titles(worker, thread, operations)
+        for i, title in enumerate(uploaded):
+            playlist.upload_song(title, f"Worker {worker}", "Stress", "3:00")
+            if i % 3 == 2:
+                playlist.delete_songs(uploaded[i - 1])
+            playlist.play_song(title)
+
+    pool = [threading.Thread(target=run, args=(t,)) for t in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    playlist.close()
+
+def stress(processes=4, threads=4, operations=60, \
+        min_throughput=STRESS_MIN_OPS_PER_SECOND):
+    """Hammers one playlist file from several processes, each with several
+        threads sharing a Playlist, with interleaved uploads, deletes and
+        plays, then checks that no update was lost.
+
+    Args:
+        processes (int, optional): number of processes. Defaults to 4.
+        threads (int, optional): threads per process. Defaults to 4.
+        operations (int, optional): songs uploaded by each thread. Defaults
+            to 60.
+        min_throughput (float, optional): the fewest operations per second
+            that count as a pass. Defaults to STRESS_MIN_OPS_PER_SECOND.
+
+    Returns:
+        bool: True if the final playlist holds exactly the songs that should
+            have survived and throughput was high enough.
+    """
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import ipod
+
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, "songs.csv")
+        shutil.copy(os.path.join(os.path.dirname(os.path.abspath(__file__)),\
+            "songs.csv"), path)
+
+        context = multiprocessing.get_context("spawn")
+        workers = [context.Process(target=_stress_worker, \
+            args=(path, w, threads, operations)) for w in range(processes)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+
+        expected = set()
+        for w in range(processes):
+            for t in range(threads):
+                uploaded, deleted = _stress_titles(w, t, operations)
+                expected.update(set(uploaded) - set(deleted))
+        playlist = ipod.Playlist(path)
+        stored = {row[0] for row in playlist.catalog.rows.values() \
+            if row[2] == "Stress"}
+    finally:
+        shutil.rmtree(directory)
+
+    # Each song costs an upload and a play, and every third one a delete.
+    total = processes * threads * (2 * operations + operations // 3)
+    throughput = total / elapsed
+    lost = expected - stored
+    unexpected = stored - expected
+    print(f"{processes} processes x {threads} threads: {total} operations "
+        f"in {elapsed:.2f} s ({throughput:.0f} ops/s, "
+        f"minimum {min_throughput})")
+    print(f"Lost updates: {len(lost)}, resurrected deletes: "
+        f"{len(unexpected)}")
+    failed = any(worker.exitcode for worker in workers)
+    if failed:
+        print("A worker process failed.")
+    return not lost and not unexpected and not failed and \
+        throughput >= min_throughput
+
+def _lock_worker(path, counter_path, threads, rounds, conflicts):
+    """Runs one lock-checking process: several threads sharing one FileLock,
+        each reading a counter file under the shared lock and then
+        incrementing it under the exclusive lock. A writer marks the file
+        busy while it works, so a holder that overlaps it sees the mark."""
+    import ipod
+    lock = ipod.FileLock(path)
+
+    def read():
+        with open(counter_path, "r", encoding="utf-8") as f:
+            value = f.read()
+        if not value.isdigit():
+            with conflicts.get_lock():
+                conflicts.value += 1
+        return value
+
+    def write(value):
+        with open(counter_path, "w", encoding="utf-8") as f:
+            f.write(value)
+
+    def run(thread):
+        for _ in range(rounds):
+            with lock.hold(shared=True):
+                read()
+                time.sleep(0.0005)
+            with lock.hold():
+                value = read()
+                write("busy")
+                time.sleep(0.0005)
+                write(str(int(value) + 1 if value.isdigit() else 0))
+
+    pool = [threading.Thread(target=run, args=(t,)) for t in range(threads)]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+
+def locks(processes=4, threads=4, rounds=50):
+    """Checks that ipod.FileLock keeps writers to themselves when several
+        processes, each with several threads, mix shared and exclusive holds
+        of one lock file, in particular when a thread asks for the exclusive
+        lock while another thread of its process holds it shared.
+
+    Args:
+        processes (int, optional): number of processes. Defaults to 4.
+        threads (int, optional): threads per process. Defaults to 4.
+        rounds (int, optional): reads and increments by each thread.
+            Defaults to 50.
+
+    Returns:
+        bool: True if no holder ever overlapped a writer and no increment
+            was lost.
+    """
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import ipod
+    if ipod.fcntl is None:
+        print("fcntl is not available; FileLock does nothing here.")
+        return True
+
+    directory = tempfile.mkdtemp()
+    try:
+        counter_path = os.path.join(directory, "counter")
+        with open(counter_path, "w", encoding="utf-8") as f:
+            f.write("0")
+        context = multiprocessing.get_context("spawn")
+        conflicts = context.Value('i', 0)
+        workers = [context.Process(target=_lock_worker, \
+            args=(os.path.join(directory, "songs.csv.lock"), counter_path, \
+                threads, rounds, conflicts)) for _ in range(processes)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+        with open(counter_path, "r", encoding="utf-8") as f:
+            value = f.read()
+    finally:
+        shutil.rmtree(directory)
+
+    expected = processes * threads * rounds
+    counted = int(value) if value.isdigit() else 0
+    print(f"{processes} processes x {threads} threads: {2 * expected} holds "
+        f"in {elapsed:.2f} s")
+    print(f"Holders overlapping a writer: {conflicts.value}, lost "
+        f"increments: {expected - counted}")
+    failed = any(worker.exitcode for worker in workers)
+    if failed:
+        print("A worker process failed.")
+    return not conflicts.value and counted == expected and not failed
+
+def server(clients=50, requests=200, write_ratio=0.1, \
+        budget=SERVER_P99_BUDGET_MS):
+    """Starts ipod_server on a copy of the playlist and measures its requests
+        per second and latency under many concurrent clients.
+
+    Args:
+        clients (int, optional): the number of clients. Defaults to 50.
+        requests (int, optional): the requests each client sends. Defaults
+            to 200.
+        write_ratio (float, optional): the share of requests that upload or
+            delete a song. Defaults to 0.1.
+        budget (float, optional): the highest p99 latency in milliseconds
+            that counts as a pass. Defaults to SERVER_P99_BUDGET_MS.
+
+    Returns:
+        bool: True if every request succeeded within the p99 budget.
+    """
+    here = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, here)
+    from ipod_server import generate_load
+
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "songs.csv")
+    socket_path = os.path.join(directory, "ipod.sock")
+    shutil.copy(os.path.join(here, "songs.csv"), path)
+    process = subprocess.Popen([sys.executable, \
+        os.path.join(here, "ipod_server.py"), "serve", "--playlist_path", \
+        path, "--socket", socket_path], stdout=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + 10
+        while not os.path.exists(socket_path):
+            if process.poll() is not None or time.monotonic() > deadline:
+                print("The server did not start.")
+                return False
+            time.sleep(0.05)
+        results = asyncio.run(generate_load(clients, requests, write_ratio, \
+            path=socket_path))
+    finally:
+        process.terminate()
+        process.wait()
+        shutil.rmtree(directory)
+
+    print(json.dumps(results, indent=2))
+    print(f"{results['rps']:.0f} requests/s, p99 {results['p99_ms']:.1f} ms "
+        f"(budget {budget} ms), {results['writes']} writes in "
+        f"{results['commits']} group commits")
+    return not results['errors'] and results['p99_ms'] <= budget
+
+def _time_calls(function, arguments):
+    """Calls a function once per argument tuple and summarizes how long the
+        calls took.
+
+    Returns:
+        dict: the number of 'runs' and the median, fastest and slowest call
+            in milliseconds.
+    """
+    timings = []
+    for args in arguments:
+        start = time.perf_counter()
+        function(*args)
+        timings.append((time.perf_counter() - start) * 1000)
+    return {'runs': len(timings), 'median_ms': median(timings), \
+        'min_ms': min(timings), 'max_ms': max(timings)}
+
+def _run_suite(path, seed):
+    """Times every Playlist method on one library. Read-only methods run
+        first; the uploads are then deleted again.
+
+    Returns:
+        dict: the timings of each method (see _time_calls).
+    """
+    import ipod
+    from matplotlib import pyplot as plt
+
+    results = {}
+    results['load'] = _time_calls(ipod.Playlist, [(path,)] * 3)
+    playlist = ipod.Playlist(path)
+    size = len(playlist.catalog)
+    rng = random.Random(seed)
+    titles = rng.sample([row[0] for row in playlist.catalog.rows.values()], \
+        min(size, 200))
+
+    def show_listening_habits():
+        playlist.show_listening_habits()
+        plt.close('all')
+
+    cases = [
+        ('play_song', playlist.play_song, [(t,) for t in titles]),
+        ('check_playlist', playlist.check_playlist, [(t,) for t in titles] \
+            + [(f"Missing {i}",) for i in range(20)]),
+        ('view_all_songs', playlist.view_all_songs, \
+            [(order,) for order in ipod.SORT_ORDERS] * 3),
+        ('view_all_songs_page', playlist.view_all_songs, \
+            [(order, ipod.PAGE_SIZE, size // 2) for order in ipod.SORT_ORDERS]
+            * 10),
+        ('released_between', playlist.released_between, \
+            [(f"{year}-01-01", f"{year}-03-31") for year in range(1990, 2020)]),
+        ('newest_songs', playlist.newest_songs, [(10,)] * 30),
+        ('release_histogram', playlist.release_histogram, \
+            [("year",), ("decade",)] * 5),
+        ('shuffle_songs', playlist.shuffle_songs, [()] * 3),
+        ('next_shuffled', playlist.next_shuffled, [()] * 200),
+        ('play_next', playlist.play_next, [()] * 200),
+        ('listening_summary', playlist.listening_summary, [()] * 30),
+        ('songs_per_artist', playlist.songs_per_artist, [()] * 3),
+        ('calculate_durations', playlist.calculate_durations, [()] * 3),
+        ('show_listening_habits', show_listening_habits, [()] * 3),
+        ('upload_song', playlist.upload_song, [(f"Benchmark {i}", \
+            "Benchmark Artist", "Pop", "3:25", "2024-01-01") \
+            for i in range(100)]),
+        ('delete_songs', playlist.delete_songs, \
+            [(f"Benchmark {i}",) for i in range(5)]),
+    ]
+    for name, function, arguments in cases:
+        results[name] = _time_calls(function, arguments)
+    playlist.close()
+    return results
+
+def find_regressions(results, baseline, tolerance=REGRESSION_TOLERANCE):
+    """Compares suite results with a baseline.
+
+    A method has regressed when its median time grew by more than the
+        tolerance and by more than NOISE_FLOOR_MS.
+
+    Args:
+        results (dict): the suite's results.
+        baseline (dict): earlier results to compare with.
+        tolerance (float, optional): the fraction a median may grow by.
+            Defaults to REGRESSION_TOLERANCE.
+
+    Returns:
+        list: (size, method, median, baseline median) tuples.
+    """
+    regressions = []
+    for size, methods in results['sizes'].items():
+        for name, timing in methods.items():
+            old = baseline.get('sizes', {}).get(size, {}).get(name)
+            if old is None:
+                continue
+            new, old = timing['median_ms'], old['median_ms']
+            if new > old * (1 + tolerance) and new - old > NOISE_FLOOR_MS:
+                regressions.append((size, name, new, old))
+    return regressions
+
+def synthetic_library(size, seed=0, data_dir=None):
+    """Returns the path of a synthetic CSV library from generate_songs.py,
+        generating it the first time. The same size and seed always produce
+        the same library, so it is kept in `data_dir` and reused.
+
+    Args:
+        size (int): the number of songs.
+        seed (int, optional): seeds the generator. Defaults to 0.
+        data_dir (str, optional): where to keep the libraries. Defaults to
+            'ipod-benchmark' in the temporary directory.
+
+    Returns:
+        str: the path of the library.
+    """
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from generate_songs import write_library
+
+    data_dir = data_dir or os.path.join(tempfile.gettempdir(), \
+        "ipod-benchmark")
+    os.makedirs(data_dir, exist_ok=True)
+    library = os.path.join(data_dir, f"songs-{size}-{seed}.csv")
+    if not os.path.exists(library):
+        write_library(library + ".tmp", size, seed)
+        os.replace(library + ".tmp", library)
+    return library
+
+def suite(sizes=SUITE_SIZES, seed=0, data_dir=None, \
+        output="benchmark_results.json", baseline="benchmark_baseline.json", \
+        save_baseline=False, tolerance=REGRESSION_TOLERANCE, shards=0):
+    """Times every Playlist method on synthetic libraries of several sizes,
+        records the results as JSON and flags regressions against a stored
+        baseline.
+
+    The libraries come from generate_songs.py and are kept in `data_dir`,
+        since the same size and seed always produce the same library. Each
+        size is benchmarked on a copy.
+
+    Args:
+        sizes (list, optional): the library sizes. Defaults to SUITE_SIZES.
+        seed (int, optional): seeds the libraries and the songs picked.
+            Defaults to 0.
+        data_dir (str, optional): where to keep the generated libraries.
+            Defaults to 'ipod-benchmark' in the temporary directory.
+        output (str, optional): where to write the results. Defaults to
+            'benchmark_results.json'.
+        baseline (str, optional): the results to compare with. Defaults to
+            'benchmark_baseline.json'.
+        save_baseline (bool, optional): store these results as the new
+            baseline. Defaults to False.
+        tolerance (float, optional): see find_regressions.
+        shards (int, optional): split each library into this many shards
+            and benchmark the sharded library instead. Defaults to 0.
+
+    Returns:
+        bool: True if no method regressed.
+    """
+    os.environ.setdefault("MPLBACKEND", "Agg")
+    results = {'python': platform.python_version(), \
+        'platform': platform.platform(), 'seed': seed, 'shards': shards, \
+        'sizes': {}}
+    for size in sizes:
+        library = synthetic_library(size, seed, data_dir)
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "songs.csv")
+            shutil.copy(library, path)
+            if shards:
+                import ipod
+                sharded = os.path.join(directory, "shards")
+                os.makedirs(sharded)
+                ipod.ShardedStorage(sharded, shards).rewrite(\
+                    chain.from_iterable(ipod.storage_for_path(path)\
+                        .iter_chunks()))
+                path = sharded
+            with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+                results['sizes'][str(size)] = _run_suite(path, seed)
+        finally:
+            shutil.rmtree(directory)
+        for name, timing in results['sizes'][str(size)].items():
+            print(f"{size:>10} {name:<22} {timing['median_ms']:>11.3f} ms "
+                f"median of {timing['runs']}")
+
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to '{output}'.")
+
+    regressions = []
+    if os.path.exists(baseline):
+        with open(baseline) as f:
+            regressions = find_regressions(results, json.load(f), tolerance)
+        for size, name, new, old in regressions:
+            print(f"REGRESSION {size} {name}: {new:.3f} ms, baseline "
+                f"{old:.3f} ms (+{new / old - 1:.0%})")
+        if not regressions:
+            print(f"No regressions against '{baseline}'.")
+    else:
+        print(f"No baseline at '{baseline}'; skipping the regression check.")
+    if save_baseline:
+        shutil.copy(output, baseline)
+        print(f"Saved the results as the baseline '{baseline}'.")
+    return not regressions
+
+def memory(size=1000000, seed=0, data_dir=None, search=False, \
+        budget=MEMORY_BUDGET_BYTES):
+    """Loads a synthetic library and reports how many bytes the catalog uses
+        per song, next to what the same songs cost as a dict of plain tuples
+        (measured on up to 100,000 of them), the layout the catalog used to
+        have before its indexes were even counted.
+
+    Args:
+        size (int, optional): the number of songs. Defaults to 1,000,000.
+        seed (int, optional): seeds the library. Defaults to 0.
+        data_dir (str, optional): see synthetic_library.
+        search (bool, optional): also build the fuzzy search index. Defaults
+            to False.
+        budget (float, optional): the most bytes per song that count as a
+            pass. Defaults to MEMORY_BUDGET_BYTES.
+
+    Returns:
+        bool: True if the catalog stayed within budget.
+    """
+    import resource
+    import tracemalloc
+
+    library = synthetic_library(size, seed, data_dir)
+    import ipod
+    playlist = ipod.Playlist(library)
+    for order in ipod.SORT_ORDERS:
+        playlist.view_all_songs(order, limit=1)
+    if search:
+        playlist.search("hotel")
+    report = playlist.memory_report()
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    sample = min(size, 100000)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    rows = islice(chain.from_iterable(playlist.storage.iter_chunks()), sample)
+    tuples = {row_id: tuple(row) for row_id, row in enumerate(rows)}
+    plain = (tracemalloc.get_traced_memory()[0] - before) / len(tuples)
+    tracemalloc.stop()
+
+    for part, used in report['bytes'].items():
+        print(f"{part:<14}{used / report['songs']:>10.1f} bytes/song")
+    print(f"Catalog: {report['per_track']:.1f} bytes/song over "
+        f"{report['songs']} songs, {report['total'] / 2 ** 20:.1f} MiB "
+        f"(budget {budget} bytes/song)")
+    print(f"Plain tuples: {plain:.1f} bytes/song without any index "
+        f"({plain / report['per_track']:.1f}x the catalog)")
+    print(f"Peak resident memory: {peak / 2 ** 20:.1f} MiB")
+    return report['per_track'] <= budget
+
+def open_time(size=300000, seed=0, data_dir=None, runs=3, \
+        budget=OPEN_BUDGET_MS):
+    """Times opening a large synthetic library, as songs.csv and as a
+        columnar '.ipodlib' library, next to reading the same CSV with
+        pandas.read_csv when pandas is installed.
+
+    Args:
+        size (int, optional): the number of songs. Defaults to 300,000.
+        seed (int, optional): seeds the library. Defaults to 0.
+        data_dir (str, optional): see synthetic_library.
+        runs (int, optional): the number of opens timed per format; the
+            median is reported. Defaults to 3.
+        budget (float, optional): the most milliseconds the columnar library
+            may take to open. Defaults to OPEN_BUDGET_MS.
+
+    Returns:
+        bool: True if the columnar library opened within budget.
+    """
+    import ipod
+    library = synthetic_library(size, seed, data_dir)
+    columnar = os.path.splitext(library)[0] + ipod.ColumnarStorage.SUFFIX
+    if not os.path.exists(columnar):
+        ipod.convert_library(library, columnar)
+
+    def open_library(path):
+        playlist = ipod.Playlist(path)
+        playlist.close()
+
+    timings = {'csv': _time_calls(open_library, [(library,)] * runs), \
+        'ipodlib': _time_calls(open_library, [(columnar,)] * runs)}
+    try:
+        import pandas as pd
+    except ImportError:
+        pass
+    else:
+        timings['pandas.read_csv'] = _time_calls(pd.read_csv, \
+            [(library,)] * runs)
+    for name, timing in timings.items():
+        print(f"{name:<16}{timing['median_ms']:>10.1f} ms median of "
+            f"{timing['runs']} opens of {size} songs")
+    print(f"Budget for the columnar library: {budget:.0f} ms")
+    return timings['ipodlib']['median_ms'] <= budget
+
+def main():
+    """Parses command line arguments and runs the requested benchmark.
+
+    Side effects:
+        prints the benchmark results and exits with status 1 if a budget
+            was missed.
+    """
+    parser = ArgumentParser(description="Benchmark the iPod music library.")
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    cold = subparsers.add_parser("cold-start", \
+        help="Time launching the iPod and playing one song.")
+    cold.add_argument("--playlist_path", default="songs.csv")
+    cold.add_argument("--title", default="Hotel")
+    cold.add_argument("--runs", type=int, default=20)
+    cold.add_argument("--budget", type=float, default=COLD_START_BUDGET_MS,\
+        help="Maximum milliseconds added to interpreter startup.")
+
+    load = subparsers.add_parser("stress", \
+        help="Check concurrent uploads, deletes and plays lose no updates.")
+    load.add_argument("--processes", type=int, default=4)
+    load.add_argument("--threads", type=int, default=4)
+    load.add_argument("--operations", type=int, default=60)
+    load.add_argument("--min_throughput", type=float, \
+        default=STRESS_MIN_OPS_PER_SECOND)
+
+    lock = subparsers.add_parser("locks", \
+        help="Check the playlist file lock under threads and processes.")
+    lock.add_argument("--processes", type=int, default=4)
+    lock.add_argument("--threads", type=int, default=4)
+    lock.add_argument("--rounds", type=int, default=50)
+
+    serve = subparsers.add_parser("server", \
+        help="Measure ipod_server's requests per second and p99 latency.")
+    serve.add_argument("--clients", type=int, default=50)
+    serve.add_argument("--requests", type=int, default=200)
+    serve.add_argument("--write_ratio", type=float, default=0.1)
+    serve.add_argument("--budget", type=float, default=SERVER_P99_BUDGET_MS,\
+        help="Maximum p99 latency in milliseconds.")
+
+    bench = subparsers.add_parser("suite", \
+        help="Time every Playlist method on synthetic libraries.")
+    bench.add_argument("--sizes", type=int, nargs="+", default=SUITE_SIZES)
+    bench.add_argument("--seed", type=int, default=0)
+    bench.add_argument("--data_dir", default=None)
+    bench.add_argument("--output", default="benchmark_results.json")
+    bench.add_argument("--baseline", default="benchmark_baseline.json")
+    bench.add_argument("--save_baseline", action="store_true")
+    bench.add_argument("--tolerance", type=float, \
+        default=REGRESSION_TOLERANCE)
+    bench.add_argument("--shards", type=int, default=0, \
+        help="Benchmark libraries split into this many shards.")
+
+    mem = subparsers.add_parser("memory", \
+        help="Report the catalog's memory use per song.")
+    mem.add_argument("--size", type=int, default=1000000)
+    mem.add_argument("--seed", type=int, default=0)
+    mem.add_argument("--data_dir", default=None)
+    mem.add_argument("--search", action="store_true", \
+        help="Also build the fuzzy search index.")
+    mem.add_argument("--budget", type=float, default=MEMORY_BUDGET_BYTES,\
+        help="Maximum bytes per song.")
+
+    opening = subparsers.add_parser("open", \
+        help="Time opening a large library as CSV and as columns.")
+    opening.add_argument("--size", type=int, default=300000)
+    opening.add_argument("--seed", type=int, default=0)
+    opening.add_argument("--data_dir", default=None)
+    opening.add_argument("--runs", type=int, default=3)
+    opening.add_argument("--budget", type=float, default=OPEN_BUDGET_MS, \
+        help="Maximum milliseconds to open the columnar library.")
+    args = parser.parse_args()
+
+    if args.benchmark == "cold-start":
+        ok = cold_start(args.playlist_path, args.title, args.runs, args.budget)
+    elif args.benchmark == "stress":
+        ok = stress(args.processes, args.threads, args.operations, \
+            args.min_throughput)
+    elif args.benchmark == "locks":
+        ok = locks(args.processes, args.threads, args.rounds)
+    elif args.benchmark == "server":
+        ok = server(args.clients, args.requests, args.write_ratio, \
+            args.budget)
+    elif args.benchmark == "suite":
+        ok = suite(args.sizes, args.seed, args.data_dir, args.output, \
+            args.baseline, args.save_baseline, args.tolerance, args.shards)
+    elif args.benchmark == "memory":
+        ok = memory(args.size, args.seed, args.data_dir, args.search, \
+            args.budget)
+    elif args.benchmark == "open":
+        ok = open_time(args.size, args.seed, args.data_dir, args.runs, \
+            args.budget)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
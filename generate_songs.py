@@ -0,0 +1,166 @@
+import random
+from argparse import ArgumentParser
+from datetime import date, timedelta
+from itertools import islice
+
+from ipod import storage_for_path
+
+"""  Generates synthetic music libraries of any size, from a thousand to ten
+        million songs, for testing the iPod at a realistic scale.
+
+    The same count and seed always produce the same library. A few artists
+        and genres account for most of the songs, as in a real collection,
+        and the rows include the awkward cases real files have: titles with
+        commas, quotes and '(feat. ...)' credits, names with stray spaces,
+        very short, very long and missing durations and missing release
+        dates. """
+
+WORDS = ['Love', 'Night', 'Hotel', 'Fire', 'Dream', 'Heart', 'Summer',
+    'Rain', 'Gold', 'Dance', 'Blue', 'Midnight', 'City', 'Lights', 'Home',
+    'Wild', 'Young', 'Forever', 'Stars', 'Ocean', 'Road', 'Ghost', 'Sugar',
+    'Paradise', 'Thunder', 'Angel', 'Echo', 'Neon', 'Velvet', 'Crown',
+    'Shadow', 'River', 'Golden', 'Electric', 'Paper', 'Diamond', 'Honey',
+    'Storm', 'Moon', 'Revolver', 'Fever', 'Silence', 'Highway', 'Mirror']
+FIRST_NAMES = ['Justin', 'Taylor', 'Ariana', 'Drake', 'Billie', 'Frank',
+    'Lana', 'Kendrick', 'Dua', 'Harry', 'Olivia', 'Montell', 'Lil', 'SZA',
+    'Bruno', 'Adele', 'Post', 'Doja', 'Tyler', 'Khalid', 'Miley', 'Sam']
+LAST_NAMES = ['Bieber', 'Swift', 'Grande', 'Eilish', 'Ocean', 'Del Rey',
+    'Lamar', 'Lipa', 'Styles', 'Rodrigo', 'Fish', 'Wayne', 'Mars', 'Malone',
+    'Cat', 'Smith', 'Cyrus', 'Fisher', 'Walters', 'Young', 'Hart', 'Cole']
+GENRES = ['Pop', 'Hip-Hop/Rap', 'Alternative', 'R&B/Soul', 'Rock', 'Dance',
+    'Country', 'Electronic', 'Indie Pop', 'Latin', 'K-Pop', 'Jazz',
+    'Classical', 'Metal', 'Reggae', 'Blues', 'Folk', 'Soundtrack', 'Punk',
+    'Gospel']
+ARTIST_SKEW = 1.07
+GENRE_SKEW = 1.3
+FIRST_RELEASE = date(1960, 1, 1)
+LAST_RELEASE = date(2024, 12, 31)
+
+def _zipf_weights(n, skew):
+    """Returns cumulative Zipf weights for n ranks, so that the first ranks
+        are picked far more often than the rest."""
+    total = 0
+    cumulative = []
+    for rank in range(1, n + 1):
+        total += 1 / rank ** skew
+        cumulative.append(total)
+    return cumulative
+
+def _artist(rng, number):
+    """Makes up an artist name, sometimes with the stray leading space or
+        '&' that songs.csv has."""
+    if number % 5 == 0:
+        name = f"The {rng.choice(WORDS)} {rng.choice(WORDS)}s"
+    else:
+        name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+    if number % 17 == 0:
+        name += f" & {rng.choice(FIRST_NAMES)}"
+    if number % 7 == 0:
+        name = " " + name
+    return f"{name} {number}" if number >= len(FIRST_NAMES) else name
+
+def _title(rng, artists):
+    """Makes up a song title of one to four words, sometimes with a comma,
+        quotes or a featured artist."""
+    title = " ".join(rng.choice(WORDS) for _ in range(rng.randint(1, 4)))
+    odd = rng.random()
+    if odd < 0.05:
+        title = f"{title}, {rng.choice(WORDS)}"
+    elif odd < 0.08:
+        title = f'"{title}"'
+    elif odd < 0.11:
+        title = f"{title} (feat. {rng.choice(artists).strip()})"
+    elif odd < 0.12:
+        title = f" {title}"
+    return f"{title} {rng.randrange(1000)}" if rng.random() < 0.5 else title
+
+def _duration(rng):
+    """Picks a duration in seconds: mostly three to four minutes, with a few
+        very short, very long and missing ones."""
+    odd = rng.random()
+    if odd < 0.01:
+        return None
+    if odd < 0.02:
+        return rng.randint(1, 29)
+    if odd < 0.03:
+        return rng.randint(900, 5400)
+    return max(30, min(600, int(rng.gauss(215, 60))))
+
+def _release(rng):
+    """Picks a release date, skewed towards recent years, or None for a few
+        songs."""
+    if rng.random() < 0.02:
+        return None
+    days = (LAST_RELEASE - FIRST_RELEASE).days
+    return (FIRST_RELEASE + timedelta(days=int(rng.triangular(0, days, \
+        days)))).isoformat()
+
+def generate_songs(count, seed=0):
+    """Generates a synthetic library.
+
+    Args:
+        count (int): the number of songs.
+        seed (int, optional): seeds the generator; the same count and seed
+            always give the same songs. Defaults to 0.
+
+    Yields:
+        tuple: (title, artist, genre, duration, release) rows.
+    """
+    rng = random.Random(seed)
+    artists = [_artist(rng, n) for n in range(max(10, count // 20))]
+    artist_weights = _zipf_weights(len(artists), ARTIST_SKEW)
+    genre_weights = _zipf_weights(len(GENRES), GENRE_SKEW)
+
+    remaining = count
+    while remaining:
+        size = min(remaining, 10000)
+        remaining -= size
+        chunk_artists = rng.choices(artists, cum_weights=artist_weights, \
+            k=size)
+        chunk_genres = rng.choices(GENRES, cum_weights=genre_weights, k=size)
+        for artist, genre in zip(chunk_artists, chunk_genres):
+            yield (_title(rng, artists), artist, genre, _duration(rng), \
+                _release(rng))
+
+def write_library(path, count, seed=0):
+    """Writes a synthetic library to a CSV file, '.ipodlib' library or
+        SQLite database.
+
+    Args:
+        path (str): where to write the library; the format is chosen from
+            the extension, as for Playlist.
+        count (int): the number of songs.
+        seed (int, optional): seeds the generator. Defaults to 0.
+
+    Returns:
+        int: the number of songs written.
+    """
+    storage_for_path(path).rewrite(generate_songs(count, seed))
+    return count
+
+def main():
+    """Parses command line arguments and writes a synthetic library.
+
+    Side effects:
+        prints the number of songs written.
+    """
+    parser = ArgumentParser(description="Generate a synthetic music library.")
+    parser.add_argument("count", type=int, help="The number of songs.")
+    parser.add_argument("--path", default=None, help="Where to write the "
+        "library. Defaults to 'songs-<count>.csv'.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--sample", type=int, default=0, \
+        help="Print this many songs instead of writing a library.")
+    args = parser.parse_args()
+
+    if args.sample:
+        for row in islice(generate_songs(args.count, args.seed), args.sample):
+            print(row)
+        return
+    path = args.path or f"songs-{args.count}.csv"
+    write_library(path, args.count, args.seed)
+    print(f"Wrote {args.count} songs to '{path}'.")
+
+
+if __name__ == "__main__":
+    main()
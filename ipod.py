@@ -1,47 +1,3444 @@
-import pandas as pd
-from datetime import datetime
+from datetime import date, datetime
+from array import array
 import csv
+import os
+import sys
+import shlex
+import threading
+import json
+import io
+import shutil
+import time
+import glob
+import zlib
 from argparse import ArgumentParser
-from random import shuffle
-from matplotlib import pyplot as plt 
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+from random import shuffle, Random
+from itertools import islice, chain
+from functools import wraps, lru_cache
+from operator import itemgetter
+from fnmatch import fnmatchcase
+import heapq
+import bisect
+from collections import Counter, deque
+from contextlib import contextmanager, nullcontext, redirect_stdout
 
 """  A music library enabling users to manage songs, playlists, and perform 
         various functions using implemented code structures, supported by 
-        CSV data storage. """
+        CSV data storage. 
+        
+    pandas, NumPy and matplotlib are imported inside the functions that use
+        them, so that starting the iPod and playing a song does not pay for
+        loading them. """
+
+COLUMNS = ['Title', 'Artist', 'Genre', 'Duration', 'Release']
+PAGE_SIZE = 20
+CHART_PATH = "listening_habits.png"
+
+def normalize_title(title):
+    """Normalizes a song title or artist name so that lookups ignore case,
+        surrounding whitespace and quotation marks.
+
+    Args:
+        title (str): the title (or artist) to normalize.
+
+    Returns:
+        str: the normalized title.
+    """
+    return str(title).strip().replace('“', '').replace('”', '')\
+        .replace('"', '').lower()
+
+def _name_key(name):
+    """Returns the key a genre or artist is counted under, by the catalog's
+        running totals and the play history alike: the name without
+        surrounding whitespace, or '' for a song without one."""
+    return '' if name is None else str(name).strip()
+
+# The record of the Playlist call being measured on each thread, if any.
+_current = threading.local()
+
+def _count(name, amount=1):
+    """Adds to a counter, such as 'rows_scanned' or 'bytes_read', of the
+        Playlist call being measured on this thread. Does nothing when no
+        call is being measured."""
+    record = getattr(_current, 'record', None)
+    if record is not None:
+        record[name] += amount
+
+@contextmanager
+def _phase(name):
+    """Adds the time spent in a block to the '<name>_seconds' counter of the
+        Playlist call being measured on this thread, so that a slow call can
+        be broken down into reading, indexing, writing and so on."""
+    if getattr(_current, 'record', None) is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _count(f"{name}_seconds", time.perf_counter() - start)
+
+class MethodStats:
+    """What Metrics has recorded about one Playlist method: its number of
+        calls, total time and counters, and the latencies of its most recent
+        calls.
+    """
+
+    def __init__(self, window=1000):
+        """Initializes the class attributes.
+
+        Args:
+            window (int, optional): the number of recent calls the latency
+                percentiles are taken over. Defaults to 1000.
+        """
+        self.calls = 0
+        self.seconds = 0.0
+        self.counters = Counter()
+        self.latencies = deque(maxlen=window)
+
+    def add(self, seconds, record):
+        """Records one call that took `seconds` and counted `record`."""
+        self.calls += 1
+        self.seconds += seconds
+        self.counters.update(record)
+        self.latencies.append(seconds)
+
+    def percentiles(self, fractions=(0.5, 0.95, 0.99)):
+        """Returns the latency in seconds below which each fraction of the
+            recent calls fell."""
+        latencies = sorted(self.latencies)
+        if not latencies:
+            return {fraction: 0.0 for fraction in fractions}
+        return {fraction: latencies[min(len(latencies) - 1, \
+            int(fraction * len(latencies)))] for fraction in fractions}
+
+class Metrics:
+    """Instruments the methods of a Playlist, recording for each one its wall
+        time, the rows it scanned, the bytes it read and wrote, its cache hits
+        and misses and the time spent in each phase, plus rolling p50, p95
+        and p99 latencies.
+
+    When disabled, which is the default, a call costs one attribute check.
+
+    Attributes:
+        enabled (bool): whether calls are being recorded.
+        methods (dict): the MethodStats of each method called so far.
+        hooks (list): functions called after each recorded call with the
+            method's name, its wall time in seconds and a dict of its
+            counters.
+    """
+
+    COUNTERS = ['rows_scanned', 'bytes_read', 'bytes_written', 'cache_hits', \
+        'cache_misses']
+
+    def __init__(self, enabled=False, window=1000):
+        """Initializes the class attributes.
+
+        Args:
+            enabled (bool, optional): record calls. Defaults to False.
+            window (int, optional): the number of recent calls of each method
+                the latency percentiles are taken over. Defaults to 1000.
+        """
+        self.enabled = enabled
+        self.window = window
+        self.methods = {}
+        self.hooks = []
+        self._guard = threading.Lock()
+
+    def add_hook(self, hook):
+        """Calls hook(method, seconds, counters) after every recorded call."""
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        """Stops calling a hook added with add_hook()."""
+        self.hooks.remove(hook)
+
+    def reset(self):
+        """Forgets everything recorded so far."""
+        with self._guard:
+            self.methods = {}
+
+    def measure(self, name, function, *args, **kwargs):
+        """Calls a function and records it under a method name. A call made
+            while another one is being measured on the same thread is counted
+            as part of the outer call.
+
+        Returns:
+            the function's result.
+        """
+        if getattr(_current, 'record', None) is not None:
+            return function(*args, **kwargs)
+        record = Counter()
+        _current.record = record
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - start
+            _current.record = None
+            with self._guard:
+                if name not in self.methods:
+                    self.methods[name] = MethodStats(self.window)
+                self.methods[name].add(seconds, record)
+            for hook in self.hooks:
+                hook(name, seconds, dict(record))
+
+    def to_dict(self):
+        """Returns the recorded statistics in a JSON-friendly form.
+
+        Returns:
+            dict: for each method, its 'calls', total 'seconds', 'p50_ms',
+                'p95_ms' and 'p99_ms' latencies, each counter in COUNTERS
+                and the seconds spent in each 'phases'.
+        """
+        report = {}
+        with self._guard:
+            for name, stats in sorted(self.methods.items()):
+                p50, p95, p99 = stats.percentiles().values()
+                report[name] = {'calls': stats.calls, \
+                    'seconds': stats.seconds, 'p50_ms': p50 * 1000, \
+                    'p95_ms': p95 * 1000, 'p99_ms': p99 * 1000, \
+                    **{counter: stats.counters[counter] \
+                        for counter in self.COUNTERS}, \
+                    'phases': {key[:-len('_seconds')]: value for key, value \
+                        in stats.counters.items() if key.endswith('_seconds')}}
+        return report
+
+    def to_prometheus(self, prefix="ipod"):
+        """Returns the recorded statistics in the Prometheus text exposition
+            format, with the latencies as a summary and everything else as
+            counters labelled by method.
+
+        Args:
+            prefix (str, optional): the start of every metric name. Defaults
+                to 'ipod'.
+
+        Returns:
+            str: the metrics, one sample per line.
+        """
+        report = self.to_dict()
+        lines = [f"# HELP {prefix}_call_seconds Wall time of Playlist calls.",
+            f"# TYPE {prefix}_call_seconds summary"]
+        for name, stats in report.items():
+            for quantile, key in (('0.5', 'p50_ms'), ('0.95', 'p95_ms'), \
+                    ('0.99', 'p99_ms')):
+                lines.append(f'{prefix}_call_seconds{{method="{name}",'
+                    f'quantile="{quantile}"}} {stats[key] / 1000!r}')
+            lines.append(f'{prefix}_call_seconds_sum{{method="{name}"}} '
+                f'{stats["seconds"]!r}')
+            lines.append(f'{prefix}_call_seconds_count{{method="{name}"}} '
+                f'{stats["calls"]}')
+        for counter in self.COUNTERS:
+            lines.append(f"# TYPE {prefix}_{counter}_total counter")
+            for name, stats in report.items():
+                lines.append(f'{prefix}_{counter}_total{{method="{name}"}} '
+                    f'{stats[counter]}')
+        lines.append(f"# TYPE {prefix}_phase_seconds_total counter")
+        for name, stats in report.items():
+            for phase, seconds in sorted(stats['phases'].items()):
+                lines.append(f'{prefix}_phase_seconds_total{{method="{name}",'
+                    f'phase="{phase}"}} {seconds!r}')
+        return "\n".join(lines) + "\n"
+
+class SortedView:
+    """A materialized sort order over the catalog: the row IDs kept sorted by
+        a key, so that reading a page of songs in that order needs no sort.
+        Only the row IDs are stored, four bytes each; keys are recomputed
+        from the catalog during the binary searches.
+
+    Attributes:
+        key (function): maps a row ID to its sort key.
+        row_ids (array): the row IDs sorted by key, then by row ID.
+    """
+
+    def __init__(self, key, row_ids=()):
+        """Sorts the given rows once.
+
+        Args:
+            key (function): maps a row ID to its sort key.
+            row_ids (iterable, optional): the row IDs to sort, in increasing
+                order. Defaults to no rows.
+        """
+        self.key = key
+        self.row_ids = array('i', sorted(row_ids, key=key))
+
+    def __len__(self):
+        """Returns the number of songs in the view."""
+        return len(self.row_ids)
+
+    def _sort_key(self, row_id):
+        return (self.key(row_id), row_id)
+
+    def _bisect(self, target, key):
+        """Returns the first position whose key is not below the target, like
+            bisect_left with a key function (which needs Python 3.10)."""
+        low, high = 0, len(self.row_ids)
+        while low < high:
+            middle = (low + high) // 2
+            if key(self.row_ids[middle]) < target:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def insert(self, row_id):
+        """Inserts a song at its sorted position with a binary search."""
+        position = self._bisect(self._sort_key(row_id), self._sort_key)
+        self.row_ids.insert(position, row_id)
+
+    def remove(self, row_id):
+        """Removes a song, finding it with a binary search. The song must
+            still be in the catalog."""
+        position = self._bisect(self._sort_key(row_id), self._sort_key)
+        if position < len(self.row_ids) and self.row_ids[position] == row_id:
+            del self.row_ids[position]
+
+    def find(self, key):
+        """Returns the row IDs whose key equals the given one, in increasing
+            order."""
+        position = self._bisect(key, self.key)
+        matches = []
+        while position < len(self.row_ids) and \
+                self.key(self.row_ids[position]) == key:
+            matches.append(self.row_ids[position])
+            position += 1
+        return matches
+
+    def prefix(self, prefix, limit=10):
+        """Returns up to `limit` (key, row ID) pairs, in order, whose string
+            key starts with the given prefix."""
+        position = self._bisect(prefix, self.key)
+        matches = []
+        while position < len(self.row_ids) and len(matches) < limit:
+            key = self.key(self.row_ids[position])
+            if not key.startswith(prefix):
+                break
+            matches.append((key, self.row_ids[position]))
+            position += 1
+        return matches
+
+    def page(self, offset=0, limit=None, reverse=False):
+        """Returns a slice of the row IDs in sorted order.
+
+        Args:
+            offset (int, optional): number of songs to skip. Defaults to 0.
+            limit (int, optional): maximum number of songs to return.
+                Defaults to None (all remaining songs).
+            reverse (bool, optional): read the order from the end. Defaults
+                to False.
+
+        Returns:
+            list: the row IDs on the page.
+        """
+        stop = len(self.row_ids) if limit is None else offset + limit
+        if not reverse:
+            return self.row_ids[offset:stop].tolist()
+        end = len(self.row_ids) - offset
+        return self.row_ids[max(end - (stop - offset), 0):max(end, 0)]\
+            .tolist()[::-1]
+
+SORT_ORDERS = {
+    "Recently Added": lambda row: 0,
+    "Alphabetical": lambda row: str(row[0]),
+    "Release Year": lambda row: (row[4] is None, str(row[4] or '')),
+}
+
+def trigrams(text):
+    """Splits normalized text into the overlapping three-character pieces
+        used by the search index, padded so that short words still match.
+
+    Args:
+        text (str): normalized text.
+
+    Returns:
+        set: the trigrams of the text.
+    """
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def _intersect(row_ids, posting):
+    """Returns the row IDs of a sorted array that are also in a longer
+        sorted array, looking each one up by bisection."""
+    common = array('i')
+    position = 0
+    for row_id in row_ids:
+        position = bisect.bisect_left(posting, row_id, position)
+        if position == len(posting):
+            break
+        if posting[position] == row_id:
+            common.append(row_id)
+    return common
+
+class SearchIndex:
+    """Fuzzy search over song titles and artists.
+
+    It is an inverted index from trigrams to row IDs: the rows sharing the
+        most trigrams with the query are ranked by how similar their title or
+        artist is. Row IDs only ever grow, so each posting list is a compact
+        array kept sorted simply by appending.
+
+    Attributes:
+        postings (dict): maps each trigram to the sorted array of row IDs
+            whose title or artist contains it.
+    """
+    
+    MAX_CANDIDATES = 100
+    MAX_PROBES = 6000
+    
+    def __init__(self, rows=()):
+        """Builds the index once from the given rows.
+
+        Args:
+            rows (iterable, optional): (row ID, row) pairs, in increasing
+                row ID order. Defaults to no rows.
+        """
+        self.postings = {}
+        for row_id, row in rows:
+            self.add(row_id, row)
+    
+    def add_table(self, table):
+        """Adds every song of a SongTable to an empty index, working out the
+            trigrams of each distinct artist only once.
+
+        Args:
+            table (SongTable): the songs.
+        """
+        artists = [trigrams(artist) if artist else set() for artist in \
+            map(normalize_title, table.artists.strings)]
+        artists.append(set())
+        postings = self.postings
+        for row_id, (title, code) in enumerate(zip(table.titles, \
+                table.artist_codes)):
+            if title is _REMOVED:
+                continue
+            title = normalize_title(title)
+            for gram in (trigrams(title) | artists[code]) if title else \
+                    artists[code]:
+                posting = postings.get(gram)
+                if posting is None:
+                    posting = postings[gram] = array('i')
+                posting.append(row_id)
+    
+    @staticmethod
+    def _texts(row):
+        """Returns the distinct normalized title and artist of a row."""
+        return {normalize_title(row[0]), normalize_title(row[1] or '')} - {''}
+    
+    def add(self, row_id, row):
+        """Adds a song to the index; its row ID must be the highest yet."""
+        for gram in set().union(*map(trigrams, self._texts(row))):
+            posting = self.postings.get(gram)
+            if posting is None:
+                posting = self.postings[gram] = array('i')
+            posting.append(row_id)
+            
+    def remove(self, row_id, row):
+        """Removes a song from the index."""
+        for gram in set().union(*map(trigrams, self._texts(row))):
+            posting = self.postings[gram]
+            position = bisect.bisect_left(posting, row_id)
+            if position < len(posting) and posting[position] == row_id:
+                del posting[position]
+            if not posting:
+                del self.postings[gram]
+    
+    def fuzzy(self, query, rows, limit=5, threshold=0.3):
+        """Finds the songs whose title or artist is most similar to a query.
+
+        Args:
+            query (str): the text to look for; may contain typos.
+            rows (SongTable): the catalog rows, to score the candidates.
+            limit (int, optional): the maximum number of results. Defaults
+                to 5.
+            threshold (float, optional): the lowest similarity, between 0 and
+                1, that counts as a match. Defaults to 0.3.
+
+        Returns:
+            list: (similarity, row ID) pairs, most similar first.
+        """
+        grams = trigrams(normalize_title(query))
+        lists = sorted((self.postings[g] for g in grams \
+            if g in self.postings), key=len)
+        # Candidates start as the rows with the query's rarest trigram and
+        # are intersected with the next rarest lists until at most
+        # MAX_CANDIDATES are left or MAX_PROBES rows have been looked up. A
+        # list that would leave fewer than `limit` is skipped, as its trigram
+        # is most likely a typo. Only the first MAX_CANDIDATES left are
+        # scored.
+        if not lists:
+            return []
+        candidates = lists[0][:self.MAX_PROBES]
+        probes = 0
+        for posting in lists[1:]:
+            probes += len(candidates)
+            if len(candidates) <= self.MAX_CANDIDATES or \
+                    probes > self.MAX_PROBES:
+                break
+            common = _intersect(candidates, posting)
+            if len(common) >= limit:
+                candidates = common
+        _count('rows_scanned', len(candidates))
+        
+        scored = []
+        titles, artists = rows.titles, rows.artists
+        for row_id in candidates[:self.MAX_CANDIDATES]:
+            best = max(len(grams & other) / len(grams | other) for other in \
+                map(trigrams, self._texts((titles[row_id], \
+                    artists.decode(rows.artist_codes[row_id])))))
+            if best >= threshold:
+                scored.append((best, row_id))
+        return heapq.nlargest(limit, scored, key=lambda pair: pair[0])
+
+class Aggregates:
+    """Running totals over the catalog, updated in O(1) for every song added
+        or removed: the total duration and number of songs of each genre and
+        the number of songs by each artist.
+
+    Attributes:
+        genre_duration (Counter): total seconds of music per genre.
+        genre_version (int): incremented whenever genre_duration changes, so
+            anything derived from it, like a rendered chart, can be cached.
+        genre_count (Counter): number of songs per genre.
+        artist_count (Counter): number of songs per artist.
+    """
+    
+    def __init__(self, rows=()):
+        """Computes the totals from the given rows.
+
+        Args:
+            rows (iterable, optional): (title, artist, genre, duration,
+                release) tuples. Defaults to no rows.
+        """
+        self.genre_duration = Counter()
+        self.genre_count = Counter()
+        self.artist_count = Counter()
+        self.genre_version = 0
+        for row in rows:
+            self.add(row)
+            
+    def __eq__(self, other):
+        return isinstance(other, Aggregates) and \
+            self.to_dict() == other.to_dict()
+            
+    def add(self, row, sign=1):
+        """Adds a song to the totals, or removes it when sign is -1."""
+        genre = _name_key(row[2])
+        artist = _name_key(row[1])
+        self.genre_duration[genre] += sign * int(row[3] or 0)
+        self.genre_count[genre] += sign
+        if row[3] or self.genre_count[genre] in (0, 1):
+            self.genre_version += 1
+        self.artist_count[artist] += sign
+        if self.genre_count[genre] <= 0:
+            del self.genre_count[genre], self.genre_duration[genre]
+        if self.artist_count[artist] <= 0:
+            del self.artist_count[artist]
+            
+    def remove(self, row):
+        """Removes a song from the totals."""
+        self.add(row, sign=-1)
+
+    def add_table(self, table, start=0):
+        """Adds the songs of a SongTable from a row ID on to the totals,
+            counting codes instead of decoding every row.
+
+        Args:
+            table (SongTable): the songs; none of the rows from start on may
+                have been removed.
+            start (int, optional): the first row ID to add. Defaults to 0.
+        """
+        artists = [_name_key(artist) for artist in table.artists.strings]
+        genres = [_name_key(genre) for genre in table.genres.strings]
+        durations = Counter()
+        for genre, duration in zip(islice(table.genre_codes, start, None), \
+                islice(table.durations, start, None)):
+            if duration > 0:
+                durations[genre] += duration
+        for row_id, row in table.odd.items():
+            if row_id >= start and row[3]:
+                durations[table.genre_codes[row_id]] += int(row[3])
+        for code, count in Counter(islice(table.genre_codes, start, \
+                None)).items():
+            genre = genres[code] if code >= 0 else ''
+            self.genre_count[genre] += count
+            self.genre_duration[genre] += durations[code]
+        for code, count in Counter(islice(table.artist_codes, start, \
+                None)).items():
+            self.artist_count[artists[code] if code >= 0 else ''] += count
+        self.genre_version += 1
+        
+    def to_dict(self):
+        """Returns the totals as plain dictionaries."""
+        return {'genre_duration': dict(self.genre_duration), \
+            'genre_count': dict(self.genre_count), \
+            'artist_count': dict(self.artist_count)}
+    
+    def save(self, path):
+        """Writes the totals to a JSON file, replacing it atomically.
+
+        Args:
+            path (str): the file to write.
+        """
+        temp_path = path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f)
+            _count('bytes_written', f.tell())
+        os.replace(temp_path, path)
+        
+    @classmethod
+    def load(cls, path):
+        """Reads totals saved by save(), for example from a dashboard that
+            should not load the whole library.
+
+        Args:
+            path (str): the file to read.
+
+        Returns:
+            Aggregates: the saved totals, or None if there are none.
+        """
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        aggregates = cls()
+        for name in ('genre_duration', 'genre_count', 'artist_count'):
+            getattr(aggregates, name).update(saved.get(name, {}))
+        return aggregates
+
+# Marks the title of a row that has been removed from a SongTable.
+_REMOVED = object()
+
+@lru_cache(maxsize=None)
+def _day(ordinal):
+    """Returns the date with the given day number, one shared object per
+        day."""
+    return date.fromordinal(ordinal)
+
+@lru_cache(maxsize=65536)
+def _release_day(release):
+    """Returns the day number of a 'YYYY-MM-DD' release, or 0 if it is not
+        one. Libraries repeat release dates a lot, so each is parsed once."""
+    try:
+        day = date.fromisoformat(release).toordinal()
+    except ValueError:
+        return 0
+    return day if _day(day).isoformat() == release else 0
+
+class StringTable:
+    """Dictionary-encodes strings that repeat, like artist and genre names:
+        each distinct string is stored once and rows hold its code.
+
+    Attributes:
+        strings (list): the distinct strings, indexed by code.
+        codes (dict): maps each string to its code.
+    """
+
+    def __init__(self):
+        """Initializes the class attributes."""
+        self.strings = []
+        self.codes = {}
+
+    def encode(self, string):
+        """Returns the code of a string, adding the string if it is new, or
+            -1 for None."""
+        if string is None:
+            return -1
+        code = self.codes.get(string)
+        if code is None:
+            code = self.codes[string] = len(self.strings)
+            self.strings.append(string)
+        return code
+
+    def decode(self, code):
+        """Returns the string with the given code, or None for -1."""
+        return None if code < 0 else self.strings[code]
+
+class SongTable:
+    """Stores the catalog's songs column by column, keyed by row ID, in far
+        less memory than a tuple per song: titles are a list of strings,
+        artists and genres are int32 codes into StringTables, durations are
+        int32 seconds and release dates are int32 day numbers. A missing
+        duration is -1 and a missing release 0.
+
+    It reads like a dict from row IDs to (title, artist, genre, duration,
+        release) tuples, where release is a datetime.date. The rare song whose
+        duration or release does not fit these columns, such as a release
+        that is not a 'YYYY-MM-DD' date, is kept whole in `odd` instead.
+
+    Attributes:
+        titles (list): the title of each row, or _REMOVED.
+        artists (StringTable): the distinct artists.
+        genres (StringTable): the distinct genres.
+        artist_codes, genre_codes, durations, releases (array): the other
+            columns, as int32 arrays.
+        odd (dict): maps row IDs to the rows stored whole.
+    """
+
+    def __init__(self):
+        """Initializes the class attributes."""
+        self.titles = []
+        self.artists = StringTable()
+        self.genres = StringTable()
+        self.artist_codes = array('i')
+        self.genre_codes = array('i')
+        self.durations = array('i')
+        self.releases = array('i')
+        self.odd = {}
+        self.count = 0
+
+    def __len__(self):
+        """Returns the number of songs stored."""
+        return self.count
+
+    def __contains__(self, row_id):
+        """Tells whether a row ID holds a song."""
+        return 0 <= row_id < len(self.titles) and \
+            self.titles[row_id] is not _REMOVED
+
+    def __iter__(self):
+        """Iterates over the row IDs of the songs, in increasing order."""
+        return (row_id for row_id, title in enumerate(self.titles) \
+            if title is not _REMOVED)
+
+    def keys(self):
+        """Returns the row IDs of the songs, in increasing order."""
+        return iter(self)
+
+    def append(self, row):
+        """Stores a song under the next row ID.
+
+        Args:
+            row (tuple): the (title, artist, genre, duration, release) of the
+                song; release may be a 'YYYY-MM-DD' string or a date.
+
+        Returns:
+            int: the row ID of the song.
+        """
+        title, artist, genre, duration, release = row
+        row_id = len(self.titles)
+        day = 0
+        if isinstance(release, str):
+            day = _release_day(release)
+        elif isinstance(release, date):
+            day = release.toordinal()
+        fits = (duration is None or 0 <= duration < 2 ** 31) and \
+            (release is None or day)
+        
+        self.titles.append(title)
+        self.artist_codes.append(self.artists.encode(artist))
+        self.genre_codes.append(self.genres.encode(genre))
+        self.durations.append(duration if fits and duration is not None \
+            else -1)
+        self.releases.append(day if fits else 0)
+        if not fits:
+            self.odd[row_id] = tuple(row)
+        self.count += 1
+        return row_id
+
+    def extend(self, rows):
+        """Stores many songs under the next row IDs, as append() does, but
+            filling the columns in bulk.
+
+        Args:
+            rows (iterable): (title, artist, genre, duration, release) tuples.
+        """
+        row_id = len(self.titles)
+        titles, artist_codes, genre_codes, durations, releases = \
+            [], [], [], [], []
+        artists, genres = self.artists.codes, self.genres.codes
+        for row in rows:
+            title, artist, genre, duration, release = row
+            if release is None:
+                day = 0
+            elif isinstance(release, str):
+                day = _release_day(release)
+            elif isinstance(release, date):
+                day = release.toordinal()
+            else:
+                day = 0
+            if (duration is not None and not 0 <= duration < 2 ** 31) or \
+                    (release is not None and not day):
+                self.odd[row_id] = tuple(row)
+                duration, day = None, 0
+            titles.append(title)
+            code = artists.get(artist)
+            artist_codes.append(self.artists.encode(artist) if code is None \
+                else code)
+            code = genres.get(genre)
+            genre_codes.append(self.genres.encode(genre) if code is None \
+                else code)
+            durations.append(-1 if duration is None else duration)
+            releases.append(day)
+            row_id += 1
+        self._extend_columns(titles, artist_codes, genre_codes, durations, \
+            releases)
+
+    def extend_encoded(self, titles, artists, genres, durations, releases):
+        """Stores many songs given column by column with their artists and
+            genres already dictionary-encoded, as a columnar library keeps
+            them, so that no row has to be built or parsed.
+
+        Args:
+            titles (list): the title of each song.
+            artists, genres (tuple): a list of codes, -1 for None, and the
+                list of strings they index.
+            durations (list): seconds, -1 when unknown.
+            releases (list): day numbers, 0 when unknown.
+        """
+        start = len(self.titles)
+        columns = []
+        for table, (codes, strings) in ((self.artists, artists), \
+                (self.genres, genres)):
+            mapping = [table.encode(string) for string in strings]
+            mapping.append(-1)
+            columns.append(list(map(mapping.__getitem__, codes)))
+        if durations and max(durations) >= 2 ** 31:
+            durations = list(durations)
+            for position, duration in enumerate(durations):
+                if duration >= 2 ** 31:
+                    day = releases[position]
+                    self.odd[start + position] = (titles[position], \
+                        self.artists.decode(columns[0][position]), \
+                        self.genres.decode(columns[1][position]), \
+                        duration, _day(day) if day else None)
+                    durations[position] = -1
+        self._extend_columns(titles, columns[0], columns[1], durations, \
+            releases)
+
+    def _extend_columns(self, titles, artist_codes, genre_codes, durations, \
+            releases):
+        self.titles.extend(titles)
+        self.artist_codes.extend(artist_codes)
+        self.genre_codes.extend(genre_codes)
+        self.durations.extend(durations)
+        self.releases.extend(releases)
+        self.count += len(titles)
+
+    def __getitem__(self, row_id):
+        """Returns the (title, artist, genre, duration, release) tuple of a
+            row.
+
+        Raises:
+            KeyError: if the row ID holds no song.
+        """
+        if row_id not in self:
+            raise KeyError(row_id)
+        if self.odd and row_id in self.odd:
+            return self.odd[row_id]
+        duration = self.durations[row_id]
+        day = self.releases[row_id]
+        return (self.titles[row_id], \
+            self.artists.decode(self.artist_codes[row_id]), \
+            self.genres.decode(self.genre_codes[row_id]), \
+            None if duration < 0 else duration, _day(day) if day else None)
+
+    def items(self):
+        """Iterates over (row ID, row) pairs in increasing row ID order,
+            decoding the columns in a single pass."""
+        artists = self.artists.strings
+        genres = self.genres.strings
+        odd = self.odd
+        for row_id, (title, artist, genre, duration, day) in \
+                enumerate(zip(self.titles, self.artist_codes, \
+                    self.genre_codes, self.durations, self.releases)):
+            if title is _REMOVED:
+                continue
+            if odd and row_id in odd:
+                yield row_id, odd[row_id]
+                continue
+            yield row_id, (title, None if artist < 0 else artists[artist], \
+                None if genre < 0 else genres[genre], \
+                None if duration < 0 else duration, \
+                _day(day) if day else None)
+
+    def values(self):
+        """Iterates over the rows in increasing row ID order."""
+        return map(itemgetter(1), self.items())
+
+    def column(self, index):
+        """Returns one column of every song, in increasing row ID order.
+
+        Args:
+            index (int): the position of the column in COLUMNS.
+
+        Returns:
+            list: the decoded values.
+        """
+        if index == 0:
+            return [title for title in self.titles if title is not _REMOVED]
+        if index == 3 and not self.odd:
+            return [None if duration < 0 else duration for title, duration \
+                in zip(self.titles, self.durations) if title is not _REMOVED]
+        return [row[index] for row in self.values()]
+
+    def pop(self, row_id):
+        """Removes a song and returns its row."""
+        row = self[row_id]
+        self.titles[row_id] = _REMOVED
+        self.odd.pop(row_id, None)
+        self.count -= 1
+        return row
+
+    def memory(self):
+        """Estimates the bytes used by each part of the table.
+
+        Returns:
+            dict: bytes used by the 'titles', the int32 'columns', the
+                artist and genre 'dictionaries' and the 'odd' rows.
+        """
+        titles = sys.getsizeof(self.titles) + sum(sys.getsizeof(title) \
+            for title in self.titles if title is not _REMOVED)
+        columns = sum(sys.getsizeof(column) for column in (self.artist_codes,\
+            self.genre_codes, self.durations, self.releases))
+        dictionaries = 0
+        for table in (self.artists, self.genres):
+            dictionaries += sys.getsizeof(table.strings) + \
+                sys.getsizeof(table.codes) + \
+                sum(sys.getsizeof(string) for string in table.strings)
+        odd = sys.getsizeof(self.odd) + sum(sys.getsizeof(row) \
+            for row in self.odd.values())
+        return {'titles': titles, 'columns': columns, \
+            'dictionaries': dictionaries, 'odd': odd}
+
+class Song:
+    """A song, as a compact record with a fixed set of fields. Fields can
+        also be read by column name, like song['Title'].
+    """
+
+    __slots__ = ('title', 'artist', 'genre', 'duration', 'release')
+
+    def __init__(self, title, artist, genre, duration=None, release=None):
+        """Initializes the class attributes.
+
+        Args:
+            title (str): the title of the song.
+            artist (str): the artist of the song.
+            genre (str): the genre of the song.
+            duration (int, optional): the duration in seconds. Defaults to
+                None.
+            release (datetime.date, optional): the release date. Defaults to
+                None.
+        """
+        self.title = title
+        self.artist = artist
+        self.genre = genre
+        self.duration = duration
+        self.release = release
+
+    def __getitem__(self, column):
+        """Returns a field by its column name in COLUMNS."""
+        return getattr(self, column.lower())
+
+    def __iter__(self):
+        """Iterates over the fields in the order of COLUMNS."""
+        return iter((self.title, self.artist, self.genre, self.duration, \
+            self.release))
+
+    def __eq__(self, other):
+        return isinstance(other, Song) and tuple(self) == tuple(other)
+
+    def __repr__(self):
+        """Returns the formal representation of the song."""
+        return f"Song{tuple(self)!r}"
+
+def _to_day(value, end=False):
+    """Turns a date, a 'YYYY-MM-DD' string or a year into a day number; a year
+        means its first day, or its last when end is True.
+
+    Raises:
+        ValueError: if a string is not a 'YYYY-MM-DD' date.
+    """
+    if isinstance(value, int):
+        return date(value, 12, 31).toordinal() if end \
+            else date(value, 1, 1).toordinal()
+    if isinstance(value, str):
+        value = date.fromisoformat(value.strip())
+    return value.toordinal()
+
+class ReleaseIndex:
+    """The songs with a release date, sorted by it: two int32 arrays, the day
+        numbers in order and the row IDs alongside, so that a range of dates
+        is found with two binary searches and read as a slice.
+
+    Release dates are parsed once, when a song is added to the SongTable;
+        the index only holds its day numbers. Songs with the same release
+        date are kept in the order they were added, and songs without a
+        release date (or with one that is not a 'YYYY-MM-DD' date) are left
+        out.
+
+    Attributes:
+        days (array): the release day numbers, in increasing order.
+        row_ids (array): the row ID of the song at each position of days.
+    """
+
+    def __init__(self, rows):
+        """Sorts the songs of a SongTable by release date once.
+
+        Args:
+            rows (SongTable): the songs to index.
+        """
+        releases = rows.releases
+        row_ids = sorted((row_id for row_id, day in enumerate(releases) \
+            if day and rows.titles[row_id] is not _REMOVED), \
+                key=releases.__getitem__)
+        self.row_ids = array('i', row_ids)
+        self.days = array('i', map(releases.__getitem__, row_ids))
+
+    def __len__(self):
+        """Returns the number of songs with a release date."""
+        return len(self.days)
+
+    def add(self, row_id, day):
+        """Adds a song released on a day number. Row IDs only grow, so the
+            song goes after every song released the same day."""
+        position = bisect.bisect_right(self.days, day)
+        self.days.insert(position, day)
+        self.row_ids.insert(position, row_id)
+
+    def remove(self, row_id, day):
+        """Removes a song released on a day number."""
+        low = bisect.bisect_left(self.days, day)
+        high = bisect.bisect_right(self.days, day, low)
+        position = bisect.bisect_left(self.row_ids, row_id, low, high)
+        if position < high and self.row_ids[position] == row_id:
+            del self.days[position], self.row_ids[position]
+
+    def between(self, start=None, end=None, limit=None):
+        """Finds the songs released between two dates, both included.
+
+        Args:
+            start (date, str or int, optional): the first date, as a date,
+                a 'YYYY-MM-DD' string or a year. Defaults to None (no lower
+                bound).
+            end (date, str or int, optional): the last date, likewise; a year
+                means up to its last day. Defaults to None (no upper bound).
+            limit (int, optional): the most songs to return, oldest first.
+                Defaults to None.
+
+        Returns:
+            list: the row IDs, ordered by release date.
+        """
+        low = 0 if start is None else \
+            bisect.bisect_left(self.days, _to_day(start))
+        high = len(self.days) if end is None else \
+            bisect.bisect_right(self.days, _to_day(end, end=True), low)
+        if limit is not None:
+            high = min(high, low + limit)
+        return self.row_ids[low:high].tolist()
+
+    def newest(self, n=10):
+        """Returns the row IDs of the n most recently released songs, newest
+            first."""
+        return self.row_ids[max(len(self.row_ids) - n, 0):].tolist()[::-1]
+
+    def histogram(self, bucket="year"):
+        """Counts the songs released in each year or decade, with one binary
+            search per bucket.
+
+        Args:
+            bucket (str, optional): 'year' or 'decade'. Defaults to 'year'.
+
+        Returns:
+            dict: maps each year (or the first year of each decade) from the
+                oldest release to the newest, to its number of songs.
+
+        Raises:
+            ValueError: if bucket is not 'year' or 'decade'.
+        """
+        if bucket not in ("year", "decade"):
+            raise ValueError(f"unknown bucket '{bucket}'; use year or decade")
+        if not self.days:
+            return {}
+        step = 10 if bucket == "decade" else 1
+        first = _day(self.days[0]).year // step * step
+        last = _day(self.days[-1]).year
+        counts = {}
+        low = 0
+        for year in range(first, last + 1, step):
+            high = len(self.days) if year + step > last else bisect\
+                .bisect_left(self.days, date(year + step, 1, 1).toordinal(), \
+                    low)
+            counts[year] = high - low
+            low = high
+        return counts
+
+class Catalog:
+    """Keeps every song of a playlist in memory, keyed by a row ID, together
+        with indexes from normalized titles and artists to row IDs.
+
+    The songs are stored column by column in a SongTable and every index
+        holds int32 row IDs. Titles and artists are looked up in O(1) in
+        dicts; a title held by a single song, as most are, maps to its bare
+        row ID and only a shared title to an array of them. Only the totals are computed when the catalog
+        is built; the title and artist indexes, the sort views, including the
+        one by title used for prefix search, the search index and the release
+        index are only built the first time they are used, and then kept up
+        to date by add() and remove().
+
+    Attributes:
+        rows (SongTable): maps each row ID to a (title, artist, genre,
+            duration, release) tuple.
+        views (dict): maps each order in SORT_ORDERS that has been used to
+            its SortedView.
+        aggregates (Aggregates): per-genre and per-artist running totals.
+    """
+
+    def __init__(self, rows=(), table=None):
+        """Stores the given rows and computes their totals in bulk.
+
+        Args:
+            rows (iterable, optional): (title, artist, genre, duration,
+                release) tuples, in file order. Defaults to no rows.
+            table (SongTable, optional): songs already read into a table,
+                which the catalog takes over; the rows are added after them.
+                Defaults to a new, empty table.
+        """
+        self.rows = SongTable() if table is None else table
+        self.aggregates = Aggregates()
+        self.views = {}
+        self._titles = None
+        self._artists = None
+        self._artist_names = None
+        self._title_view = None
+        self._search = None
+        self._release_index = None
+        self.rows.extend(rows)
+        self.aggregates.add_table(self.rows)
+
+    @property
+    def titles(self):
+        """dict: maps a normalized title to its row ID, or to an array of its
+            row IDs when several songs share it, built the first time it is
+            used."""
+        if self._titles is None:
+            titles = {}
+            for row_id, (key, title) in enumerate(zip(map(normalize_title, \
+                    self.rows.titles), self.rows.titles)):
+                if title is _REMOVED:
+                    continue
+                self._index_title(titles, title if key == title else key, \
+                    row_id)
+            self._titles = titles
+        return self._titles
+
+    @staticmethod
+    def _index_title(titles, title, row_id):
+        """Adds a row ID, the highest yet, under a normalized title."""
+        row_ids = titles.get(title)
+        if row_ids is None:
+            titles[title] = row_id
+        elif isinstance(row_ids, int):
+            titles[title] = array('i', (row_ids, row_id))
+        else:
+            row_ids.append(row_id)
+
+    @property
+    def artists(self):
+        """dict: maps a normalized artist to an array of its row IDs, built
+            the first time it is used by grouping the artist codes, so each
+            distinct artist is normalized only once."""
+        if self._artists is None:
+            self._index_artists()
+        return self._artists
+
+    @property
+    def artist_names(self):
+        """list: the normalized artists in sorted order, built with the
+            artist index."""
+        if self._artist_names is None:
+            self._index_artists()
+        return self._artist_names
+
+    def _index_artists(self):
+        rows = self.rows
+        grouped = {}
+        for row_id, (code, title) in enumerate(zip(rows.artist_codes, \
+                rows.titles)):
+            if title is _REMOVED:
+                continue
+            row_ids = grouped.get(code)
+            if row_ids is None:
+                row_ids = grouped[code] = array('i')
+            row_ids.append(row_id)
+        names = [normalize_title(artist) for artist in rows.artists.strings]
+        names.append('')
+        artists = {}
+        for code, row_ids in grouped.items():
+            other = artists.get(names[code])
+            artists[names[code]] = row_ids if other is None else \
+                array('i', sorted(other + row_ids))
+        self._artists = artists
+        self._artist_names = sorted(artists)
+
+    def __len__(self):
+        """Returns the number of songs in the catalog."""
+        return len(self.rows)
+
+    def _title_key(self, row_id):
+        return normalize_title(self.rows.titles[row_id])
+
+    @property
+    def title_view(self):
+        """SortedView: the row IDs sorted by normalized title, built from the
+            title index the first time it is used."""
+        if self._title_view is None:
+            view = SortedView(self._title_key)
+            for title in sorted(self.titles):
+                view.row_ids.extend(self._title_rows(title))
+            self._title_view = view
+        return self._title_view
+
+    def view(self, order):
+        """Returns the SortedView of an order in SORT_ORDERS, sorting the
+            catalog the first time it is asked for.
+
+        Args:
+            order (str): the name of the order.
+
+        Returns:
+            SortedView: the view.
+        """
+        if order not in self.views:
+            key = SORT_ORDERS[order]
+            rows = self.rows
+            view = SortedView(lambda row_id: key(rows[row_id]))
+            view.row_ids = array('i', (row_id for _, row_id in \
+                sorted((key(row), row_id) for row_id, row in rows.items())))
+            self.views[order] = view
+        return self.views[order]
+
+    @property
+    def release_index(self):
+        """ReleaseIndex: the songs sorted by release date, built the first
+            time it is used."""
+        if self._release_index is None:
+            self._release_index = ReleaseIndex(self.rows)
+        return self._release_index
+
+    @property
+    def search(self):
+        """SearchIndex: the fuzzy search index, built the first time it is
+            used."""
+        if self._search is None:
+            search = SearchIndex()
+            search.add_table(self.rows)
+            self._search = search
+        return self._search
+
+    def add(self, row):
+        """Adds a song to the catalog and its indexes.
+
+        Args:
+            row (tuple): the (title, artist, genre, duration, release) of the
+                song.
+
+        Returns:
+            int: the row ID given to the song.
+        """
+        row_id = self.rows.append(row)
+        self.aggregates.add(row)
+        if self._titles is not None:
+            title = normalize_title(row[0])
+            self._index_title(self._titles, row[0] if title == row[0] \
+                else title, row_id)
+        if self._artists is not None:
+            artist = normalize_title(row[1] or '')
+            if artist not in self._artists:
+                self._artists[artist] = array('i')
+                bisect.insort(self._artist_names, artist)
+            self._artists[artist].append(row_id)
+        if self._title_view is not None:
+            self._title_view.insert(row_id)
+        for view in self.views.values():
+            view.insert(row_id)
+        if self._search is not None:
+            self._search.add(row_id, row)
+        if self._release_index is not None and self.rows.releases[row_id]:
+            self._release_index.add(row_id, self.rows.releases[row_id])
+        return row_id
+
+    def remove(self, row_id):
+        """Removes a song from the catalog and its indexes.
+
+        Args:
+            row_id (int): the row ID of the song.
+
+        Returns:
+            tuple: the row that was removed.
+        """
+        row = self.rows[row_id]
+        self.aggregates.remove(row)
+        if self._titles is not None:
+            title = normalize_title(row[0])
+            row_ids = self._titles[title]
+            if isinstance(row_ids, int):
+                del self._titles[title]
+            else:
+                del row_ids[bisect.bisect_left(row_ids, row_id)]
+                if len(row_ids) == 1:
+                    self._titles[title] = row_ids[0]
+        if self._artists is not None:
+            artist = normalize_title(row[1] or '')
+            row_ids = self._artists[artist]
+            del row_ids[bisect.bisect_left(row_ids, row_id)]
+            if not row_ids:
+                del self._artists[artist]
+                del self._artist_names[bisect.bisect_left(\
+                    self._artist_names, artist)]
+        if self._title_view is not None:
+            self._title_view.remove(row_id)
+        for view in self.views.values():
+            view.remove(row_id)
+        if self._search is not None:
+            self._search.remove(row_id, row)
+        if self._release_index is not None and self.rows.releases[row_id]:
+            self._release_index.remove(row_id, self.rows.releases[row_id])
+        return self.rows.pop(row_id)
+
+    def find_title(self, title):
+        """Looks up the songs with the given title.
+
+        Args:
+            title (str): the title to look for; case and quotes are ignored.
+
+        Returns:
+            list: the matching row IDs in the order the songs were added.
+        """
+        return self._title_rows(normalize_title(title))
+
+    def _title_rows(self, title):
+        """Returns the row IDs under a normalized title as a list."""
+        row_ids = self.titles.get(title, ())
+        return [row_ids] if isinstance(row_ids, int) else list(row_ids)
+
+    def find_artist(self, artist):
+        """Looks up the songs by the given artist.
+
+        Args:
+            artist (str): the artist to look for; case and quotes are ignored.
+
+        Returns:
+            list: the matching row IDs in the order the songs were added.
+        """
+        return self.artists.get(normalize_title(artist), array('i')).tolist()
+
+    def prefix(self, prefix, limit=10):
+        """Finds the titles and artists starting with a prefix.
+
+        Args:
+            prefix (str): the start of a title or artist.
+            limit (int, optional): the maximum number of results. Defaults
+                to 10.
+
+        Returns:
+            list: (normalized text, row ID) pairs in alphabetical order; an
+                artist is given with the row ID of its first song.
+        """
+        prefix = normalize_title(prefix)
+        artists = []
+        position = bisect.bisect_left(self.artist_names, prefix)
+        while position < len(self.artist_names) and len(artists) < limit:
+            artist = self.artist_names[position]
+            if not artist.startswith(prefix):
+                break
+            artists.append((artist, self.artists[artist][0]))
+            position += 1
+        return list(islice(heapq.merge(self.title_view.prefix(prefix, limit), \
+            artists), limit))
+
+    def memory_report(self):
+        """Estimates the bytes used by each part of the catalog.
+
+        Returns:
+            dict: bytes used by the parts of the SongTable (see
+                SongTable.memory), the 'title_index', the 'artist_index', the
+                sort 'views', the 'search' index, the 'release_index' and the
+                'aggregates'.
+        """
+        report = self.rows.memory()
+        report['title_index'] = sys.getsizeof(self.titles) + sum(\
+            sys.getsizeof(row_ids) for row_ids in self.titles.values()) + \
+            sum(sys.getsizeof(title) for title in self.titles \
+                if self.rows.titles[self._title_rows(title)[0]] is not title)
+        if self._title_view is not None:
+            report['title_index'] += sys.getsizeof(self._title_view.row_ids)
+        report['artist_index'] = sys.getsizeof(self.artists) + \
+            sys.getsizeof(self.artist_names) + sum(sys.getsizeof(name) + \
+                sys.getsizeof(row_ids) for name, row_ids in \
+                    self.artists.items())
+        report['views'] = sum(sys.getsizeof(view.row_ids) \
+            for view in self.views.values())
+        report['search'] = 0
+        if self._search is not None:
+            postings = self._search.postings
+            report['search'] = sys.getsizeof(postings) + sum(\
+                sys.getsizeof(gram) + sys.getsizeof(row_ids) \
+                for gram, row_ids in postings.items())
+        report['release_index'] = 0 if self._release_index is None else \
+            sys.getsizeof(self._release_index.days) + \
+                sys.getsizeof(self._release_index.row_ids)
+        report['aggregates'] = sum(sys.getsizeof(counter) for counter in \
+            (self.aggregates.genre_duration, self.aggregates.genre_count, \
+                self.aggregates.artist_count))
+        return report
+
+class ShuffleEngine:
+    """Shuffles a catalog's row IDs lazily, one song at a time.
+
+    Each pass over the catalog is an incremental Fisher–Yates shuffle of the
+        row IDs that have not been drawn yet: a draw picks a random position
+        among them and swaps the last one into its place. Positions start
+        out as their own row ID and only the swapped ones are remembered, in
+        a dict, so the next song costs O(1) and nothing is materialized up
+        front; once an eighth of a pass has been drawn the positions left
+        are packed into an int32 array instead. When a pass runs out the
+        next one starts, so the engine never stops while the catalog has
+        songs.
+
+    Songs uploaded during a pass join the songs left to draw, and deleted
+        ones are dropped when they are drawn, so changes never reshuffle the
+        catalog. If the catalog is replaced, for example after another
+        process changed the playlist, reset() starts over on the new one.
+
+    With weights, songs are drawn with replacement instead of in passes: a
+        random row ID is accepted with probability weight / the largest
+        weight and otherwise drawn again, so in the long run every song
+        plays in proportion to the weight of its genre or artist; a weight
+        of 0 leaves a genre or artist out. Draws stay O(1) on average, and
+        fall back to one weighted choice over the whole catalog if too many
+        are rejected in a row. With a window, songs among the last `window`
+        played are drawn again as well, so a song does not come back soon
+        after it played, even across passes.
+
+    Attributes:
+        catalog (Catalog): the catalog being shuffled.
+        rng (random.Random): the random number generator.
+        weights (dict): maps normalized genres or artists to their weight;
+            the others weigh 1.
+        by (str): 'genre' or 'artist', what the weights apply to.
+        window (int): how many of the last songs played may not repeat.
+        recent (deque): the row IDs of the last songs played.
+        passes (int): the number of passes started; weighted draws do not
+            use passes.
+    """
+
+    WEIGHTED_TRIES = 256
+
+    def __init__(self, catalog, seed=None, weights=None, by="genre", \
+            window=0):
+        """Initializes the class attributes and starts the first pass.
+
+        Args:
+            catalog (Catalog): the catalog to shuffle.
+            seed (int, optional): seeds the shuffle, so that the same seed
+                gives the same songs in the same order. Defaults to None.
+            weights (dict, optional): maps genres or artists to how often
+                their songs play, relative to the others; case and quotes
+                are ignored. Defaults to None (a plain shuffle, where every
+                song plays once per pass).
+            by (str, optional): 'genre' or 'artist'. Defaults to 'genre'.
+            window (int, optional): how many of the last songs played may
+                not repeat. Defaults to 0.
+
+        Raises:
+            ValueError: if by is not 'genre' or 'artist', or a weight is
+                negative.
+        """
+        if by not in ("genre", "artist"):
+            raise ValueError(f"cannot weight by '{by}'; use genre or artist")
+        self.weights = {normalize_title(name): float(weight) \
+            for name, weight in (weights or {}).items()}
+        if any(weight < 0 for weight in self.weights.values()):
+            raise ValueError("weights cannot be negative")
+        self.rng = Random(seed)
+        self.by = by
+        self.window = window
+        self._top = max([1.0] + list(self.weights.values()))
+        self.passes = 0
+        self.reset(catalog)
+
+    def reset(self, catalog=None):
+        """Starts a new pass, over a new catalog if one is given, forgetting
+            the songs played recently.
+
+        Args:
+            catalog (Catalog, optional): the catalog to shuffle from now on.
+                Defaults to the current one.
+        """
+        self.catalog = catalog or self.catalog
+        self.recent = deque()
+        self._recent = Counter()
+        self._weight_cache = {}
+        self._new_pass()
+
+    def _new_pass(self):
+        self._seen = self._remaining = len(self.catalog.rows.titles)
+        self._swaps = {}
+        self._pool = None
+        self._drawn = 0
+        self.passes += 1
+
+    def _sync(self):
+        """Adds the songs uploaded since the last draw to this pass."""
+        titles = self.catalog.rows.titles
+        for row_id in range(self._seen, len(titles)):
+            if self._pool is not None:
+                self._pool.append(row_id)
+            else:
+                self._swaps[self._remaining] = row_id
+            self._remaining += 1
+        self._seen = len(titles)
+
+    def _take(self, position):
+        """Removes the row ID at a position from this pass, moving the last
+            one into its place, and returns it."""
+        last = self._remaining - 1
+        if self._pool is not None:
+            row_id = self._pool[position]
+            self._pool[position] = self._pool[last]
+            self._pool.pop()
+        else:
+            row_id = self._swaps.get(position, position)
+            moved = self._swaps.pop(last, last)
+            if position != last:
+                self._swaps[position] = moved
+            if len(self._swaps) * 8 > last:
+                swaps = self._swaps
+                self._pool = array('i', (swaps.get(i, i) for i in range(last)))
+                self._swaps = {}
+        self._remaining = last
+        return row_id
+
+    def _weight(self, row_id):
+        """Returns the weight of a song's genre or artist."""
+        rows = self.catalog.rows
+        codes = rows.genre_codes if self.by == "genre" else rows.artist_codes
+        code = codes[row_id]
+        if code not in self._weight_cache:
+            table = rows.genres if self.by == "genre" else rows.artists
+            self._weight_cache[code] = self.weights.get(\
+                normalize_title(table.decode(code) or ''), 1.0)
+        return self._weight_cache[code]
+
+    def __iter__(self):
+        """Returns the engine itself, which yields row IDs forever."""
+        return self
+
+    def __next__(self):
+        """Draws the next song.
+
+        Returns:
+            int: the row ID of the song.
+
+        Raises:
+            StopIteration: if the catalog has no song that can be played.
+        """
+        rows = self.catalog.rows
+        window = min(self.window, len(rows) - 1)
+        while len(self.recent) > max(window, 0):
+            row_id = self.recent.popleft()
+            self._recent[row_id] -= 1
+            if not self._recent[row_id]:
+                del self._recent[row_id]
+        row_id = self._draw_weighted() if self.weights else self._draw()
+        if window > 0:
+            self.recent.append(row_id)
+            self._recent[row_id] += 1
+        return row_id
+
+    def _draw(self):
+        """Draws the next song of the current pass, starting a new pass when
+            it runs out."""
+        rows = self.catalog.rows
+        self._sync()
+        patience = 32 + self._remaining
+        while True:
+            if not self._remaining:
+                if not self._drawn:
+                    raise StopIteration
+                self._new_pass()
+            position = self.rng.randrange(self._remaining)
+            row_id = self._pool[position] if self._pool is not None \
+                else self._swaps.get(position, position)
+            if row_id not in rows:
+                self._take(position)
+                continue
+            if row_id in self._recent and patience > 0:
+                patience -= 1
+                continue
+            self._take(position)
+            self._drawn += 1
+            return row_id
+
+    def _draw_weighted(self):
+        """Draws a song with replacement, in proportion to its weight."""
+        rows = self.catalog.rows
+        slots = len(rows.titles)
+        for _ in range(self.WEIGHTED_TRIES if slots else 0):
+            row_id = self.rng.randrange(slots)
+            if row_id not in rows or row_id in self._recent:
+                continue
+            if self.rng.random() * self._top < self._weight(row_id):
+                return row_id
+        candidates = [row_id for row_id in rows if self._weight(row_id)]
+        fresh = [row_id for row_id in candidates \
+            if row_id not in self._recent]
+        if not candidates:
+            raise StopIteration
+        candidates = fresh or candidates
+        return self.rng.choices(candidates, \
+            [self._weight(row_id) for row_id in candidates])[0]
+
+class PlayHistory:
+    """Remembers every song played: an append-only log of play events, plus
+        rollups of the listening time per genre and artist by hour, by day
+        and in total.
+
+    A play event is (time, seconds, title, artist, genre); a skip adds an
+        event with negative seconds for the part that was not heard.
+        Recording an event only updates the in-memory rollups and buffers the
+        event; buffered events are appended to the log FLUSH_EVENTS at a time
+        or by flush(). Once the log grows past COMPACT_BYTES it is compacted:
+        the whole log is folded into the rollups saved in a JSON file next to
+        it, and replaced by an empty log of the next generation. Hourly
+        rollups are kept for HOURLY_RETENTION hours and daily ones for
+        DAILY_RETENTION days.
+
+    The log starts with its generation number and the rollup file records
+        the last generation folded into it, so a log is never counted twice
+        and no event is dropped, whatever its timestamp. The log is read up
+        to a byte offset; flush() and refresh() read on from there, so the
+        events other processes flushed are added to the rollups too.
+
+    Attributes:
+        log_path (str): the log of events not yet compacted.
+        rollup_path (str): the JSON file of compacted rollups.
+        hourly (dict): maps an hour number (hours since the epoch) to a
+            [genre seconds, artist seconds, plays] bucket.
+        daily (dict): maps a day number (date.toordinal) to a bucket.
+        totals (list): a bucket over all time.
+        version (int): incremented for every event, so that anything
+            derived from the rollups can be cached.
+    """
+
+    FLUSH_EVENTS = 1000
+    COMPACT_BYTES = 2 ** 23
+    HOURLY_RETENTION = 7 * 24
+    DAILY_RETENTION = 366
+
+    def __init__(self, log_path, rollup_path, file_lock=None):
+        """Loads the saved rollups and replays the log on top of them.
+
+        Args:
+            log_path (str): the log file; it is created if needed.
+            rollup_path (str): the rollup file; it is created if needed.
+            file_lock (FileLock, optional): held while the files are read
+                and written, so that processes sharing them do not lose
+                events. Defaults to None.
+        """
+        self.log_path = log_path
+        self.rollup_path = rollup_path
+        self.version = 0
+        self._file_lock = file_lock
+        self._lock = threading.Lock()
+        self._io_lock = threading.RLock()
+        self._buffer = []
+        self._hour_day = (None, None)
+        with self._hold(shared=True), self._lock:
+            self._load()
+
+    def _reset(self):
+        """Empties the rollups."""
+        self.hourly = {}
+        self.daily = {}
+        self.totals = [Counter(), Counter(), 0]
+
+    def _load(self):
+        """Reads the rollup file and then the log, if it was not folded into
+            the rollups yet, followed by the events still buffered."""
+        self._reset()
+        try:
+            with open(self.rollup_path, "r", encoding="utf-8") as f:
+                saved = json.load(f)
+        except (FileNotFoundError, ValueError):
+            saved = {}
+        for name in ('hourly', 'daily'):
+            getattr(self, name).update((int(key), [Counter(genres), \
+                Counter(artists), plays]) for key, (genres, artists, plays) \
+                    in saved.get(name, {}).items())
+        genres, artists, plays = saved.get('totals', ({}, {}, 0))
+        self.totals = [Counter(genres), Counter(artists), plays]
+        self._generation = saved.get('generation', 0) + 1
+        self._offset = 0
+        generation = self._read_log()
+        if generation is not None and generation > self._generation:
+            # Nothing folded this log yet, whatever its generation.
+            self._generation = generation
+            self._read_log()
+        for event in self._buffer:
+            self._apply(*event)
+
+    def _read_log(self):
+        """Adds the events appended to the log since it was last read to the
+            rollups.
+
+        Returns:
+            int: the log's generation, or None if it is missing or empty. A
+                generation below the current one belongs to a log that was
+                already folded into the rollups, and one above it to a log
+                started by another process's compaction; neither is read.
+        """
+        try:
+            with open(self.log_path, "rb") as f:
+                header = f.readline().decode("utf-8", "replace").split(",")
+                if len(header) != 2 or header[0] != "generation":
+                    return None
+                generation = int(header[1])
+                if generation != self._generation:
+                    return generation
+                f.seek(max(self._offset, f.tell()))
+                start = f.tell()
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        data = data[:data.rfind(b"\n") + 1]
+        self._offset = start + len(data)
+        _count('bytes_read', len(data))
+        for fields in csv.reader(io.StringIO(data.decode("utf-8"), \
+                newline="")):
+            if len(fields) == 5:
+                self._apply(float(fields[0]), int(fields[1]), *fields[2:])
+        return generation
+
+    def _catch_up(self):
+        """Adds the events other processes flushed to the rollups, reloading
+            them from the files if the log was compacted meanwhile. The file
+            lock and the lock on the rollups must be held.
+
+        Returns:
+            bool: True if the log is the current generation's, and False if
+                it is missing, empty or left over from a compaction.
+        """
+        generation = self._read_log()
+        if generation is not None and generation > self._generation:
+            self._load()
+            generation = self._read_log()
+        return generation == self._generation
+
+    def _bucket(self, buckets, key, retention):
+        """Returns the bucket of an hour or day, starting it (and dropping
+            buckets older than the retention) if it is new."""
+        bucket = buckets.get(key)
+        if bucket is None:
+            for old in [old for old in buckets if old <= key - retention]:
+                del buckets[old]
+            bucket = buckets[key] = [Counter(), Counter(), 0]
+        return bucket
+
+    def _apply(self, at, seconds, title, artist, genre):
+        """Adds one event to the rollups."""
+        hour = int(at // 3600)
+        if self._hour_day[0] != hour:
+            self._hour_day = (hour, date.fromtimestamp(at).toordinal())
+        play = seconds > 0
+        for bucket in (self._bucket(self.hourly, hour, self.HOURLY_RETENTION),\
+                self._bucket(self.daily, self._hour_day[1], \
+                    self.DAILY_RETENTION), self.totals):
+            bucket[0][genre] += seconds
+            bucket[1][artist] += seconds
+            bucket[2] += play
+        self.version += 1
+
+    def record(self, title, artist, genre, seconds, at=None):
+        """Records a play event.
+
+        Args:
+            title (str): the title of the song.
+            artist (str): the artist of the song.
+            genre (str): the genre of the song.
+            seconds (int): the seconds listened; negative to take back time
+                counted for a song that was skipped.
+            at (float, optional): when it happened, as a Unix timestamp.
+                Defaults to now.
+        """
+        at = time.time() if at is None else at
+        event = (at, int(seconds), title or '', _name_key(artist), \
+            _name_key(genre))
+        with self._lock:
+            self._apply(*event)
+            self._buffer.append(event)
+            full = len(self._buffer) >= self.FLUSH_EVENTS
+        if full:
+            self.flush()
+
+    def _hold(self, shared=False):
+        """Returns a context manager that holds the file lock, if any."""
+        return self._file_lock.hold(shared) if self._file_lock is not None \
+            else nullcontext()
+
+    def refresh(self):
+        """Adds the events other processes have flushed since the log was
+            last read to the rollups."""
+        with self._io_lock, self._hold(shared=True), self._lock:
+            self._catch_up()
+
+    def flush(self):
+        """Appends the buffered events to the log, after reading the events
+            other processes appended, and compacts it once it has grown past
+            COMPACT_BYTES.
+
+        Side effects:
+            writes to the log and, when compacting, the rollup file.
+        """
+        with self._io_lock:
+            if not self._buffer:
+                return
+            with self._hold():
+                with self._lock:
+                    current = self._catch_up()
+                    events, self._buffer = self._buffer, []
+                # A log left over from a compaction was already folded into
+                # the rollups, so it is started afresh.
+                with open(self.log_path, "a" if current else "w", \
+                        newline="", encoding="utf-8") as f:
+                    start = f.tell()
+                    writer = csv.writer(f)
+                    if not current:
+                        writer.writerow(("generation", self._generation))
+                    writer.writerows((f"{event[0]:.6f}",) + event[1:] \
+                        for event in events)
+                    size = self._offset = f.tell()
+                    _count('bytes_written', size - start)
+                if size >= self.COMPACT_BYTES:
+                    self.compact()
+
+    def compact(self):
+        """Folds the whole log into the rollup file and starts the log of the
+            next generation. The rollups are rebuilt from the files first, so
+            events logged by other processes are kept too.
+
+        Side effects:
+            rewrites the rollup file and empties the log.
+        """
+        with self._io_lock:
+            self.flush()
+            with self._hold(), self._lock:
+                self._buffer, buffered = [], self._buffer
+                self._load()
+                saved = {'generation': self._generation, \
+                    'totals': self.totals, 'hourly': self.hourly, \
+                    'daily': self.daily}
+                temp_path = self.rollup_path + ".tmp"
+                with open(temp_path, "w", encoding="utf-8") as f:
+                    f.write(json.dumps(saved))
+                    _count('bytes_written', f.tell())
+                os.replace(temp_path, self.rollup_path)
+                self._generation += 1
+                with open(temp_path, "w", newline="", encoding="utf-8") as f:
+                    csv.writer(f).writerow(("generation", self._generation))
+                    self._offset = f.tell()
+                os.replace(temp_path, self.log_path)
+                # Events recorded while compacting are still buffered.
+                self._buffer = buffered
+                for event in buffered:
+                    self._apply(*event)
+
+    def summary(self, days=7, hours=None, top=5, now=None):
+        """Adds up the listening time of the last days or hours from the
+            rollups.
+
+        Args:
+            days (int, optional): the number of days, today included.
+                Defaults to 7.
+            hours (int, optional): the number of hours, this one included,
+                to use instead of days. Defaults to None.
+            top (int, optional): the number of top artists. Defaults to 5.
+            now (float, optional): the Unix timestamp to count back from.
+                Defaults to now.
+
+        Returns:
+            dict: the 'seconds' listened, the number of 'plays', the seconds
+                per genre ('genres') and the 'top_artists' as (artist,
+                seconds) pairs.
+        """
+        self.refresh()
+        now = time.time() if now is None else now
+        if hours is not None:
+            buckets, last, count = self.hourly, int(now // 3600), hours
+        else:
+            buckets, count = self.daily, days
+            last = date.fromtimestamp(now).toordinal()
+        genres, artists, plays = Counter(), Counter(), 0
+        with self._lock:
+            for key in range(last - count + 1, last + 1):
+                if key in buckets:
+                    genres.update(buckets[key][0])
+                    artists.update(buckets[key][1])
+                    plays += buckets[key][2]
+        return {'seconds': sum(genres.values()), 'plays': plays, \
+            'genres': dict(+genres), 'top_artists': (+artists).most_common(top)}
+
+def _append_csv(path, chunks):
+    """Appends chunks of rows to the end of a CSV file, opening it and forcing
+        it to disk only once.
+
+    Args:
+        path (str): the CSV file to append to.
+        chunks (iterable): lists of (title, artist, genre, duration, release)
+            tuples.
+    """
+    needs_newline = False
+    if os.path.exists(path):
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell():
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != b"\n"
+    with open(path, "a", newline="", encoding="utf-8") as f:
+        if needs_newline:
+            f.write("\r\n")
+        start = f.tell()
+        writer = csv.writer(f)
+        for rows in chunks:
+            writer.writerows(rows)
+        f.flush()
+        os.fsync(f.fileno())
+        _count('bytes_written', f.tell() - start)
+
+def _parse_row(fields):
+    """Turns the text fields of a CSV row into a (title, artist, genre,
+        duration, release) tuple, with the duration as an int and empty
+        values as None."""
+    if len(fields) != len(COLUMNS):
+        fields = (list(fields) + [''] * len(COLUMNS))[:len(COLUMNS)]
+    title, artist, genre, duration, release = fields
+    duration = duration.strip()
+    return (title, artist, genre, \
+        int(duration) if duration.isdigit() else None, release or None)
+
+def _stat_signature(path):
+    """Returns the inode, size and modification time of a file, or None if it
+        does not exist."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+class FileWatcher:
+    """Watches a playlist for changes with Linux inotify, so that a Playlist
+        only needs to check the file after something has touched it.
+
+    The directory holding the playlist is watched (a rewrite replaces the
+        file, which would end a watch on the file itself), along with the
+        playlist itself when it is a directory; that watch is renewed when
+        the directory is replaced. Events are read by a daemon thread. An
+        event sets the changed flag when it is on the playlist's own name
+        (or a name matching it, for a sharded library's pattern), on an
+        SQLite database's '-wal' or '-journal' file, or inside the playlist's
+        directory, unless it is on one of the playlist's sidecar files, such
+        as its lock or play log. close() stops the thread and releases the
+        inotify descriptor.
+    """
+    
+    MASK = 0x2 | 0x8 | 0x80 | 0x100 | 0x200 # modify, close write, moves,
+                                             # create and delete
+    
+    def __init__(self, path, sidecars=()):
+        """Starts watching. Raises OSError where inotify is not available.
+
+        Args:
+            path (str): the playlist path.
+            sidecars (iterable, optional): the paths of files kept with the
+                playlist whose changes, and those of their '.tmp' files, are
+                ignored. Defaults to none.
+        """
+        import ctypes
+        import select
+        import struct
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        if not hasattr(self._libc, "inotify_init1"):
+            raise OSError("inotify is not available on this platform")
+        self._fd = self._libc.inotify_init1(os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        
+        path = os.path.abspath(path).rstrip(os.sep)
+        self.path = path
+        self.name = os.path.basename(path)
+        self.names = {self.name, f"{self.name}-wal", f"{self.name}-journal"}
+        self.sidecars = {os.path.basename(sidecar) for sidecar in sidecars}
+        self.sidecars |= {f"{name}.tmp" for name in self.sidecars}
+        self._libc.inotify_add_watch(self._fd, \
+            os.fsencode(os.path.dirname(path)), self.MASK)
+        self._inside = self._libc.inotify_add_watch(self._fd, \
+            os.fsencode(path), self.MASK) if os.path.isdir(path) else None
+        self.changed = True
+        self._struct = struct
+        self._select = select
+        # Writing to the pipe wakes the thread up when the watcher is closed.
+        self._wake, self._waker = os.pipe()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+    
+    def _run(self):
+        header = self._struct.Struct("iIII")
+        try:
+            while True:
+                ready = self._select.select([self._fd, self._wake], [], [])[0]
+                if self._wake in ready:
+                    return
+                data = os.read(self._fd, 4096)
+                offset = 0
+                while offset < len(data):
+                    wd, mask, cookie, length = header.unpack_from(data, \
+                        offset)
+                    name = data[offset + header.size:offset + header.size + \
+                        length].rstrip(b"\0").decode(errors="replace")
+                    offset += header.size + length
+                    if name in self.sidecars:
+                        continue
+                    if wd == self._inside:
+                        self.changed = True
+                    elif name in self.names or (('*' in self.name or \
+                            '?' in self.name) and \
+                            fnmatchcase(name, self.name)):
+                        self.changed = True
+                        if self._inside is not None:
+                            self._inside = self._libc.inotify_add_watch(\
+                                self._fd, os.fsencode(self.path), self.MASK)
+        except OSError:
+            return
+        finally:
+            os.close(self._fd)
+            os.close(self._wake)
+    
+    def close(self):
+        """Stops watching: ends the thread and closes the inotify descriptor.
+            Closing a watcher twice does nothing."""
+        if self._waker is None:
+            return
+        os.write(self._waker, b"\0")
+        os.close(self._waker)
+        self._waker = None
+        self._thread.join()
+        self.changed = True
+    
+    def consume(self):
+        """Returns whether anything changed since the last call, and resets
+            the flag."""
+        changed, self.changed = self.changed, False
+        return changed
+
+class CSVStorage:
+    """Stores a playlist as a CSV file with a header row, the layout of
+        songs.csv.
+    """
+    
+    def __init__(self, path):
+        """Initializes the class attributes.
+
+        Args:
+            path (str): path to the CSV file.
+        """
+        self.path = path
+        
+    def load(self):
+        """Reads the whole playlist.
+
+        Returns:
+            pandas.DataFrame: DataFrame containing the loaded data.
+        """
+        import pandas as pd
+        return pd.read_csv(self.path)
+    
+    def sidecar(self, name):
+        """Returns the path of a file kept next to the playlist, such as its
+            saved statistics.
+
+        Args:
+            name (str): the name of the file, for example 'stats.json'.
+
+        Returns:
+            str: the path of the file.
+        """
+        return f"{self.path}.{name}"
+    
+    def signature(self):
+        """Identifies the current version of the file, so that a change made
+            by another program can be noticed without reading it.
+
+        Returns:
+            tuple: the file's inode, size and modification time, or None if
+                it does not exist.
+        """
+        return _stat_signature(self.path)
+    
+    def iter_chunks(self, chunksize=10000):
+        """Reads the playlist a chunk at a time with a CSV parser.
+
+        Args:
+            chunksize (int, optional): the number of rows per chunk. Defaults
+                to 10000.
+
+        Yields:
+            list: the next (title, artist, genre, duration, release) tuples.
+        """
+        with open(self.path, "r", newline="", encoding="utf-8") as f:
+            _count('bytes_read', os.fstat(f.fileno()).st_size)
+            reader = csv.reader(f)
+            next(reader, None)
+            while True:
+                rows = [_parse_row(fields) \
+                    for fields in islice(reader, chunksize) if fields]
+                if not rows:
+                    break
+                _count('rows_scanned', len(rows))
+                yield rows
+    
+    def append(self, chunks):
+        """Appends chunks of rows to the end of the file.
+
+        Args:
+            chunks (iterable): lists of (title, artist, genre, duration,
+                release) tuples.
+        """
+        _append_csv(self.path, chunks)
+        
+    def rewrite(self, rows):
+        """Replaces the whole playlist, writing to a temporary file first so
+            that a crash cannot leave a half-written playlist behind.
+
+        Args:
+            rows (iterable): the (title, artist, genre, duration, release)
+                tuples to store.
+        """
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(COLUMNS)
+            writer.writerows(rows)
+            f.flush()
+            os.fsync(f.fileno())
+            _count('bytes_written', f.tell())
+        os.replace(temp_path, self.path)
+
+class ColumnarStorage:
+    """Stores a playlist as a directory of memory-mapped NumPy columns.
+
+    Every column is kept in its own `.npy` file: Duration as int64 seconds
+        (-1 when unknown), Release as datetime64[D] (NaT when unknown), and
+        Title, Artist and Genre as int32 codes into a string table (a UTF-8
+        blob plus an array of offsets), so repeated artists and genres are
+        stored once. The arrays are opened with mmap_mode='r', so only the
+        pages that are used are read from disk. Uploads are appended to a
+        small `journal.csv` in the same directory until compact() folds them
+        into the columns.
+    """
+    
+    SUFFIX = ".ipodlib"
+    
+    def __init__(self, path):
+        """Initializes the class attributes.
+
+        Args:
+            path (str): path to the library directory.
+        """
+        self.path = path
+        self.journal = os.path.join(path, "journal.csv")
+        self._tables = {}
+        
+    def _file(self, name):
+        return os.path.join(self.path, name)
+    
+    def sidecar(self, name):
+        """Returns the path of a file kept inside the library directory. It
+            is replaced along with the columns on every rewrite, so files
+            that must outlive one, like the saved statistics, belong next to
+            the directory instead (see Playlist._sidecar_path).
+
+        Args:
+            name (str): the name of the file.
+
+        Returns:
+            str: the path of the file.
+        """
+        return self._file(name)
+    
+    def signature(self):
+        """Identifies the current version of the library from its duration
+            column, which is replaced on every rewrite, and its journal.
+
+        Returns:
+            tuple: the inode, size and modification time of both files.
+        """
+        return (_stat_signature(self._file("Duration.npy")), \
+            _stat_signature(self.journal))
+    
+    def _strings(self, column):
+        """Memory-maps a string column and decodes its string table. The
+            decoded table is kept, with the signature of its file, until a
+            rewrite replaces it, so reading the library chunk by chunk
+            decodes every table only once.
+
+        Returns:
+            tuple: the int32 codes and a NumPy array of the distinct strings.
+        """
+        import numpy as np
+        codes = np.load(self._file(f"{column}.codes.npy"), mmap_mode='r')
+        path = self._file(f"{column}.strings")
+        signature = _stat_signature(path)
+        cached = self._tables.get(column)
+        if cached is None or cached[0] != signature:
+            bounds = np.load(self._file(f"{column}.offsets.npy")).tolist()
+            with open(path, "rb") as f:
+                blob = f.read()
+            _count('bytes_read', len(blob) + 8 * len(bounds))
+            strings = np.array([blob[start:stop].decode("utf-8") \
+                for start, stop in zip(bounds, bounds[1:])], dtype=object)
+            cached = self._tables[column] = (signature, strings)
+        return codes, cached[1]
+    
+    def _columns(self, start=0, stop=None):
+        """Returns a slice of every column as plain Python values."""
+        import numpy as np
+        columns = []
+        for column in ['Title', 'Artist', 'Genre']:
+            codes, strings = self._strings(column)
+            codes = np.asarray(codes[start:stop])
+            _count('bytes_read', codes.nbytes)
+            values = strings[np.where(codes < 0, 0, codes)] if len(strings) \
+                else np.full(len(codes), None, dtype=object)
+            values[codes < 0] = None
+            columns.append(values)
+        duration = np.load(self._file("Duration.npy"), mmap_mode='r')
+        duration = np.asarray(duration[start:stop])
+        _count('bytes_read', duration.nbytes)
+        columns.append(np.where(duration < 0, None, duration.astype(object)))
+        release = np.load(self._file("Release.npy"), mmap_mode='r')
+        release = np.asarray(release[start:stop])
+        _count('bytes_read', release.nbytes)
+        release = np.datetime_as_string(release).astype(object)
+        release[release == 'NaT'] = None
+        columns.append(release)
+        return columns
+    
+    def _journal_rows(self):
+        if not os.path.exists(self.journal):
+            return []
+        with open(self.journal, "r", newline="", encoding="utf-8") as f:
+            _count('bytes_read', os.fstat(f.fileno()).st_size)
+            return [_parse_row(fields) for fields in csv.reader(f) if fields]
+        
+    def __len__(self):
+        import numpy as np
+        return len(np.load(self._file("Duration.npy"), mmap_mode='r'))
+        
+    def load(self):
+        """Reads the whole playlist from the memory-mapped columns.
+
+        Returns:
+            pandas.DataFrame: DataFrame containing the loaded data.
+        """
+        import pandas as pd
+        data = pd.DataFrame(dict(zip(COLUMNS, self._columns())))
+        data['Duration'] = data['Duration'].astype('Int64')
+        journal = self._journal_rows()
+        if journal:
+            journal = pd.DataFrame(journal, columns=COLUMNS)
+            journal['Duration'] = journal['Duration'].astype('Int64')
+            data = pd.concat([data, journal], ignore_index=True)
+        return data
+    
+    def iter_chunks(self, chunksize=10000):
+        """Reads the playlist a chunk at a time, touching only the pages of
+            the columns that hold that chunk.
+
+        Args:
+            chunksize (int, optional): the number of rows per chunk. Defaults
+                to 10000.
+
+        Yields:
+            list: the next (title, artist, genre, duration, release) tuples.
+        """
+        for start in range(0, len(self), chunksize):
+            rows = list(zip(*self._columns(start, start + chunksize)))
+            _count('rows_scanned', len(rows))
+            yield rows
+        journal = self._journal_rows()
+        _count('rows_scanned', len(journal))
+        for start in range(0, len(journal), chunksize):
+            yield journal[start:start + chunksize]
+    
+    def fill(self, table, chunksize=100000):
+        """Reads the playlist into a SongTable straight from the memory-mapped
+            code and integer columns, a chunk at a time, without building a
+            tuple per song or decoding the artist and genre of every row.
+
+        Args:
+            table (SongTable): the table to add the songs to.
+            chunksize (int, optional): the number of rows per chunk. Defaults
+                to 100000.
+        """
+        import numpy as np
+        tables = {column: self._strings(column) \
+            for column in ['Title', 'Artist', 'Genre']}
+        strings = {column: strings.tolist() \
+            for column, (_, strings) in tables.items() if column != 'Title'}
+        titles = np.append(tables['Title'][1], None)
+        duration = np.load(self._file("Duration.npy"), mmap_mode='r')
+        release = np.load(self._file("Release.npy"), mmap_mode='r')
+        for start in range(0, len(duration), chunksize):
+            stop = start + chunksize
+            codes = {column: np.asarray(codes[start:stop]) \
+                for column, (codes, _) in tables.items()}
+            durations = np.asarray(duration[start:stop])
+            days = np.asarray(release[start:stop])
+            _count('bytes_read', durations.nbytes + days.nbytes + \
+                sum(column.nbytes for column in codes.values()))
+            days = np.where(np.isnat(days), 0, \
+                days.astype(np.int64) + date(1970, 1, 1).toordinal())
+            table.extend_encoded(titles[codes['Title']].tolist(), \
+                (codes['Artist'].tolist(), strings['Artist']), \
+                (codes['Genre'].tolist(), strings['Genre']), \
+                np.where(durations < 0, -1, durations).tolist(), \
+                days.tolist())
+            _count('rows_scanned', len(durations))
+        table.extend(self._journal_rows())
+    
+    def append(self, chunks):
+        """Appends chunks of rows to the journal.
+
+        Args:
+            chunks (iterable): lists of (title, artist, genre, duration,
+                release) tuples.
+        """
+        _append_csv(self.journal, chunks)
+        
+    def rewrite(self, rows):
+        """Replaces the whole library. The new columns are written to a
+            temporary directory which is then swapped in, and the journal is
+            emptied.
+
+        Args:
+            rows (iterable): the (title, artist, genre, duration, release)
+                tuples to store.
+        """
+        import numpy as np
+        import pandas as pd
+        data = pd.DataFrame(list(rows), columns=COLUMNS)
+        temp_path = self.path.rstrip(os.sep) + ".tmp"
+        old_path = self.path.rstrip(os.sep) + ".old"
+        shutil.rmtree(temp_path, ignore_errors=True)
+        os.makedirs(temp_path)
+        
+        for column in ['Title', 'Artist', 'Genre']:
+            codes, strings = pd.factorize(data[column])
+            encoded = [str(s).encode("utf-8") for s in strings]
+            offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(b) for b in encoded])
+            np.save(os.path.join(temp_path, f"{column}.codes.npy"), \
+                codes.astype(np.int32))
+            np.save(os.path.join(temp_path, f"{column}.offsets.npy"), offsets)
+            with open(os.path.join(temp_path, f"{column}.strings"), "wb") as f:
+                f.write(b"".join(encoded))
+        duration = pd.to_numeric(data['Duration'], errors='coerce')
+        np.save(os.path.join(temp_path, "Duration.npy"), \
+            duration.fillna(-1).to_numpy(dtype=np.int64))
+        release = pd.to_datetime(data['Release'], format="%Y-%m-%d", \
+            errors='coerce')
+        np.save(os.path.join(temp_path, "Release.npy"), \
+            release.to_numpy(dtype='datetime64[D]'))
+        
+        _count('bytes_written', sum(entry.stat().st_size \
+            for entry in os.scandir(temp_path)))
+        if os.path.exists(self.path):
+            os.replace(self.path, old_path)
+        os.replace(temp_path, self.path)
+        shutil.rmtree(old_path, ignore_errors=True)
+        
+    def compact(self):
+        """Folds the journal into the memory-mapped columns."""
+        self.rewrite(list(chain.from_iterable(self.iter_chunks())))
+
+class SQLiteStorage:
+    """Stores a playlist in an SQLite database.
+
+    The songs table has indexes on the normalized title and artist, so
+        deleting a title is an indexed delete instead of a rewrite of the
+        whole playlist. The database runs in WAL mode, so readers in other
+        processes are not blocked while songs are written, and each batch of
+        uploads and deletes is applied in a single transaction.
+    """
+    
+    SUFFIXES = (".db", ".sqlite", ".sqlite3")
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS songs (
+            id INTEGER PRIMARY KEY,
+            title TEXT, artist TEXT, genre TEXT,
+            duration INTEGER, release TEXT,
+            norm_title TEXT, norm_artist TEXT);
+        CREATE INDEX IF NOT EXISTS songs_title ON songs (norm_title);
+        CREATE INDEX IF NOT EXISTS songs_artist ON songs (norm_artist);
+    """
+    
+    def __init__(self, path):
+        """Initializes the class attributes.
+
+        Args:
+            path (str): path to the database file.
+        """
+        self.path = path
+        self._connection = None
+        
+    @property
+    def connection(self):
+        """sqlite3.Connection: the database connection, opened, switched to
+            WAL mode and given its schema on first use."""
+        if self._connection is None:
+            import sqlite3
+            self._connection = sqlite3.connect(self.path, \
+                isolation_level=None, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.executescript(self.SCHEMA)
+        return self._connection
+    
+    def sidecar(self, name):
+        """Returns the path of a file kept next to the database, such as its
+            saved statistics.
+
+        Args:
+            name (str): the name of the file, for example 'stats.json'.
+
+        Returns:
+            str: the path of the file.
+        """
+        return f"{self.path}.{name}"
+    
+    def signature(self):
+        """Identifies the current version of the database. SQLite's
+            data_version changes whenever another connection commits.
+
+        Returns:
+            tuple: the database file's inode and the data version.
+        """
+        version = self.connection.execute("PRAGMA data_version").fetchone()
+        return (_stat_signature(self.path)[0], version[0])
+    
+    def load(self):
+        """Reads the whole playlist.
+
+        Returns:
+            pandas.DataFrame: DataFrame containing the loaded data.
+        """
+        import pandas as pd
+        data = pd.DataFrame(list(chain.from_iterable(self.iter_chunks())), \
+            columns=COLUMNS)
+        data['Duration'] = data['Duration'].astype('Int64')
+        return data
+    
+    def iter_chunks(self, chunksize=10000):
+        """Reads the playlist a chunk at a time, in upload order.
+
+        Args:
+            chunksize (int, optional): the number of rows per chunk. Defaults
+                to 10000.
+
+        Yields:
+            list: the next (title, artist, genre, duration, release) tuples.
+        """
+        cursor = self.connection.execute("SELECT title, artist, genre, "
+            "duration, release FROM songs ORDER BY id")
+        while True:
+            rows = cursor.fetchmany(chunksize)
+            if not rows:
+                break
+            _count('rows_scanned', len(rows))
+            yield rows
+            
+    def _insert(self, rows):
+        self.connection.executemany("INSERT INTO songs (title, artist, "
+            "genre, duration, release, norm_title, norm_artist) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)", \
+            (tuple(row[:4]) + (None if row[4] is None else str(row[4]), \
+                normalize_title(row[0]), normalize_title(row[1] or '')) \
+                for row in rows))
+    
+    @contextmanager
+    def _transaction(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            raise
+        self.connection.execute("COMMIT")
+    
+    def append(self, chunks):
+        """Inserts chunks of rows in a single transaction.
+
+        Args:
+            chunks (iterable): lists of (title, artist, genre, duration,
+                release) tuples.
+        """
+        with self._transaction():
+            for rows in chunks:
+                self._insert(rows)
+    
+    def apply(self, deleted_titles, rows):
+        """Deletes titles and inserts new rows in a single transaction; the
+            deletes use the index on the normalized title.
+
+        Args:
+            deleted_titles (list): the titles to delete; case and quotes are
+                ignored.
+            rows (list): the (title, artist, genre, duration, release) tuples
+                to insert after the deletes.
+        """
+        with self._transaction():
+            self.connection.executemany( \
+                "DELETE FROM songs WHERE norm_title = ?", \
+                ((normalize_title(title),) for title in deleted_titles))
+            self._insert(rows)
+    
+    def rewrite(self, rows):
+        """Replaces the whole playlist in a single transaction.
+
+        Args:
+            rows (iterable): the (title, artist, genre, duration, release)
+                tuples to store.
+        """
+        with self._transaction():
+            self.connection.execute("DELETE FROM songs")
+            self._insert(rows)
+
+def _disk_size(path):
+    """Returns the bytes a file, or the files directly inside a directory,
+        take up on disk."""
+    if os.path.isdir(path):
+        return sum(entry.stat().st_size for entry in os.scandir(path) \
+            if entry.is_file())
+    return os.path.getsize(path)
+
+def _read_shard(path):
+    """Reads every song of one shard; run in a worker process by
+        ShardedStorage.map."""
+    return list(chain.from_iterable(storage_for_path(path).iter_chunks()))
+
+def _shard_rows(path, deleted):
+    """Yields the songs of one shard, leaving out the normalized titles in
+        deleted."""
+    for rows in storage_for_path(path).iter_chunks():
+        for row in rows:
+            if not deleted or normalize_title(row[0]) not in deleted:
+                yield row
+
+def _shard_artist_counts(path, deleted):
+    """Counts the songs by each artist in one shard; run in a worker process
+        by ShardedStorage.map."""
+    return Counter(_name_key(row[1]) for row in _shard_rows(path, deleted))
+
+def _shard_extremes(path, deleted, n, largest, genre, artist):
+    """Finds the n longest (or shortest) songs of one shard; run in a worker
+        process by ShardedStorage.map.
+
+    Returns:
+        list: (title, duration) tuples, in the order heapq.merge expects.
+    """
+    select = heapq.nlargest if largest else heapq.nsmallest
+    return select(n, _filter_durations(_shard_rows(path, deleted), genre, \
+        artist), key=itemgetter(1))
+
+def _filter_durations(rows, genre=None, artist=None):
+    """Yields the (title, duration) of every row with a known duration that
+        matches the optional genre and artist filters; case and quotes are
+        ignored."""
+    genre = None if genre is None else normalize_title(genre)
+    artist = None if artist is None else normalize_title(artist)
+    for title, song_artist, song_genre, duration, release in rows:
+        if duration is None:
+            continue
+        if genre is not None and normalize_title(song_genre or '') != genre:
+            continue
+        if artist is not None and normalize_title(song_artist or '') != artist:
+            continue
+        yield title, int(duration)
+
+class ShardedStorage:
+    """Stores a playlist across several shard files, each of them a CSV file,
+        columnar library or SQLite database.
+
+    The shards are the supported files in a directory, or the files matching
+        a glob pattern such as 'library/songs-*.csv'. Every song lives in the
+        shard picked by a CRC-32 hash of its normalized title, so an upload
+        is appended to one shard and deleting a title rewrites only the shard
+        holding it. The number of shards is fixed when the library is first
+        written; rewrite() keeps it and records the shards in a manifest.
+        Before a write is routed, shards that the manifest does not describe,
+        such as files split some other way or a shard added since, are
+        repartitioned by hash. Songs are read shard by shard, so there
+        is no upload order across shards: 'Recently Added' lists each shard's
+        songs in the order they were uploaded.
+
+    Reading fans out: map() runs a function on every shard, in a pool of
+        worker processes once the library is big enough for that to pay off,
+        and the results are merged by the caller.
+    """
+
+    DEFAULT_SHARDS = 8
+    PARALLEL_BYTES = 2 ** 22
+    MANIFEST = "shards.json"
+    SUFFIXES = (".csv", ColumnarStorage.SUFFIX) + SQLiteStorage.SUFFIXES
+
+    def __init__(self, path, shards=DEFAULT_SHARDS, processes=None):
+        """Initializes the class attributes.
+
+        Args:
+            path (str): the directory holding the shards, or a glob pattern
+                matching them.
+            shards (int, optional): the number of shards to create when the
+                library has none yet. Defaults to DEFAULT_SHARDS.
+            processes (int, optional): the most worker processes map() uses;
+                1 reads the shards one after another in this process.
+                Defaults to the number of CPUs.
+        """
+        self.path = path
+        self.shards = shards
+        self.processes = processes or os.cpu_count() or 1
+        self._storages = {}
+
+    def paths(self):
+        """Returns the paths of the shards, sorted by name."""
+        if os.path.isdir(self.path):
+            paths = [os.path.join(self.path, name) \
+                for name in os.listdir(self.path)]
+        else:
+            paths = glob.glob(self.path)
+        return sorted(path for path in paths \
+            if path.rstrip(os.sep).lower().endswith(self.SUFFIXES))
+
+    def _new_paths(self):
+        """Names the shards of a library that has none yet."""
+        if os.path.isdir(self.path):
+            pattern = os.path.join(self.path, "shard-*.csv")
+        elif '*' in self.path:
+            pattern = self.path
+        else:
+            raise ValueError(f"cannot name new shards after '{self.path}'; "
+                "use a pattern with '*'")
+        return [pattern.replace('*', f"{i:03}", 1) for i in range(self.shards)]
+
+    def _shard_names(self, paths):
+        """Returns the shards' paths relative to the manifest."""
+        base = os.path.dirname(os.path.abspath(self.sidecar(self.MANIFEST)))
+        return [os.path.relpath(os.path.abspath(path), base) for path in paths]
+
+    def routed_paths(self):
+        """Returns the shards in the order that shard_of numbers them. If the
+            manifest written by rewrite() does not list exactly these shards,
+            their songs are not where shard_of would look for them, so the
+            library is repartitioned by hash first.
+
+        Returns:
+            list: the paths of the shards.
+        """
+        paths = self.paths()
+        if not paths:
+            return paths
+        try:
+            with open(self.sidecar(self.MANIFEST), "r", \
+                    encoding="utf-8") as f:
+                if json.load(f).get('shards') == self._shard_names(paths):
+                    return paths
+        except (FileNotFoundError, ValueError, AttributeError):
+            pass
+        self.rewrite(list(chain.from_iterable(self.iter_chunks())))
+        return paths
+
+    def _storage(self, path):
+        """Returns the storage of one shard, reusing it so that an SQLite
+            shard keeps its connection."""
+        if path not in self._storages:
+            self._storages[path] = storage_for_path(path)
+        return self._storages[path]
+
+    @staticmethod
+    def shard_of(title, count):
+        """Returns the index of the shard holding a title.
+
+        Args:
+            title (str): the title of the song; case and quotes are ignored.
+            count (int): the number of shards.
+
+        Returns:
+            int: the shard's position in paths().
+        """
+        return zlib.crc32(normalize_title(title).encode("utf-8")) % count
+
+    def _partition(self, rows, count):
+        """Groups rows by the index of the shard they belong in."""
+        groups = {}
+        for row in rows:
+            groups.setdefault(self.shard_of(row[0], count), []).append(row)
+        return groups
+
+    def sidecar(self, name):
+        """Returns the path of a file kept with the shards, such as their
+            saved statistics: inside the directory, or next to the shards
+            with the pattern's wildcards replaced by 'all'.
+
+        Args:
+            name (str): the name of the file, for example 'stats.json'.
+
+        Returns:
+            str: the path of the file.
+        """
+        if os.path.isdir(self.path):
+            return os.path.join(self.path, name)
+        base = self.path.replace('*', 'all').replace('?', '_')
+        return f"{base}.{name}"
+
+    def signature(self):
+        """Identifies the current version of the library from the signature
+            of every shard.
+
+        Returns:
+            tuple: the shards' paths and signatures.
+        """
+        return tuple((path, self._storage(path).signature()) \
+            for path in self.paths())
+
+    def map(self, function, *args):
+        """Runs a function on every shard and returns the results, in the
+            order of paths(). Several shards totalling PARALLEL_BYTES or more
+            are handled by a pool of worker processes; they are spawned
+            rather than forked, so a lock held by another thread of this
+            process is never copied into them.
+
+        Args:
+            function (callable): a module-level function taking a shard's
+                path and args; its result must be picklable.
+            *args: further arguments passed to every call.
+
+        Returns:
+            list: the result for each shard.
+        """
+        paths = self.paths()
+        if len(paths) < 2 or self.processes < 2 or \
+                sum(_disk_size(path) for path in paths) < self.PARALLEL_BYTES:
+            return [function(path, *args) for path in paths]
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(min(len(paths), self.processes), \
+                mp_context=multiprocessing.get_context("spawn")) as pool:
+            return list(pool.map(function, paths, \
+                *([arg] * len(paths) for arg in args)))
+
+    def load(self):
+        """Reads the whole playlist.
+
+        Returns:
+            pandas.DataFrame: DataFrame containing the loaded data.
+        """
+        import pandas as pd
+        data = pd.DataFrame(list(chain.from_iterable(self.iter_chunks())), \
+            columns=COLUMNS)
+        data['Duration'] = data['Duration'].astype('Int64')
+        return data
+
+    def iter_chunks(self, chunksize=10000):
+        """Reads the playlist shard by shard, loading the shards in parallel
+            (see map).
+
+        Args:
+            chunksize (int, optional): the number of rows per chunk. Defaults
+                to 10000.
+
+        Yields:
+            list: the next (title, artist, genre, duration, release) tuples.
+        """
+        for rows in self.map(_read_shard):
+            for start in range(0, len(rows), chunksize):
+                yield rows[start:start + chunksize]
+
+    def append(self, chunks):
+        """Appends chunks of rows, each to the end of its shard. The chunks
+            are partitioned and appended one at a time, so only one chunk is
+            held in memory.
+
+        Args:
+            chunks (iterable): lists of (title, artist, genre, duration,
+                release) tuples.
+        """
+        paths = self.routed_paths()
+        if not paths:
+            self.rewrite(chain.from_iterable(chunks))
+            return
+        for rows in chunks:
+            for index, shard_rows in self._partition(rows, \
+                    len(paths)).items():
+                self._storage(paths[index]).append([shard_rows])
+
+    def apply(self, deleted_titles, rows):
+        """Deletes titles and inserts new rows, touching only the shards that
+            hold them. SQLite shards apply their part in one transaction;
+            other shards holding a deleted title are rewritten.
+
+        Args:
+            deleted_titles (list): the titles to delete; case and quotes are
+                ignored.
+            rows (list): the (title, artist, genre, duration, release) tuples
+                to insert after the deletes.
+        """
+        paths = self.routed_paths()
+        if not paths:
+            self.rewrite(rows)
+            return
+        deletes = {}
+        for title in deleted_titles:
+            deletes.setdefault(self.shard_of(title, len(paths)), set())\
+                .add(normalize_title(title))
+        inserts = self._partition(rows, len(paths))
+        for index in sorted(set(deletes) | set(inserts)):
+            storage = self._storage(paths[index])
+            if hasattr(storage, 'apply'):
+                storage.apply(list(deletes.get(index, ())), \
+                    inserts.get(index, []))
+            elif index in deletes:
+                kept = list(_shard_rows(paths[index], deletes[index]))
+                storage.rewrite(kept + inserts.get(index, []))
+            else:
+                storage.append([inserts[index]])
+
+    def rewrite(self, rows):
+        """Replaces the whole playlist, rewriting every shard with the rows
+            that hash to it, and records the shards in the manifest. A library
+            without shards gets `shards` new CSV shards.
+
+        Args:
+            rows (iterable): the (title, artist, genre, duration, release)
+                tuples to store.
+        """
+        paths = self.paths() or self._new_paths()
+        directory = os.path.dirname(paths[0])
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        groups = self._partition(rows, len(paths))
+        for index, path in enumerate(paths):
+            self._storage(path).rewrite(groups.get(index, []))
+        manifest = self.sidecar(self.MANIFEST)
+        with open(manifest + ".tmp", "w", encoding="utf-8") as f:
+            json.dump({'shards': self._shard_names(paths)}, f)
+        os.replace(manifest + ".tmp", manifest)
+
+def storage_for_path(path):
+    """Picks the storage backend for a playlist path: a glob pattern (with
+        '*' or '?'), or a directory that is not a columnar library, is a
+        sharded library; a path ending in '.db', '.sqlite' or '.sqlite3' is
+        an SQLite database; a path ending in '.ipodlib', or a directory
+        holding columns, is a columnar library; and anything else is a CSV
+        file.
+
+    Args:
+        path (str): the playlist path, as given by --playlist_path.
+
+    Returns:
+        CSVStorage, ColumnarStorage, SQLiteStorage or ShardedStorage: the
+            storage for the path.
+    """
+    if '*' in path or '?' in path:
+        return ShardedStorage(path)
+    if path.lower().endswith(SQLiteStorage.SUFFIXES):
+        return SQLiteStorage(path)
+    if path.rstrip(os.sep).endswith(ColumnarStorage.SUFFIX) or \
+            os.path.exists(os.path.join(path, "Duration.npy")):
+        return ColumnarStorage(path)
+    if os.path.isdir(path):
+        return ShardedStorage(path)
+    return CSVStorage(path)
+
+def convert_library(source, destination):
+    """Converts a playlist between storage formats, for example from
+        songs.csv to a columnar '.ipodlib' library or an SQLite database, or
+        back.
+
+    Args:
+        source (str): path of the playlist to read.
+        destination (str): path of the playlist to write; its format is
+            picked by storage_for_path.
+
+    Returns:
+        int: the number of songs converted.
+    """
+    rows = list(chain.from_iterable(storage_for_path(source).iter_chunks()))
+    storage_for_path(destination).rewrite(rows)
+    return len(rows)
+
+def _read_chunks(source, chunksize):
+    """Splits a bulk upload source into DataFrames of at most `chunksize` rows.
+
+    Args:
+        source (iterable, str or pandas.DataFrame): see Playlist.upload_songs.
+        chunksize (int): the maximum number of rows per chunk.
+
+    Yields:
+        pandas.DataFrame: the next chunk of the source.
+    """
+    import pandas as pd
+    if isinstance(source, str):
+        yield from pd.read_csv(source, chunksize=chunksize, dtype=str, \
+            keep_default_na=False)
+    elif isinstance(source, pd.DataFrame):
+        for start in range(0, len(source), chunksize):
+            yield source.iloc[start:start + chunksize]
+    else:
+        source = iter(source)
+        while True:
+            records = list(islice(source, chunksize))
+            if not records:
+                break
+            records = [tuple(r) + (None,) * (len(COLUMNS) - len(r)) \
+                for r in records]
+            yield pd.DataFrame(records, columns=COLUMNS)
+
+def _validate_chunk(chunk):
+    """Parses and checks the durations and release dates of a chunk of songs
+        with vectorized operations.
+
+    Args:
+        chunk (pandas.DataFrame): songs with the columns in COLUMNS.
+
+    Returns:
+        tuple: a list of the valid (title, artist, genre, duration, release)
+            rows, with durations in seconds, and a dict mapping the index of
+            each rejected row to the reason it was rejected.
+    """
+    import pandas as pd
+    text = chunk.fillna('').astype(str).apply(lambda col: col.str.strip())
+    
+    parts = text['Duration'].str.extract(r'^(?:(\d+):([0-5]?\d)|(\d+))$')\
+        .apply(pd.to_numeric)
+    seconds = (parts[0] * 60 + parts[1]).fillna(parts[2]).astype('Int64')
+    release = pd.to_datetime(text['Release'], format="%Y-%m-%d", \
+        errors='coerce')
+    
+    checks = [
+        (text['Title'] == '', "missing title"),
+        (text['Artist'] == '', "missing artist"),
+        (text['Genre'] == '', "missing genre"),
+        ((text['Duration'] != '') & seconds.isna(), \
+            "invalid duration, expected 'mm:ss'"),
+        ((text['Release'] != '') & release.isna(), \
+            "invalid release date, expected 'YYYY-MM-DD'"),
+    ]
+    reasons = {}
+    for failed, reason in reversed(checks):
+        for position in failed[failed].index:
+            reasons[position] = reason
+    
+    valid = ~chunk.index.isin(list(reasons))
+    rows = pd.DataFrame({
+        'Title': chunk['Title'], 'Artist': chunk['Artist'], \
+        'Genre': chunk['Genre'], 'Duration': seconds, \
+        'Release': release.dt.strftime("%Y-%m-%d")})[valid]
+    rows = rows.astype(object).where(rows.notna(), None)
+    return list(rows.itertuples(index=False, name=None)), reasons
+
+class ReadWriteLock:
+    """A lock that lets any number of threads read at the same time but gives
+        a writer the object to itself.
+
+    Writers take priority over new readers so that a steady stream of reads
+        cannot starve them. Both sides are reentrant: a thread may take the
+        read or write lock again while holding it, and the writing thread
+        may also read.
+    """
+    
+    def __init__(self):
+        """Initializes the class attributes."""
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._writer_depth = 0
+        self._waiting_writers = 0
+        self._local = threading.local()
+        
+    @contextmanager
+    def read(self):
+        """Holds the lock for reading for the duration of a with block."""
+        depth = getattr(self._local, "depth", 0)
+        me = threading.get_ident()
+        if depth or self._writer == me:
+            self._local.depth = depth + 1
+            try:
+                yield
+            finally:
+                self._local.depth = depth
+            return
+        with self._condition:
+            while self._writer is not None or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        self._local.depth = 1
+        try:
+            yield
+        finally:
+            self._local.depth = 0
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+                    
+    @contextmanager
+    def write(self):
+        """Holds the lock for writing for the duration of a with block."""
+        me = threading.get_ident()
+        with self._condition:
+            if self._writer != me:
+                self._waiting_writers += 1
+                while self._writer is not None or self._readers:
+                    self._condition.wait()
+                self._waiting_writers -= 1
+                self._writer = me
+            self._writer_depth += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writer_depth -= 1
+                if not self._writer_depth:
+                    self._writer = None
+                    self._condition.notify_all()
+
+class FileLock:
+    """An advisory lock shared between processes, taken with fcntl.flock on a
+        lock file next to the playlist. Where fcntl is not available (on
+        Windows) it does nothing.
+
+    flock belongs to the open file, not the thread, so the threads of a
+        process share one flock: any number of them may hold it shared, but
+        a thread asking for it exclusively waits until no other thread holds
+        it and then takes LOCK_EX itself. Waiting exclusive requests go ahead
+        of new shared ones. The lock is reentrant, and a thread that already
+        holds it keeps the mode it first took.
+    """
+    
+    def __init__(self, path):
+        """Initializes the class attributes.
+
+        Args:
+            path (str): the lock file; it is created if needed.
+        """
+        self.path = path
+        self._file = None
+        self._holders = 0
+        self._exclusive = False
+        self._waiting = 0
+        self._local = threading.local()
+        self._guard = threading.Condition(threading.Lock())
+        
+    @contextmanager
+    def hold(self, shared=False):
+        """Holds the lock for the duration of a with block.
+
+        Args:
+            shared (bool, optional): take a shared (reading) lock instead of
+                an exclusive one. Defaults to False.
+        """
+        if fcntl is None or getattr(self._local, "held", False):
+            yield
+            return
+        with self._guard:
+            if shared:
+                while self._exclusive or self._waiting:
+                    self._guard.wait()
+            else:
+                self._waiting += 1
+                while self._holders:
+                    self._guard.wait()
+                self._waiting -= 1
+            if not self._holders:
+                if self._file is None:
+                    self._file = open(self.path, "a+")
+                fcntl.flock(self._file.fileno(), \
+                    fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+                self._exclusive = not shared
+            self._holders += 1
+        self._local.held = True
+        try:
+            yield
+        finally:
+            self._local.held = False
+            with self._guard:
+                self._holders -= 1
+                if not self._holders:
+                    fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+                    self._exclusive = False
+                    self._guard.notify_all()
+    
+    def close(self):
+        """Closes the lock file if no thread holds the lock; it is opened
+            again the next time the lock is taken."""
+        with self._guard:
+            if self._file is not None and not self._holders:
+                self._file.close()
+                self._file = None
+
+def _read_through(method):
+    """Decorates a Playlist method that only reads the catalog: it reloads
+        the catalog first if the playlist's storage changed behind its back,
+        then runs under the playlist's read lock."""
+    def read(self, *args, **kwargs):
+        self.refresh()
+        with self._lock.read():
+            return method(self, *args, **kwargs)
+    
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.metrics.enabled:
+            return self.metrics.measure(method.__name__, read, self, *args, \
+                **kwargs)
+        return read(self, *args, **kwargs)
+    return wrapper
+
+def _write_through(method):
+    """Decorates a Playlist method that changes the catalog: it runs under
+        the playlist's write lock, after reloading the catalog if the
+        playlist's storage changed behind its back."""
+    def write(self, *args, **kwargs):
+        with self._lock.write():
+            self.refresh()
+            return method(self, *args, **kwargs)
+    
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self.metrics.enabled:
+            return self.metrics.measure(method.__name__, write, self, *args, \
+                **kwargs)
+        return write(self, *args, **kwargs)
+    return wrapper
+
+def _to_frame(rows):
+    """Builds a DataFrame from catalog rows.
+
+    Args:
+        rows (list): (row ID, (title, artist, genre, duration, release))
+            pairs.
+
+    Returns:
+        pandas.DataFrame: the songs, indexed by row ID.
+    """
+    import pandas as pd
+    data = pd.DataFrame([row for _, row in rows], columns = COLUMNS, \
+        index = [row_id for row_id, _ in rows])
+    data['Duration'] = data['Duration'].astype('Int64')
+    return data
 
 class Playlist:
     """Represents the music library where users can create their own playlist.
     """
     
-    def __init__(self, filepath):
+    # The fewest seconds between two saves of the running totals, unless a
+    # batch or with block is ending.
+    STATS_INTERVAL = 5
+    # The files kept next to the playlist (see _sidecar_path), which the
+    # FileWatcher does not count as changes to the playlist.
+    SIDECARS = ("lock", "plays.log", "plays.json", "stats.json", "queue.json")
+    
+    def __init__(self, filepath, flush_every=1, flush_interval=None, \
+            watch=False, instrument=False):
         """Initializes the class attributes.
+
+        Every method reads through the in-memory catalog, which is reloaded
+            only when the playlist's storage changes behind its back. A
+            playlist can be shared between threads, and several processes
+            can share one playlist file: reads run in parallel under a
+            reader-writer lock, and writes also hold an fcntl lock on the
+            file, merging in changes made by other processes before writing.
+
+        Args:
+            filepath (str): path to the playlist CSV file, or another
+                format picked by storage_for_path, such as a directory or
+                glob pattern of shards.
+            flush_every (int, optional): number of uploaded songs to buffer
+                before they are appended to the file. Defaults to 1, which
+                writes every upload straight away.
+            flush_interval (float, optional): milliseconds after which
+                buffered songs are flushed, whatever their number, by a
+                timer started when the first of them is buffered. Defaults
+                to None (no time limit).
+            watch (bool, optional): use inotify to learn about changes to the
+                playlist instead of checking it on every call, where
+                available. Defaults to False.
+            instrument (bool, optional): record the time and work of every
+                call in the `metrics` attribute; it can also be switched on
+                later with metrics.enabled. Defaults to False.
         """
         self.filepath = filepath
-        self.now_playing_song = {}
+        self.storage = storage_for_path(filepath)
+        self.metrics = Metrics(instrument)
+        self.now_playing_song = None
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        self._pending = []
+        self._deleted_titles = []
+        self._batch_depth = 0
+        self._charts = {}
+        self._shuffler = None
+        self._generation = 0
+        self._last_flush = time.monotonic()
+        self._timer = None
+        self._stats_dirty = False
+        self._stats_saved = 0.0
+        self._lock = ReadWriteLock()
+        self._file_lock = FileLock(self._sidecar_path("lock"))
+        self._queue_lock = threading.Lock()
+        self._history = None
+        self._started = None
+        self._watcher = None
+        if watch:
+            try:
+                self._watcher = FileWatcher(filepath, \
+                    [self._sidecar_path(name) for name in self.SIDECARS])
+            except OSError:
+                self._watcher = None
         self.create_database()
         
+    def _sidecar_path(self, name):
+        """Returns the path of a file kept next to the playlist, such as its
+            lock, play history or saved statistics. Unlike storage.sidecar,
+            it is outside a columnar library, whose directory is replaced on
+            every rewrite.
+        """
+        if isinstance(self.storage, ShardedStorage):
+            return self.storage.sidecar(name)
+        return f"{self.filepath.rstrip(os.sep)}.{name}"
+    
+    @property
+    def history(self):
+        """PlayHistory: the songs played on this playlist, loaded from its
+            play log the first time it is needed."""
+        if self._history is None:
+            self._history = PlayHistory(self._sidecar_path("plays.log"), \
+                self._sidecar_path("plays.json"), self._file_lock)
+        return self._history
+    
+    @property
+    def queue(self):
+        """deque: the titles waiting to be played. The queue is kept in a
+            file next to the playlist, so that it lasts from one command to
+            the next and is shared with other processes."""
+        with self._file_lock.hold(shared=True):
+            return self._read_queue()
+    
+    def _read_queue(self):
+        """Reads the queue file, which is a JSON list of titles."""
+        try:
+            with open(self._sidecar_path("queue.json"), "r", \
+                    encoding="utf-8") as f:
+                return deque(json.load(f))
+        except (FileNotFoundError, ValueError):
+            return deque()
+    
+    @contextmanager
+    def _edit_queue(self):
+        """Holds the queue, read from its file, for the duration of a with
+            block and saves it when the block exits."""
+        path = self._sidecar_path("queue.json")
+        with self._queue_lock, self._file_lock.hold():
+            queue = self._read_queue()
+            yield queue
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump(list(queue), f)
+                _count('bytes_written', f.tell())
+            os.replace(path + ".tmp", path)
+    
+    def _listening_time(self):
+        """Returns the seconds listened per genre, with a key that changes
+            whenever they do. Until a song has been played, the catalog's
+            genre durations stand in, as if every song had played once."""
+        history = self.history
+        history.refresh()
+        if history.totals[2]:
+            return +history.totals[0], ('plays', history.version)
+        return self.catalog.aggregates.genre_duration, \
+            (self._generation, self.catalog.aggregates.genre_version)
+    
     def __repr__(self):
         """Returns the formal representation of the object in an f-string."""
         return f"Playlist({self.filepath},{self.now_playing_song},\
             {self.new_data})"
     
+    def __enter__(self):
+        """Lets the playlist be used as a context manager that flushes any
+            buffered uploads and closes the playlist when the block exits."""
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        """Closes the playlist at the end of a with block (see close)."""
+        self.close()
+    
+    def close(self):
+        """Writes everything still buffered and releases the playlist's
+            background resources: the flush timer, the file watcher's thread
+            and inotify descriptor, and the lock file. The playlist can still
+            be used afterwards, but then checks its file on every call
+            instead of being told about changes.
+
+        Side effects:
+            flushes buffered uploads, deletes and play events, and saves the
+                running totals.
+        """
+        self.flush()
+        self._save_stats(force=True)
+        if self._watcher is not None:
+            self._watcher.close()
+            self._watcher = None
+        self._file_lock.close()
+    
+    @contextmanager
+    def batch(self):
+        """Groups many uploads and deletes into a single write: inside the
+            with block nothing is written to storage unless flush() is called
+            explicitly, and everything is flushed together when it exits.
+            
+        Other threads cannot use the playlist until the block exits.
+            
+        Side effects:
+            writes all changes made in the block to storage when it exits.
+        """
+        with self._lock.write():
+            self._batch_depth += 1
+            try:
+                yield self
+            finally:
+                self._batch_depth -= 1
+                if not self._batch_depth:
+                    self.flush()
+                    self._save_stats(force=True)
+    
+    @property
+    def new_data(self):
+        """pandas.DataFrame: every song in the playlist. It is built from the
+            catalog the first time it is needed, and songs uploaded since the
+            last access are concatenated in one go, so a run of uploads costs
+            a single concat instead of one per song."""
+        import pandas as pd
+        if self._data is None:
+            self._data = _to_frame(list(self.catalog.rows.items()))
+            self._unmerged = []
+        elif self._unmerged:
+            new_rows = _to_frame(self._unmerged)
+            self._data = pd.concat([self._data, new_rows]) \
+                if len(self._data) else new_rows
+            self._unmerged = []
+        return self._data
+    
+    @new_data.setter
+    def new_data(self, value):
+        self._data = value
+        self._unmerged = []
         
     def create_database(self):
-        """Loads data from a CSV file into a DataFrame, and reads data from the
-            CSV file specified by the `filepath` attribute and stores it in the
-            `new_data` attribute.
+        """Loads data from storage into the catalog, reading the CSV file or
+            columnar library specified by the `filepath` attribute. The
+            `new_data` DataFrame is only built when something asks for it.
 
         Returns:
-            pandas.DataFrame: DataFrame containing the loaded data.
+            Catalog: the catalog containing the loaded data.
         """
-        self.new_data = pd.read_csv(self.filepath)
+        with self._file_lock.hold(shared=True):
+            self._signature = self.storage.signature()
+            with _phase('read'):
+                table = SongTable()
+                if hasattr(self.storage, 'fill'):
+                    self.storage.fill(table)
+                else:
+                    for rows in self.storage.iter_chunks():
+                        table.extend(rows)
+        with _phase('index'):
+            self.catalog = Catalog(table=table)
+        self.new_data = None
+        self._generation += 1
         
-        return self.new_data
+        saved = Aggregates.load(self._sidecar_path("stats.json"))
+        self._stats_dirty = saved != self.catalog.aggregates
+        self._save_stats(force=True)
+        
+        return self.catalog
+    
+    def refresh(self):
+        """Reloads the catalog if the playlist's storage was changed by
+            something else since it was loaded or last written. Only the
+            file's inode, size and modification time are checked, and with a
+            watcher not even that unless it reported a change.
+
+        Returns:
+            bool: True if the catalog was reloaded.
+        """
+        if self._watcher is not None and not self._watcher.consume():
+            _count('cache_hits')
+            return False
+        if self.storage.signature() == self._signature:
+            _count('cache_hits')
+            return False
+        with self._lock.write():
+            if self.storage.signature() == self._signature:
+                _count('cache_hits')
+                return False
+            _count('cache_misses')
+            if self._pending or self._deleted_titles:
+                self.flush()
+            else:
+                self.create_database()
+        return True
+    
+    def _merge_changes(self):
+        """Reloads the catalog after another process changed storage, then
+            replays this playlist's unflushed deletes and uploads on top of
+            it, so that neither side's changes are lost."""
+        pending, deleted = self._pending, self._deleted_titles
+        self.create_database()
+        for title in deleted:
+            for row_id in self.catalog.find_title(title):
+                self.catalog.remove(row_id)
+        for row in pending:
+            self.catalog.add(row)
+    
+    def _save_stats(self, force=False):
+        """Saves the catalog's running totals next to the playlist if they
+            changed since they were last saved. Unless forced, they are saved
+            at most once every STATS_INTERVAL seconds, so that a run of
+            single uploads does not rewrite the whole file every time.
+
+        Args:
+            force (bool, optional): save now, however recent the last save.
+                Defaults to False.
+        """
+        now = time.monotonic()
+        if not self._stats_dirty or \
+                (not force and now - self._stats_saved < self.STATS_INTERVAL):
+            return
+        try:
+            self.catalog.aggregates.save(self._sidecar_path("stats.json"))
+        except OSError as e:
+            print(f"Error saving statistics: {e}")
+            return
+        self._stats_dirty = False
+        self._stats_saved = now
     
+    @_write_through
     def upload_song(self, song_title, artist, genre, \
             duration=None, release=None):
         """Uploads song details to a playlist in an iPod represented by a CSV
-            file using Pandas.
+            file. Only the new song is parsed and validated; it is appended to
+            the end of the file rather than rewriting the whole playlist.
 
         Args:
             song_title (str): the title of the song.
@@ -49,16 +3446,19 @@ class Playlist:
             genre (str): the genre of the song.
             duration (str, optional): the duration of the song in the 
                 format 'mm:ss'. Defaults to None.
-            release (str, optional): the release date of the song. Defaults 
-                to None.
+            release (str, optional): the release date of the song in the
+                format 'YYYY-MM-DD'. Defaults to None.
 
         Returns:
-            bool: True if the song details were sucessfully uploaded, and False
-                otherwise.
+            bool: True if the song details were sucessfully uploaded (or
+                buffered for the next flush), and False otherwise. A song
+                that could not be written is not kept anywhere, so it can
+                simply be uploaded again.
                 
         Side effects:
-            modifies the CSV file specified by filepath to include details of 
-                the uploaded song.
+            appends the uploaded song to the CSV file specified by filepath,
+                either straight away or on the next flush, depending on
+                flush_every and flush_interval.
             if duration is provided and in the format 'mm:ss', it calculates 
                 the duration in seconds and updates the duration_seconds 
                 variable accordingly.
@@ -70,9 +3470,9 @@ class Playlist:
             
         Technique:
             conditional expressions
-            concatenating on Pandas DataFrame
+            buffered appends to a file
         """
-        if self.new_data is None:
+        if self.catalog is None:
             self.create_database()   
             
         try: 
@@ -82,41 +3482,189 @@ class Playlist:
         except ValueError:
             print("Invalid duration format. Please use 'mm:ss'.")
             return False
-            
+        
         try:
-            existing_data = pd.read_csv(self.filepath)
-        except FileNotFoundError:
-            print("Error: File not found.")
+            if release:
+                datetime.strptime(release, "%Y-%m-%d")
+        except ValueError:
+            print("Invalid release date format. Please use 'YYYY-MM-DD'.")
             return False
         
-        if 'Release' not in existing_data.columns:
-            print("Error: 'Release' column not found in the CSV file.")
-            return False
+        new_song_data = (song_title, artist, genre, \
+                duration_seconds, release or None)
         
-        new_song_data = [song_title, artist, genre, \
-                duration_seconds, release]
+        row_id = self.catalog.add(new_song_data)
+        if self._data is not None:
+            self._unmerged.append((row_id, new_song_data))
+        self._pending.append(new_song_data)
         
-        columns = self.new_data.columns
+        overdue = self.flush_interval is not None and \
+            (time.monotonic() - self._last_flush) * 1000 >= \
+                self.flush_interval
+        if not self._batch_depth and \
+                (len(self._pending) >= self.flush_every or overdue):
+            if self.flush():
+                return True
+            # The song was not stored, so it is taken back out rather than
+            # left buffered, where a retry would upload it a second time.
+            self._pending = [row for row in self._pending \
+                if row is not new_song_data]
+            row_id = self.catalog.find_title(song_title)[-1]
+            self.catalog.remove(row_id)
+            if self._data is not None:
+                self.new_data = self.new_data.drop(index=[row_id])
+            return False
+        if not self._batch_depth and self.flush_interval is not None and \
+                self._timer is None:
+            self._timer = threading.Timer(self.flush_interval / 1000, \
+                self.flush)
+            self._timer.daemon = True
+            self._timer.start()
+        return True
+    
+    def flush(self):
+        """Appends every buffered upload to the CSV file and forces it to disk.
+            If songs were deleted since the last flush, the deletes and
+            uploads are applied in one transaction when storage supports it
+            (SQLite), and otherwise the whole playlist is rewritten once.
 
-        new_song_df = pd.DataFrame([new_song_data], columns = columns)
-        
-            
-        updated_data = pd.concat([self.new_data, new_song_df],ignore_index=True)
-        updated_data = updated_data.convert_dtypes()
-        updated_data['Release']= pd.to_datetime(updated_data['Release'])
-        
-            
-        try:
-            updated_data.to_csv(self.filepath, index=False)
-            self.new_data = updated_data
-           
+        Returns:
+            bool: True if the buffered songs were written (or there were none),
+                and False otherwise. Songs that could not be written stay
+                buffered for the next flush.
+                
+        Side effects:
+            appends rows to the CSV file specified by filepath.
+            if an error occurs, it prints an error message.
+        """
+        if self.metrics.enabled:
+            return self.metrics.measure("flush", self._flush)
+        return self._flush()
+    
+    def _flush(self):
+        self._last_flush = time.monotonic()
+        timer, self._timer = self._timer, None
+        if timer is not None:
+            timer.cancel()
+        if self._history is not None:
+            self._history.flush()
+        if not self._pending and not self._deleted_titles:
             return True
-        except Exception as e:
-            print(f"Error uploading song: {e}")
+        if not os.path.exists(self.filepath) and \
+                not isinstance(self.storage, ShardedStorage):
+            print("Error: File not found.")
             return False
+            
+        with self._lock.write(), self._file_lock.hold():
+            try:
+                if self.storage.signature() != self._signature:
+                    self._merge_changes()
+                with _phase('write'):
+                    if self._deleted_titles and \
+                            hasattr(self.storage, 'apply'):
+                        self.storage.apply(self._deleted_titles, \
+                            self._pending)
+                    elif self._deleted_titles:
+                        self.storage.rewrite(self.catalog.rows.values())
+                    else:
+                        self.storage.append([self._pending])
+            except Exception as e:
+                print(f"Error uploading song: {e}")
+                return False
+        
+            self._pending = []
+            self._deleted_titles = []
+            self._signature = self.storage.signature()
+            self._stats_dirty = True
+            self._save_stats()
+        return True
+    
+    @_write_through
+    def upload_songs(self, source, chunksize=10000):
+        """Uploads many songs at once from an iterable of tuples, another CSV
+            file or a DataFrame.
+
+        The source is read in chunks of `chunksize` rows; each chunk has its
+            durations and release dates parsed and checked column by column
+            before its valid rows are added, so memory use stays bounded by
+            the chunk size. Durations may be given as 'mm:ss' or as a whole
+            number of seconds, and release dates as 'YYYY-MM-DD'.
+
+        Args:
+            source (iterable, str or pandas.DataFrame): (title, artist, genre,
+                duration, release) tuples, where duration and release are
+                optional; the path of a CSV file; or a DataFrame. CSV files
+                and DataFrames must have the columns Title, Artist, Genre,
+                Duration and Release.
+            chunksize (int, optional): number of rows handled at a time.
+                Defaults to 10000.
+
+        Returns:
+            dict: 'uploaded', the number of songs added, and 'rejected', a
+                list of dicts giving the 'row' number in the source, the
+                'record' and the 'reason' it was rejected. If the upload
+                failed part way, 'error' says why and 'uploaded' counts only
+                the songs that storage kept.
+                
+        Side effects:
+            appends the valid songs to the CSV file specified by filepath,
+                with a single open and flush of the file. The songs are only
+                added to the catalog once storage has written them all.
+        
+        Technique:
+            vectorized string operations on pandas Series
+        """
+        report = {'uploaded': 0, 'rejected': []}
+        written = []
+        
+        def valid_chunks():
+            start = 0
+            for chunk in _read_chunks(source, chunksize):
+                missing = [c for c in COLUMNS if c not in chunk.columns]
+                if missing:
+                    raise ValueError(f"missing columns {missing}")
+                chunk = chunk[COLUMNS].astype(object)\
+                    .where(chunk[COLUMNS].notna(), None)
+                chunk.index = range(start, start + len(chunk))
+                start += len(chunk)
+                
+                rows, reasons = _validate_chunk(chunk)
+                for position, reason in sorted(reasons.items()):
+                    report['rejected'].append({'row': position, 'record': \
+                        tuple(chunk.loc[position]), 'reason': reason})
+                    
+                written.append(rows)
+                yield rows
+        
+        self.flush()
+        with self._file_lock.hold():
+            if self.storage.signature() != self._signature:
+                self._merge_changes()
+            before = len(self.catalog)
+            try:
+                with _phase('write'):
+                    self.storage.append(valid_chunks())
+            except Exception as e:
+                # Chunks written before the error may have been kept (CSV) or
+                # rolled back with the rest (SQLite), so the catalog is
+                # reloaded to match whatever storage now holds.
+                report['error'] = str(e)
+                self.create_database()
+            else:
+                for row in chain.from_iterable(written):
+                    row_id = self.catalog.add(row)
+                    if self._data is not None:
+                        self._unmerged.append((row_id, row))
+                self._signature = self.storage.signature()
+                self._stats_dirty = True
+                self._save_stats(force=True)
+            report['uploaded'] = len(self.catalog) - before
+        return report
         
+    @_read_through
     def play_song(self, song_title):
-        """Attempts to find and play a song by title from a CSV file.
+        """Attempts to find and play a song by title using the catalog's title
+            index, without reading the CSV file.
 
         Args:
             song_title (str): the title of the song that is going to be played.
@@ -127,30 +3675,96 @@ class Playlist:
                 not found.
         
         Side effects:
-            modifies the 'now_playing_song' attribute with the details of the
-                song that was found.
+            sets the 'now_playing_song' attribute to a Song record of the
+                song that was found, and records the play in the play
+                history.
                 
         Author:
             Daphne O'Malley
         """
-        try:
-            with open(self.filepath, "r", encoding="utf-8") as f:
-                reader = csv.reader(f)
-                for song in reader:
-                    csv_title = song[0].strip().lower()
-                    if csv_title == song_title.lower().strip():
-                        self.now_playing_song = {}
-                        keys = ['Title', 'Artist', 'Genre', 'Duration', \
-                            'Release']
-                        for i in range(len(keys)):
-                            self.now_playing_song[keys[i]] = song[i].strip()
-                        now_playing = self.display_now_playing()
-                        return now_playing
-                return "Song not found."
-        except FileNotFoundError:
-            return f"Couldn't find the file '{self.filepath}'."
-        except Exception as e:
-            return f"Error: {e}"
+        row_ids = self.catalog.find_title(song_title)
+        if not row_ids:
+            return "Song not found."
+        song = self.catalog.rows[row_ids[0]]
+        self.now_playing_song = Song(*(value.strip() \
+            if isinstance(value, str) else value for value in song))
+        song = self.now_playing_song
+        self._started = time.monotonic()
+        self.history.record(song.title, song.artist, song.genre, \
+            song.duration or 0)
+        now_playing = self.display_now_playing()
+        return now_playing
+    
+    @_read_through
+    def enqueue(self, song_title):
+        """Adds a song to the end of the play queue.
+
+        Args:
+            song_title (str): the title of the song; case and quotes are
+                ignored.
+
+        Returns:
+            bool: True if the song was found and queued, and False otherwise.
+        """
+        row_ids = self.catalog.find_title(song_title)
+        if row_ids:
+            with self._edit_queue() as queue:
+                queue.append(self.catalog.rows.titles[row_ids[0]])
+        return bool(row_ids)
+    
+    def play_next(self):
+        """Plays the next song in the queue, or the next song of the shuffle
+            (see next_shuffled) when the queue is empty. Queued songs that
+            have been deleted since are passed over.
+
+        Returns:
+            str: the now playing message, or a message that there is nothing
+                left to play.
+        """
+        while True:
+            with self._edit_queue() as queue:
+                title = queue.popleft() if queue else None
+            if title is None:
+                break
+            now_playing = self.play_song(title)
+            if now_playing != "Song not found.":
+                return now_playing
+        titles = self.next_shuffled()
+        if not titles:
+            return "Nothing to play."
+        return self.play_song(titles[0])
+    
+    def skip(self):
+        """Skips the rest of the song playing and plays the next one. The
+            part that was not heard is taken back out of the listening time
+            recorded for the song.
+
+        Returns:
+            str: the now playing message of the next song (see play_next).
+        """
+        song, started = self.now_playing_song, self._started
+        if song is not None and started is not None and song.duration:
+            unheard = int(song.duration - (time.monotonic() - started))
+            if unheard > 0:
+                self.history.record(song.title, song.artist, song.genre, \
+                    -unheard)
+        return self.play_next()
+    
+    def listening_summary(self, days = 7, hours = None, top = 5):
+        """Answers what was listened to lately, such as this week, from the
+            play history's rollups.
+
+        Args:
+            days (int, optional): the number of days, today included.
+                Defaults to 7.
+            hours (int, optional): the number of hours to use instead.
+                Defaults to None.
+            top (int, optional): the number of top artists. Defaults to 5.
+
+        Returns:
+            dict: see PlayHistory.summary.
+        """
+        return self.history.summary(days, hours, top)
 
     def display_now_playing(self):
         """Displays the details of the song that is currently playing.
@@ -163,24 +3777,38 @@ class Playlist:
         Author:
             Daphne O'Malley
         """
-        if self.now_playing_song:
-            return (f"Now playing: '{self.now_playing_song['Title']}' by " 
-                    f"{self.now_playing_song['Artist']} "
-                    f" from the genre {self.now_playing_song['Genre']}."
-                    f" Duration: {self.now_playing_song['Duration']} seconds,"
-                    f" released on {self.now_playing_song['Release']}.")
+        song = self.now_playing_song
+        if song:
+            duration = '' if song.duration is None else song.duration
+            release = '' if song.release is None else song.release
+            return (f"Now playing: '{song.title}' by " 
+                    f"{song.artist} "
+                    f" from the genre {song.genre}."
+                    f" Duration: {duration} seconds,"
+                    f" released on {release}.")
         else:
             return "No song is currently playing."
   
-    def view_all_songs(self, order = "Recently Added"):
-        """Returns all of the user's added songs in a specified order.
+    @_read_through
+    def view_all_songs(self, order = "Recently Added", limit = None, \
+            offset = 0):
+        """Returns the user's added songs in a specified order, read from the
+            catalog's materialized sort views so nothing is re-sorted.
         
         Args:
             order(str): the sort order to return the songs; 
                     default is set to 'Recently Added'.
+            limit(int, optional): the maximum number of songs to return;
+                    default is None, which returns every song.
+            offset(int, optional): the number of songs to skip, to read
+                    further pages; default is 0.
             
         Returns:
-            list: list of all added songs according to specified order.
+            pandas.Series: the titles of the songs on the requested page,
+                indexed by row ID, according to specified order.
+            
+        Raises:
+            ValueError: if the order is not one of SORT_ORDERS.
             
         Author:
             Becky Takang
@@ -188,18 +3816,18 @@ class Playlist:
         Technique:
             optional parameters
         """
-        if order == "Recently Added":
-            recent = self.new_data.sort_index(ascending = False)
-            return recent['Title']
-        
-        elif order == "Alphabetical":
-            alpha = self.new_data.sort_values('Title')
-            return alpha['Title']
-        elif order == "Release Year":
-            release = self.new_data.sort_values('Release')
-
-            return release['Title']
+        if order not in SORT_ORDERS:
+            raise ValueError(f"unknown order '{order}'; use " + \
+                ", ".join(SORT_ORDERS))
+        row_ids = self.catalog.view(order).page(offset, limit, \
+            reverse = order == "Recently Added")
+        _count('rows_scanned', len(row_ids))
+        import pandas as pd
+        titles = self.catalog.rows.titles
+        return pd.Series([titles[i] for i in row_ids], \
+            index = row_ids, name = 'Title', dtype = object)
                                     
+    @_write_through
     def delete_songs(self,song_title):
         """Deletes songs off a playlist and returns the updated playlist.
 
@@ -212,39 +3840,138 @@ class Playlist:
         Author: Elise Ferguson
         Technique: f-strings with expressions
         """
-        updated_playlist = []
-        song_found = False
-        with open(self.filepath, mode='r', encoding='utf-8') as file:
-            reader = csv.reader(file)
-            for row in reader:
-                csv_song_title = \
-                    row[0].strip().replace('“', '').replace('”', '')\
-                        .replace('"', '').lower()
-                input_song_title = song_title.strip().replace('“', '')\
-                    .replace('”', '').replace('"', '').lower()
-                if csv_song_title != input_song_title:
-                    updated_playlist.append(row)
-                else:
-                    song_found = True
+        song_found = self._delete_title(song_title) > 0
         
         if song_found:
             print(f"'{song_title}' found and deleted.")
         else:
             print(f"'{song_title}' not found in the playlist.")
 
-        with open(self.filepath, mode='w', encoding='utf-8') as file:
-            writer = csv.writer(file)
-            writer.writerows(updated_playlist)
+        updated_playlist = [list(COLUMNS)] + \
+            [list(row) for row in self.catalog.rows.values()]
 
         return updated_playlist
     
-    def shuffle_songs(self):
-            """A method that will take a playlist from a file and shuffle 
+    @_write_through
+    def _delete_title(self, song_title):
+        """Removes every song with a title from the catalog and storage.
+            Storage is updated straight away, or on the next flush inside a
+            batch.
+
+        Args:
+            song_title (str): the title of the songs to delete.
+
+        Returns:
+            int: the number of songs deleted.
+        """
+        row_ids = self.catalog.find_title(song_title)
+        for row_id in row_ids:
+            self.catalog.remove(row_id)
+        if row_ids:
+            if self._data is not None:
+                self.new_data = self.new_data.drop(index=row_ids)
+            title = normalize_title(song_title)
+            self._pending = [row for row in self._pending \
+                if normalize_title(row[0]) != title]
+            self._deleted_titles.append(song_title)
+            if not self._batch_depth:
+                self.flush()
+        return len(row_ids)
+    
+    @_read_through
+    def summary(self):
+        """Summarizes the library from the catalog's running totals.
+
+        Returns:
+            dict: the number of 'songs', plus the per-genre durations and
+                counts and the per-artist counts of Aggregates.to_dict().
+        """
+        return {'songs': len(self.catalog), \
+            **self.catalog.aggregates.to_dict()}
+    
+    @_read_through
+    def memory_report(self):
+        """Estimates how much memory the catalog uses, part by part and per
+            song.
+
+        Returns:
+            dict: the number of 'songs', the 'bytes' used by each part of the
+                catalog (see Catalog.memory_report), their 'total' and the
+                'per_track' average.
+        """
+        parts = self.catalog.memory_report()
+        total = sum(parts.values())
+        return {'songs': len(self.catalog), 'bytes': parts, 'total': total, \
+            'per_track': total / max(len(self.catalog), 1)}
+    
+    @_read_through
+    def released_between(self, start = None, end = None, limit = None):
+        """Finds the songs released between two dates with the catalog's
+            release index, in O(log n) plus the songs returned.
+
+        Args:
+            start (str, int or date, optional): the first release date, as
+                'YYYY-MM-DD' or a year. Defaults to None (the oldest).
+            end (str, int or date, optional): the last release date, as
+                'YYYY-MM-DD' or a year, included. Defaults to None (the
+                newest).
+            limit (int, optional): the most songs to return. Defaults to
+                None.
+
+        Returns:
+            list: (title, release date) tuples, oldest first.
+
+        Raises:
+            ValueError: if a date is not in the format 'YYYY-MM-DD'.
+        """
+        row_ids = self.catalog.release_index.between(start, end, limit)
+        _count('rows_scanned', len(row_ids))
+        return [(self.catalog.rows.titles[row_id], \
+            _day(self.catalog.rows.releases[row_id])) for row_id in row_ids]
+    
+    @_read_through
+    def newest_songs(self, n = 10):
+        """Finds the most recently released songs with the catalog's release
+            index.
+
+        Args:
+            n (int, optional): the number of songs. Defaults to 10.
+
+        Returns:
+            list: (title, release date) tuples, newest first.
+        """
+        row_ids = self.catalog.release_index.newest(n)
+        _count('rows_scanned', len(row_ids))
+        return [(self.catalog.rows.titles[row_id], \
+            _day(self.catalog.rows.releases[row_id])) for row_id in row_ids]
+    
+    @_read_through
+    def release_histogram(self, bucket = "year"):
+        """Counts the songs released in each year or decade.
+
+        Args:
+            bucket (str, optional): 'year' or 'decade'. Defaults to 'year'.
+
+        Returns:
+            dict: maps each year, or the first year of each decade, to its
+                number of songs; years without songs are included as 0.
+
+        Raises:
+            ValueError: if bucket is not 'year' or 'decade'.
+        """
+        return self.catalog.release_index.histogram(bucket)
+    
+    @_read_through
+    def shuffle_songs(self, limit = None, seed = None):
+            """A method that will take a playlist from the catalog and shuffle 
             the order of the songs.
 
             Args:
-                filepath (str): the name of the filepath with the songs that
-                need to be shuffled. 
+                limit (int, optional): only shuffle out this many songs,
+                    drawn lazily by a ShuffleEngine so that the rest of the
+                    catalog is never touched. Defaults to None (every song).
+                seed (int, optional): seeds the shuffle, so that the same
+                    seed gives the same order. Defaults to None.
             Returns:
                 list: returns a list of the songs in the filepath shuffled, 
                 using the shuffle function from the random module.
@@ -252,19 +3979,74 @@ class Playlist:
             Author: Hailey Moore
             Techniques: With statements
             """
-            shuffled_songs = []
-            with open(self.filepath, "r", encoding = "utf-8") as f:
-                reader = csv.reader(f)
-                for line in reader:
-                    if line[0] == 'Title':
-                        continue 
-                    shuffled_songs.append(line[0])
-
-            shuffle(shuffled_songs)    
+            if limit is not None:
+                engine = ShuffleEngine(self.catalog, seed)
+                titles = self.catalog.rows.titles
+                _count('rows_scanned', min(limit, len(self.catalog)))
+                return [titles[row_id] for row_id in islice(engine, limit)]
+            
+            _count('rows_scanned', len(self.catalog.rows))
+            shuffled_songs = self.catalog.rows.column(0)
+
+            if seed is None:
+                shuffle(shuffled_songs)
+            else:
+                Random(seed).shuffle(shuffled_songs)
             return shuffled_songs
     
+    @_write_through
+    def start_shuffle(self, seed = None, weights = None, by = "genre", \
+            window = 0):
+        """Starts a new shuffle for next_shuffled() to draw from.
+
+        Args:
+            seed (int, optional): seeds the shuffle. Defaults to None.
+            weights (dict, optional): maps genres or artists to how often
+                their songs should come up, relative to the weight of 1 that
+                every other song has; 0 leaves them out. Weighted songs are
+                drawn with replacement, so heavier ones repeat more often.
+                Defaults to None (every song once per pass).
+            by (str, optional): whether weights name a 'genre' or an
+                'artist'. Defaults to 'genre'.
+            window (int, optional): how many of the last songs shuffled may
+                not come up again. Defaults to 0.
+
+        Returns:
+            ShuffleEngine: the new shuffle.
+
+        Raises:
+            ValueError: if by or a weight is invalid (see ShuffleEngine).
+        """
+        self._shuffler = ShuffleEngine(self.catalog, seed, weights, by, \
+            window)
+        return self._shuffler
+    
+    @_write_through
+    def next_shuffled(self, count = 1):
+        """Draws the next songs of the current shuffle, starting a plain one
+            if start_shuffle() was never called. Each song costs O(1), and
+            uploads and deletes are taken into the shuffle as it goes instead
+            of reshuffling.
+
+        Args:
+            count (int, optional): the number of songs. Defaults to 1.
+
+        Returns:
+            list: the titles of the songs; fewer than count only if no song
+                can be played.
+        """
+        if self._shuffler is None:
+            self._shuffler = ShuffleEngine(self.catalog)
+        elif self._shuffler.catalog is not self.catalog:
+            self._shuffler.reset(self.catalog)
+        titles = self.catalog.rows.titles
+        _count('rows_scanned', count)
+        return [titles[row_id] for row_id in islice(self._shuffler, count)]
+    
+    @_read_through
     def show_listening_habits(self):
-        """Shows how long a user spends listening to a certain genre of music
+        """Shows how long a user spends listening to a certain genre of music,
+            from the play history's running per-genre totals
 
         Returns:
             pyplot bar graph : pyplot bar graph with the results of the \
@@ -276,20 +4058,81 @@ class Playlist:
         Technique:
             visualizing data with pyplot
         """
-        group = self.new_data.groupby('Genre')['Duration'].sum()
+        import pandas as pd
+        from matplotlib import pyplot as plt
+        genres, _ = self._listening_time()
+        group = pd.Series(genres, dtype='int64').sort_index()
         bar = group.plot.bar(x = 'Genre', y = 'Duration')
         plt.xlabel('Genre')
         plt.ylabel('Duration')
         plt.title('The Amount of Time Spent Listening to Each Genre')
         return plt.show()
                 
-    def songs_per_artist(self):
+    @_read_through
+    def render_listening_habits(self, format = "png", path = None):
+        """Draws the listening habits bar graph without a display, using
+            matplotlib's non-interactive Figure API, and returns the image.
+            Images are cached per version of the genre totals, so the graph
+            is only drawn again after a play (or, before anything has been
+            played, an upload or delete) has changed them.
+
+        Args:
+            format (str, optional): the image format, such as 'png' or 'svg'.
+                Defaults to 'png'.
+            path (str or file, optional): where to also write the image; a
+                path or a binary file object. Defaults to None.
+
+        Returns:
+            bytes: the rendered image.
+            
+        Side effects:
+            writes the image to path if one is given.
+        """
+        genres, version = self._listening_time()
+        key = version + (format,)
+        _count('cache_hits' if key in self._charts else 'cache_misses')
+        if key not in self._charts:
+            with _phase('render'):
+                import pandas as pd
+                from matplotlib.figure import Figure
+                group = pd.Series(genres, dtype='int64').sort_index()
+                figure = Figure()
+                axes = figure.subplots()
+                group.plot.bar(ax = axes)
+                axes.set_xlabel('Genre')
+                axes.set_ylabel('Duration')
+                axes.set_title('The Amount of Time Spent Listening to Each '
+                    'Genre')
+                buffer = io.BytesIO()
+                figure.savefig(buffer, format = format, \
+                    bbox_inches = 'tight')
+                self._charts = {k: v for k, v in self._charts.items() \
+                    if k[:2] == key[:2]}
+                self._charts[key] = buffer.getvalue()
+        
+        image = self._charts[key]
+        if isinstance(path, str):
+            with open(path, "wb") as f:
+                f.write(image)
+        elif path is not None:
+            path.write(image)
+        return image
+    
+    @_read_through
+    def songs_per_artist(self, stream=False, chunksize=10000):
         """
-        Counts the number of songs by each artist stored on the iPod
+        Counts the number of songs by each artist stored on the iPod. By
+            default the counts come from the catalog's running totals; with
+            stream=True they are recomputed in a single streaming pass over
+            storage, so memory use depends only on the chunk size and the
+            number of distinct artists.
 
         Args:
-            filepath(str): Path to CSV file containing information about each\
-                song.
+            stream (bool, optional): recount from storage instead of using
+                the running totals; the shards of a sharded library are
+                counted in parallel. Defaults to False.
+            chunksize (int, optional): number of rows read at a time when
+                streaming. Defaults to 10000.
 
         Returns: 
             songs_artist_dict(dict): A dictionary where the keys are the artist\
@@ -297,32 +4140,43 @@ class Playlist:
                 the values are the number of songs they have on the iPod.
 
         Author: Charlotte Drew
-        Technique: List and dictionary comprehensions
+        Technique: Counter and dictionary comprehensions
         """
 
-        with open(self.filepath, "r", encoding = "utf-8") as f:
-            #Skips header line
-            next(f)
-            #Use list comprehension to extract artist values from CSV file
-            artists = [line.strip().split(",") [1] for line in f]
+        if stream and hasattr(self.storage, 'map'):
+            #Counts each shard in a worker process and adds up the counts
+            deleted = {normalize_title(t) for t in self._deleted_titles}
+            with self._file_lock.hold(shared=True):
+                artists = sum(self.storage.map(_shard_artist_counts, \
+                    deleted), Counter())
+            artists.update(_name_key(line[1]) for line in self._pending)
+        elif stream:
+            #Keeps a running count of songs per artist, one chunk at a time
+            artists = Counter()
+            for rows in self._stream_rows(chunksize):
+                artists.update(_name_key(line[1]) for line in rows)
+        else:
+            artists = self.catalog.aggregates.artist_count
 
-            #Counts the number of songs written by each artist downloaded on 
-            #the iPod using a dictionary comprehension
+        #Formats the count for each artist downloaded on the iPod using a 
+        #dictionary comprehension
 
-            songs_artist_dict = {artist: f"{artists.count(artist)} song/s." \
-            for artist in set(artists)}
+        songs_artist_dict = {artist: f"{count} song/s." \
+        for artist, count in artists.items()}
 
         return songs_artist_dict
     
 
+    @_read_through
     def calculate_durations(self):
         """
         Creates a list of all the songs on the iPod in order of their duration\
               and 
             also calculates the longest song with its length."
 
-        Args:
-            filepath (str): Path to csv file containing song information.
+        The catalog is read in a single pass that keeps only each song's
+            duration and title, and tracks the longest song as a running
+            maximum.
 
         Returns: 
             str: f string containing the list of song titles sorted by duration\
@@ -330,7 +4184,7 @@ class Playlist:
                 descending order and the longest song with its length.
         
         Side effects: 
-            modifies songs list by adding values from the csv file.
+            modifies songs list by adding values from the catalog.
 
         Author: Charlotte Drew
 
@@ -339,35 +4193,170 @@ class Playlist:
 
         """
 
-        with open(self.filepath, "r", encoding = "utf-8") as f:
-                
-                songs = []
-                for line in f:
-                    song_title, artist, genre, duration, release_date =\
-                        line.strip().split(",")
-                    if song_title == 'Title':
-                        continue
-                    songs.append((song_title, artist, genre, duration, \
-                        release_date ))
+        songs = []
+        longest = None
+        _count('rows_scanned', len(self.catalog.rows))
+        for duration, song_title in zip(self.catalog.rows.column(3), \
+                self.catalog.rows.column(0)):
+            songs.append((duration, song_title))
+            if duration is not None and \
+                    (longest is None or duration > longest[0]):
+                longest = (duration, song_title)
                     
-    #Sort songs in descending order by duration in seconds
-        sorted_by_duration = sorted(songs, reverse = True, key=lambda x: x[3])
-
+    #Sort songs in descending order by duration in seconds, songs without a
+    #duration last
+        sorted_by_duration = sorted(songs, reverse = True, \
+            key=lambda x: -1 if x[0] is None else x[0])
 
     #Extract song titles
         
-        sorted_song_titles = [song[0] for song in sorted_by_duration]
+        sorted_song_titles = [song[1] for song in sorted_by_duration]
 
-    #Extract durations
-        song_durations = [duration[3] for duration in sorted_by_duration]
-    #Calculate longest song downloaded on iPod
-        longest_song = max(song_durations)
+    #Longest song downloaded on iPod
+        longest_song, longest_title = longest if longest else (0, None)
 
 
         return(f" List of song titles sorted by duration in descending order: \
         {sorted_song_titles}. The longest song on this iPod is \
-        {sorted_song_titles[0]} and it is {longest_song} seconds long.") 
+        {longest_title} and it is {longest_song} seconds long.") 
+    
+    @_read_through
+    def longest(self, n=10, genre=None, artist=None, stream=False):
+        """Finds the n longest songs, optionally only those of one genre or
+            artist, with heap selection instead of sorting every song.
+
+        Args:
+            n (int, optional): number of songs to return. Defaults to 10.
+            genre (str, optional): only consider songs of this genre; case
+                and quotes are ignored. Defaults to None.
+            artist (str, optional): only consider songs by this artist; case
+                and quotes are ignored. Defaults to None.
+            stream (bool, optional): read the songs chunk by chunk from
+                storage instead of the in-memory catalog. Defaults to False.
+
+        Returns:
+            list: (title, duration) tuples, longest first.
+            
+        Technique:
+            heapq.nlargest with a key function
+        """
+        if stream and hasattr(self.storage, 'map'):
+            return self._merged_extremes(n, True, genre, artist)
+        return heapq.nlargest(n, self._durations(genre, artist, stream), \
+            key=lambda song: song[1])
     
+    @_read_through
+    def shortest(self, n=10, genre=None, artist=None, stream=False):
+        """Finds the n shortest songs, optionally only those of one genre or
+            artist, with heap selection instead of sorting every song.
+
+        Args:
+            n (int, optional): number of songs to return. Defaults to 10.
+            genre (str, optional): only consider songs of this genre; case
+                and quotes are ignored. Defaults to None.
+            artist (str, optional): only consider songs by this artist; case
+                and quotes are ignored. Defaults to None.
+            stream (bool, optional): read the songs chunk by chunk from
+                storage instead of the in-memory catalog. Defaults to False.
+
+        Returns:
+            list: (title, duration) tuples, shortest first.
+        """
+        if stream and hasattr(self.storage, 'map'):
+            return self._merged_extremes(n, False, genre, artist)
+        return heapq.nsmallest(n, self._durations(genre, artist, stream), \
+            key=lambda song: song[1])
+    
+    def _merged_extremes(self, n, largest, genre=None, artist=None):
+        """Finds the n longest (or shortest) songs of a sharded library from
+            storage: each shard selects its own in a worker process and the
+            sorted results are k-way merged with the songs uploaded since
+            the last flush."""
+        deleted = {normalize_title(title) for title in self._deleted_titles}
+        with self._file_lock.hold(shared=True):
+            results = self.storage.map(_shard_extremes, deleted, n, largest, \
+                genre, artist)
+        select = heapq.nlargest if largest else heapq.nsmallest
+        results.append(select(n, _filter_durations(self._pending, genre, \
+            artist), key=itemgetter(1)))
+        return list(islice(heapq.merge(*results, key=itemgetter(1), \
+            reverse=largest), n))
+    
+    def _stream_rows(self, chunksize=10000):
+        """Reads the songs chunk by chunk from storage, leaving out titles
+            deleted since the last flush and adding songs uploaded since.
+
+        Args:
+            chunksize (int, optional): number of rows read at a time. Defaults
+                to 10000.
+
+        Yields:
+            list: the next (title, artist, genre, duration, release) tuples.
+        """
+        deleted = {normalize_title(title) for title in self._deleted_titles}
+        with self._file_lock.hold(shared=True):
+            for rows in self.storage.iter_chunks(chunksize):
+                yield [row for row in rows \
+                    if not deleted or normalize_title(row[0]) not in deleted]
+        if self._pending:
+            yield list(self._pending)
+    
+    def _durations(self, genre=None, artist=None, stream=False):
+        """Returns an iterator over the (title, duration) of every song with
+            a known duration that matches the optional genre and artist
+            filters."""
+        if stream:
+            rows = chain.from_iterable(self._stream_rows())
+        elif artist is not None:
+            row_ids = self.catalog.find_artist(artist)
+            _count('rows_scanned', len(row_ids))
+            rows = (self.catalog.rows[row_id] for row_id in row_ids)
+        else:
+            _count('rows_scanned', len(self.catalog.rows))
+            rows = self.catalog.rows.values()
+        return _filter_durations(rows, genre, artist)
+    
+    @_read_through
+    def search(self, query, limit = 5):
+        """Finds the songs whose title or artist best matches a query, even
+            when it is misspelled.
+
+        Args:
+            query (str): the title or artist to look for.
+            limit (int, optional): the maximum number of songs to return.
+                Defaults to 5.
+
+        Returns:
+            list: (title, artist) tuples of the matching songs, best match
+                first.
+        """
+        return [tuple(self.catalog.rows[row_id][:2]) for _, row_id in \
+            self.catalog.search.fuzzy(query, self.catalog.rows, limit)]
+    
+    @_read_through
+    def suggest(self, prefix, limit = 10):
+        """Autocompletes a partly typed title or artist.
+
+        Args:
+            prefix (str): the start of a title or artist; case and quotes are
+                ignored.
+            limit (int, optional): the maximum number of suggestions. Defaults
+                to 10.
+
+        Returns:
+            list: the distinct titles and artists starting with the prefix,
+                in alphabetical order.
+        """
+        suggestions = []
+        for text, row_id in self.catalog.prefix(prefix, limit * 4):
+            title, artist = self.catalog.rows[row_id][:2]
+            match = title if normalize_title(title) == text else artist
+            match = str(match).strip()
+            if match not in suggestions:
+                suggestions.append(match)
+        return suggestions[:limit]
+    
+    @_read_through
     def check_playlist(self, song, favorite = False):
         """Checks if a song is in the playlist/csv, and if it is a favorite 
         song,it is added to the frozenset that will keep it as the user's 
@@ -387,16 +4376,12 @@ class Playlist:
         Techniques: Set operations and frozensets.
         """
         check_set = set()
-        with open(self.filepath, "r", encoding = "utf-8") as f:
-            for line in f:
-                if 'Title' in line:
-                    continue
-                if song in line.strip().split(','):
-                    check_set.add(song)
+        if self.catalog.find_title(song) or self.catalog.find_artist(song):
+            check_set.add(song)
               
-            if favorite == True:
-                favorites = frozenset({song})
-                print(f"'{song}' is an all time favorite!")
+        if favorite == True:
+            favorites = frozenset({song})
+            print(f"'{song}' is an all time favorite!")
 
         if check_set == set():
             return f"The song '{song}' is not in the playlist"
@@ -428,7 +4413,8 @@ def menu():
     print("7. View your listening habits")
     print("8. Shuffle Songs")
     print("9. Check for a song in the playlist")
-    print("10. Turn off IPod")
+    print("10. Stats")
+    print("11. Turn off IPod")
 
 def upload_song_menu(playlist):
     """Asks the user to provide the details of the song they want to be added to
@@ -468,11 +4454,23 @@ def play_song_menu(playlist):
             played.
     """
     song_title = input("Enter the title of the song to be played: ")
-    print(playlist.play_song(song_title))
+    now_playing = playlist.play_song(song_title)
+    matches = playlist.search(song_title) \
+        if now_playing == "Song not found." else []
+    if matches:
+        print("Song not found. Did you mean:")
+        for number, (title, artist) in enumerate(matches, start=1):
+            print(f"{number}. {title.strip()} by {str(artist).strip()}")
+        choice = input("Enter a number to play it, or press Enter to skip: ")
+        if choice.isdigit() and 1 <= int(choice) <= len(matches):
+            now_playing = playlist.play_song(matches[int(choice) - 1][0])
+        else:
+            return
+    print(now_playing)
 
 def view_all_songs_menu(playlist):
     """Asks the user to input their filtering criteria for the view_all_songs \
-        function
+        function, then shows the songs one page at a time
 
     Args:
         playlist (Playlist): the playlist object from which the songs will \
@@ -483,21 +4481,21 @@ def view_all_songs_menu(playlist):
     while True:
         option = input("How would you like to view your songs: Recently Added," 
         " Alphabetical, Release Year ")
-        if option == 'Recently Added':
-            print(playlist.view_all_songs('Recently Added'))
-            break
-            
-        elif option == 'Alphabetical':
-            print(playlist.view_all_songs('Alphabetical'))
-            break
-            
-        elif option == 'Release Year':
-            print(playlist.view_all_songs('Release Year'))
+        if option in ('Recently Added', 'Alphabetical', 'Release Year'):
             break
             
         else:
             print(f"Please choose from one of the given options")
 
+    offset = 0
+    while True:
+        page = playlist.view_all_songs(option, limit=PAGE_SIZE, offset=offset)
+        print(page)
+        offset += PAGE_SIZE
+        if len(page) < PAGE_SIZE or offset >= len(playlist.catalog) or \
+                input("Press Enter for more songs, or q to stop: ") == 'q':
+            break
+
 def songs_per_artist_menu(playlist):
     """Helps call the songs_per_aritst method in the menu"""
     print(playlist.songs_per_artist())
@@ -507,13 +4505,23 @@ def calculate_durations_menu(playlist):
     print(playlist.calculate_durations())
     
 def view_your_listening_habits_menu(playlist):
-    """Shows users their listening habits
+    """Shows users their listening habits, or saves them to a PNG file when \
+        there is no display to show them on
 
     Args:
         playlist (Playlist): the playlist object from which the listening \
             habits will be displayed
     """
-    print(playlist.show_listening_habits())
+    import matplotlib
+    if matplotlib.get_backend().lower() in ('agg', 'svg', 'pdf', 'ps', 'cairo'):
+        playlist.render_listening_habits(path = CHART_PATH)
+        print(f"Saved your listening habits to '{CHART_PATH}'.")
+    else:
+        print(playlist.show_listening_habits())
+    week = playlist.listening_summary()
+    artists = ", ".join(artist for artist, _ in week['top_artists'])
+    print(f"This week: {week['plays']} plays, {week['seconds'] // 60} minutes"
+        + (f", mostly {artists}." if artists else "."))
 
 def shuffle_songs_menu(playlist):
     """Menu option to call the shuffling songs function.
@@ -532,7 +4540,212 @@ def check_playlist_menu(playlist):
     """
     song = input("Enter the song you want to check: ")
     favorite = input("Enter True if this song is your favorite, False if not: ")
-    print(playlist.check_playlist(song, favorite=False))
+    result = playlist.check_playlist(song, favorite=False)
+    print(result)
+    if result.endswith("is not in the playlist"):
+        matches = playlist.search(song)
+        if matches:
+            print("Similar songs in the playlist: " + ", ".join(\
+                f"'{title.strip()}' by {str(artist).strip()}" \
+                for title, artist in matches))
+
+def stats_menu(playlist):
+    """Menu option for seeing how long each playlist operation takes and how
+        much work it does, and for exporting those statistics.
+
+    Args:
+        playlist (Playlist): the playlist whose statistics are shown.
+    """
+    if not playlist.metrics.enabled:
+        answer = input("Stats are off. Turn them on from now? (y/n): ")
+        if answer.strip().lower().startswith("y"):
+            playlist.metrics.enabled = True
+            print("Stats are on; choose this option again to see them.")
+        return
+    report = playlist.metrics.to_dict()
+    if not report:
+        print("No operations recorded yet.")
+        return
+    print(f"{'Operation':<24}{'Calls':>7}{'p50 ms':>10}{'p95 ms':>10}"
+        f"{'p99 ms':>10}{'Rows':>10}{'Read':>10}{'Written':>10}{'Hits':>7}")
+    for name, stats in report.items():
+        print(f"{name:<24}{stats['calls']:>7}{stats['p50_ms']:>10.3f}"
+            f"{stats['p95_ms']:>10.3f}{stats['p99_ms']:>10.3f}"
+            f"{stats['rows_scanned']:>10}{stats['bytes_read']:>10}"
+            f"{stats['bytes_written']:>10}{stats['cache_hits']:>7}")
+    path = input("To export, enter a file name ending in .json or .prom "
+        "(or press Enter to skip): ").strip()
+    if path:
+        with open(path, "w", encoding="utf-8") as f:
+            if path.endswith(".prom"):
+                f.write(playlist.metrics.to_prometheus())
+            else:
+                json.dump(report, f, indent=2)
+        print(f"Stats exported to '{path}'.")
+
+def _int(value):
+    """Converts an optional command argument to an int."""
+    return None if value is None else int(value)
+
+def _year(value):
+    """Converts an optional date argument to an int when it is a year, and
+        leaves 'YYYY-MM-DD' dates as they are."""
+    return int(value) if isinstance(value, str) and value.isdigit() \
+        else value
+
+def _weights(value):
+    """Converts an optional weights argument, a dict or a string such as
+        'Pop=2,Rock=0.5', to a dict."""
+    if value is None or isinstance(value, dict):
+        return value
+    weights = {}
+    for pair in value.split(','):
+        name, _, weight = pair.rpartition('=')
+        weights[name.strip()] = float(weight)
+    return weights
+
+# Maps each command of the batch and subcommand modes to a function taking
+# the playlist and the command's arguments, and returning a JSON-friendly
+# result.
+OPERATIONS = {
+    'play': lambda p, song_title: p.play_song(song_title),
+    'upload': lambda p, song_title, artist, genre, duration=None, \
+        release=None: p.upload_song(song_title, artist, genre, duration, \
+            release),
+    'delete': lambda p, song_title: {'deleted': p._delete_title(song_title)},
+    'view': lambda p, order="Recently Added", limit=None, offset=0: \
+        p.view_all_songs(order, _int(limit), _int(offset)).tolist(),
+    'shuffle': lambda p, limit=None, seed=None: \
+        p.shuffle_songs(_int(limit), _int(seed)),
+    'shuffle_start': lambda p, seed=None, weights=None, by="genre", window=0: \
+        p.start_shuffle(_int(seed), _weights(weights), by, _int(window)) \
+            is not None,
+    'shuffle_next': lambda p, count=1: p.next_shuffled(_int(count)),
+    'artists': lambda p: p.songs_per_artist(),
+    'durations': lambda p: p.calculate_durations(),
+    'check': lambda p, song: p.check_playlist(song),
+    'search': lambda p, query, limit=5: p.search(query, _int(limit)),
+    'suggest': lambda p, prefix, limit=10: p.suggest(prefix, _int(limit)),
+    'longest': lambda p, n=10, genre=None, artist=None: \
+        p.longest(_int(n), genre, artist),
+    'shortest': lambda p, n=10, genre=None, artist=None: \
+        p.shortest(_int(n), genre, artist),
+    'released': lambda p, start=None, end=None, limit=None: \
+        p.released_between(_year(start), _year(end), _int(limit)),
+    'newest': lambda p, n=10: p.newest_songs(_int(n)),
+    'releases': lambda p, bucket="year": p.release_histogram(bucket),
+    'enqueue': lambda p, song_title: p.enqueue(song_title),
+    'queue': lambda p: list(p.queue),
+    'next': lambda p: p.play_next(),
+    'skip': lambda p: p.skip(),
+    'listened': lambda p, days=7, hours=None, top=5: \
+        p.listening_summary(_int(days), _int(hours), _int(top)),
+    'stats': lambda p: p.summary(),
+    'memory': lambda p: p.memory_report(),
+    'metrics': lambda p, format="json": p.metrics.to_prometheus() \
+        if format == "prometheus" else p.metrics.to_dict(),
+    'flush': lambda p: p.flush(),
+}
+
+def run_operation(playlist, command):
+    """Runs one command of the batch or subcommand modes.
+
+    Args:
+        playlist (Playlist): the playlist to run the command on.
+        command (str, list or dict): a script line such as
+            'upload "Song" Artist Pop 3:20', a list of the command name and
+            its arguments, or a JSON object with an 'op' key plus either an
+            'args' list or the arguments by name.
+
+    Returns:
+        dict: 'op', 'ok' and either the command's 'result' or an 'error',
+            plus any 'messages' the command printed. A command that raises
+            is reported as an error rather than stopping a batch.
+    """
+    if isinstance(command, str):
+        command = shlex.split(command)
+    if isinstance(command, dict):
+        command = dict(command)
+        op = command.pop('op', None)
+        args = command.pop('args', [])
+        kwargs = command
+    else:
+        op, args, kwargs = command[0], command[1:], {}
+    
+    if op not in OPERATIONS:
+        return {'op': op, 'ok': False, 'error': f"unknown command '{op}'"}
+    
+    output = io.StringIO()
+    try:
+        with redirect_stdout(output):
+            result = OPERATIONS[op](playlist, *args, **kwargs)
+        response = {'op': op, 'ok': True, 'result': result}
+    except Exception as e:
+        error = str(e).replace('<lambda>()', op)
+        if not isinstance(e, (TypeError, ValueError)):
+            error = f"{type(e).__name__}: {error}"
+        response = {'op': op, 'ok': False, 'error': error}
+    if output.getvalue():
+        response['messages'] = output.getvalue().splitlines()
+    return response
+
+def flush_batch(playlist):
+    """Flushes the uploads and deletes grouped by a batch as a 'flush'
+        command, so that a write that fails is reported like any other
+        command instead of only being printed.
+
+    Args:
+        playlist (Playlist): the playlist inside its batch() block.
+
+    Returns:
+        dict: the response, as from run_operation; 'ok' is False if the
+            changes could not be written.
+    """
+    response = run_operation(playlist, ['flush'])
+    if response['ok'] and response['result'] is False:
+        messages = response.get('messages', [])
+        response = {'op': 'flush', 'ok': False, 'error': (messages or \
+            ["the uploads and deletes could not be written"])[-1]}
+        if messages:
+            response['messages'] = messages
+    return response
+
+def run_batch(playlist, lines, out=sys.stdout):
+    """Runs a script of commands against one playlist, writing one JSON result
+        per command. Every upload and delete is grouped into a single flush
+        at the end, which adds a 'flush' result only if it fails. Nothing
+        else is written to standard output.
+
+    Args:
+        playlist (Playlist): the playlist to run the commands on.
+        lines (iterable): script lines (see run_operation) or JSON objects,
+            one per line; blank lines and lines starting with '#' are skipped.
+        out (file, optional): where to write the results. Defaults to
+            standard output.
+
+    Returns:
+        int: the number of commands that failed.
+    """
+    failures = 0
+    with redirect_stdout(io.StringIO()), playlist.batch():
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                command = json.loads(line) if line[0] in '{[' else line
+            except ValueError as e:
+                command = None
+                response = {'op': None, 'ok': False, 'error': str(e)}
+            if command is not None:
+                response = run_operation(playlist, command)
+            failures += not response['ok']
+            out.write(json.dumps(response, default=str) + "\n")
+        response = flush_batch(playlist)
+        if not response['ok']:
+            failures += 1
+            out.write(json.dumps(response, default=str) + "\n")
+    return failures
 
 def main():
     """Parse command line argument and intializes the playlist manager. Also
@@ -540,7 +4753,7 @@ def main():
     perform.
     
     Side effect:
-        prints "Ipod shutting down" if option 10 is selected
+        prints "Ipod shutting down" if option 11 is selected
         prints "Invalid choice. Please choose a valid option." if conditons are
         not met
 
@@ -549,14 +4762,56 @@ def main():
     """
     parser = ArgumentParser(description="Manage your playlist.")
     parser.add_argument("--playlist_path", default="songs.csv",\
-                            help="The path to the playlist CSV file.")
+                            help="The path to the playlist CSV file, "
+                            "'.ipodlib' columnar library or SQLite database, "
+                            "or a directory or quoted glob pattern of shard "
+                            "files.")
+    parser.add_argument("--instrument", action="store_true",\
+                            help="Record how long each operation takes and "
+                            "how much work it does, shown by the Stats "
+                            "option.")
+    parser.add_argument("--convert_to", default=None,\
+                            help="Convert the playlist to this path (a CSV "
+                            "file, '.ipodlib' library, SQLite database or "
+                            "shard pattern such as 'shards/songs-*.csv') and "
+                            "exit.")
+    subparsers = parser.add_subparsers(dest="command", metavar="command",\
+                            help="Run one command and print its result as "
+                            "JSON instead of showing the menu: "
+                            + ", ".join(OPERATIONS) + ", or batch.")
+    for name in OPERATIONS:
+        subparser = subparsers.add_parser(name)
+        subparser.add_argument("args", nargs="*")
+    subparsers.add_parser("batch", help="Run commands read from standard "
+                            "input, one script line or JSON object per line, "
+                            "and print one JSON result per line.")
     args = parser.parse_args()
 
-    music_library_manager = Playlist(args.playlist_path)
+    if args.convert_to:
+        count = convert_library(args.playlist_path, args.convert_to)
+        print(f"Converted {count} songs to '{args.convert_to}'.")
+        return
+
+    music_library_manager = Playlist(args.playlist_path, \
+        instrument=args.instrument)
+
+    if args.command == "batch":
+        failures = run_batch(music_library_manager, sys.stdin)
+        sys.exit(1 if failures else 0)
+    elif args.command:
+        with redirect_stdout(io.StringIO()), \
+                music_library_manager.batch():
+            response = run_operation(music_library_manager, \
+                [args.command] + args.args)
+            flushed = flush_batch(music_library_manager)
+        print(json.dumps(response, default=str))
+        if not flushed['ok']:
+            print(json.dumps(flushed, default=str))
+        sys.exit(0 if response['ok'] and flushed['ok'] else 1)
 
     while True:
         menu()
-        choice = input("Enter your choice (1-10): ")
+        choice = input("Enter your choice (1-11): ")
 
         if choice == "1":
             upload_song_menu(music_library_manager)
@@ -577,6 +4832,9 @@ def main():
         elif choice == "9":
             check_playlist_menu(music_library_manager)
         elif choice == "10":
+            stats_menu(music_library_manager)
+        elif choice == "11":
+            music_library_manager.close()
             print("Ipod shutting down")
             break
         else:
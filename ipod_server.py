@@ -0,0 +1,454 @@
+import asyncio
+import json
+import os
+import random
+import shlex
+import signal
+import time
+from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+
+from ipod import Playlist, flush_batch, run_operation
+
+"""  Serves one playlist to many clients over a local TCP or Unix socket, so
+        that each client does not have to load the library itself.
+
+    The protocol is the batch mode's, one message per line: each request is
+        a JSON object such as {"op": "search", "query": "hotel"} (or a list,
+        or a script line), optionally with an "id" that is echoed back, and
+        each response is the JSON object run_operation returns.
+
+    The playlist is only touched by one worker thread, so its storage work
+        never blocks the event loop. Uploads and deletes are queued and
+        committed in groups: every write that arrives while a commit is
+        running goes into the next one, which is flushed to storage once. A
+        write is only answered after its group has been committed. """
+
+WRITE_OPERATIONS = {'upload', 'delete'}
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+STREAM_LIMIT = 2 ** 24
+
+def _parse_request(line):
+    """Parses one request line into a command for run_operation.
+
+    Args:
+        line (str): a JSON object or list, or a script line.
+
+    Returns:
+        tuple: the command, its op and the request id (None if the request
+            has none).
+
+    Raises:
+        ValueError: if the line is not valid JSON or an empty command.
+    """
+    line = line.strip()
+    command = json.loads(line) if line[:1] in ('{', '[') else shlex.split(line)
+    if isinstance(command, dict):
+        command = dict(command)
+        return command, command.get('op'), command.pop('id', None)
+    if not command:
+        raise ValueError("empty command")
+    return command, command[0], None
+
+class PlaylistServer:
+    """Serves a playlist over a socket, committing writes in groups.
+
+    Attributes:
+        playlist (Playlist): the playlist being served.
+        max_group (int): the most writes committed together.
+        commits (int): the number of group commits so far.
+        writes (int): the number of writes committed so far.
+    """
+
+    def __init__(self, playlist, max_group=1000):
+        """Initializes the class attributes.
+
+        Args:
+            playlist (Playlist): the playlist to serve.
+            max_group (int, optional): the most writes to commit together.
+                Defaults to 1000.
+        """
+        self.playlist = playlist
+        self.max_group = max_group
+        self.commits = 0
+        self.writes = 0
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._queue = None
+        self._committer = None
+        self._server = None
+
+    async def start(self, host=DEFAULT_HOST, port=DEFAULT_PORT, path=None):
+        """Starts listening for clients.
+
+        Args:
+            host (str, optional): the address to listen on. Defaults to
+                DEFAULT_HOST.
+            port (int, optional): the TCP port to listen on. Defaults to
+                DEFAULT_PORT.
+            path (str, optional): listen on this Unix socket instead of TCP.
+                Defaults to None.
+
+        Returns:
+            asyncio.Server: the listening server.
+        """
+        self._queue = asyncio.Queue()
+        self._committer = asyncio.create_task(self._commit_loop())
+        if path:
+            self._server = await asyncio.start_unix_server(\
+                self._serve_client, path, limit=STREAM_LIMIT)
+        else:
+            self._server = await asyncio.start_server(self._serve_client, \
+                host, port, limit=STREAM_LIMIT)
+        return self._server
+
+    async def close(self):
+        """Stops accepting clients, commits any queued writes and closes the
+            playlist.
+
+        Side effects:
+            writes any buffered changes to storage.
+        """
+        self._server.close()
+        await self._server.wait_closed()
+        await self._queue.put(None)
+        await self._committer
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self.playlist.close)
+        self._executor.shutdown()
+
+    async def _serve_client(self, reader, writer):
+        """Answers one client's requests in the order they arrive."""
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    response = {'op': None, 'ok': False, \
+                        'error': "request too long"}
+                    line = None
+                else:
+                    if not line:
+                        break
+                    if not line.strip():
+                        continue
+                    response = await self.handle(line.decode())
+                writer.write((json.dumps(response, default=str) + "\n")\
+                    .encode())
+                await writer.drain()
+                if line is None:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def handle(self, line):
+        """Runs one request line, queueing writes for the next group commit
+            and running reads on the playlist's worker thread.
+
+        Args:
+            line (str): the request (see _parse_request).
+
+        Returns:
+            dict: the response, with the request's id if it had one.
+        """
+        try:
+            command, op, request_id = _parse_request(line)
+        except ValueError as e:
+            return {'op': None, 'ok': False, 'error': str(e)}
+
+        if op == 'server_stats':
+            response = {'op': op, 'ok': True, 'result': \
+                {'commits': self.commits, 'writes': self.writes}}
+        elif op in WRITE_OPERATIONS:
+            future = asyncio.get_running_loop().create_future()
+            await self._queue.put((command, future))
+            response = await future
+        else:
+            response = await asyncio.get_running_loop().run_in_executor(\
+                self._executor, self._run, command)
+        if request_id is not None:
+            response['id'] = request_id
+        return response
+
+    def _run(self, command):
+        """Runs one command on the worker thread, turning any failure into an
+            error response so that one bad request cannot stop the server."""
+        try:
+            return run_operation(self.playlist, command)
+        except Exception as e:
+            op = command.get('op') if isinstance(command, dict) \
+                else command[0]
+            return {'op': op, 'ok': False, 'error': str(e)}
+
+    def _commit(self, commands):
+        """Runs a group of writes on the worker thread and flushes them to
+            storage together. If the flush fails, every write of the group
+            that had succeeded is answered with the flush's error instead."""
+        with self.playlist.batch():
+            responses = [self._run(command) for command in commands]
+            flushed = flush_batch(self.playlist)
+        if flushed['ok']:
+            return responses
+        return [{'op': response['op'], 'ok': False, \
+            'error': flushed['error']} if response['ok'] else response \
+                for response in responses]
+
+    async def _commit_loop(self):
+        """Commits queued writes in groups until close() queues None."""
+        loop = asyncio.get_running_loop()
+        closing = False
+        while not closing:
+            item = await self._queue.get()
+            if item is None:
+                break
+            group = [item]
+            while len(group) < self.max_group and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    closing = True
+                    break
+                group.append(item)
+
+            commands = [command for command, _ in group]
+            try:
+                responses = await loop.run_in_executor(self._executor, \
+                    self._commit, commands)
+            except Exception as e:
+                responses = [{'op': None, 'ok': False, 'error': str(e)}] \
+                    * len(group)
+            self.commits += 1
+            self.writes += len(group)
+            for (_, future), response in zip(group, responses):
+                if not future.done():
+                    future.set_result(dict(response))
+
+class PlaylistClient:
+    """An asyncio client for PlaylistServer. Requests may be sent from
+        several tasks at once; each response is matched to its request by id.
+    """
+
+    def __init__(self, reader, writer):
+        """Initializes the class attributes; use connect() instead."""
+        self._reader = reader
+        self._writer = writer
+        self._ids = count()
+        self._waiting = {}
+        self._listener = asyncio.create_task(self._listen())
+
+    @classmethod
+    async def connect(cls, host=DEFAULT_HOST, port=DEFAULT_PORT, path=None):
+        """Connects to a server.
+
+        Args:
+            host (str, optional): the server's address. Defaults to
+                DEFAULT_HOST.
+            port (int, optional): the server's TCP port. Defaults to
+                DEFAULT_PORT.
+            path (str, optional): connect to this Unix socket instead.
+                Defaults to None.
+
+        Returns:
+            PlaylistClient: the connected client.
+        """
+        if path:
+            reader, writer = await asyncio.open_unix_connection(path, \
+                limit=STREAM_LIMIT)
+        else:
+            reader, writer = await asyncio.open_connection(host, port, \
+                limit=STREAM_LIMIT)
+        return cls(reader, writer)
+
+    async def __aenter__(self):
+        """Lets the client be used as an async context manager."""
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        """Closes the connection at the end of an async with block."""
+        await self.close()
+
+    async def close(self):
+        """Closes the connection."""
+        self._writer.close()
+        try:
+            await self._writer.wait_closed()
+        except ConnectionError:
+            pass
+        await self._listener
+
+    async def _listen(self):
+        """Hands each response to the request waiting for it."""
+        try:
+            while line := await self._reader.readline():
+                response = json.loads(line)
+                future = self._waiting.pop(response.pop('id', None), None)
+                if future is not None and not future.done():
+                    future.set_result(response)
+        except ConnectionError:
+            pass
+        for future in self._waiting.values():
+            if not future.done():
+                future.set_exception(ConnectionError("connection closed"))
+        self._waiting.clear()
+
+    async def request(self, op, *args, **kwargs):
+        """Sends one command and waits for its response.
+
+        Args:
+            op (str): the command, one of ipod.OPERATIONS.
+            *args: the command's arguments.
+            **kwargs: the command's arguments by name.
+
+        Returns:
+            dict: the response: 'op', 'ok' and either 'result' or 'error',
+                plus any 'messages'.
+        """
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[request_id] = future
+        message = dict(kwargs, op=op, args=list(args), id=request_id)
+        self._writer.write((json.dumps(message) + "\n").encode())
+        await self._writer.drain()
+        return await future
+
+    async def call(self, op, *args, **kwargs):
+        """Sends one command and returns its result.
+
+        Raises:
+            ValueError: if the server reports an error.
+        """
+        response = await self.request(op, *args, **kwargs)
+        if not response['ok']:
+            raise ValueError(response['error'])
+        return response['result']
+
+def percentile(sorted_values, fraction):
+    """Returns the value below which the given fraction of a sorted list
+        falls."""
+    index = min(len(sorted_values) - 1, int(fraction * len(sorted_values)))
+    return sorted_values[index]
+
+async def generate_load(clients=50, requests=200, write_ratio=0.1, \
+        host=DEFAULT_HOST, port=DEFAULT_PORT, path=None, seed=0):
+    """Runs many clients against a server at once, each sending a mix of
+        plays, searches, views, stats, uploads and deletes one after another.
+
+    Args:
+        clients (int, optional): the number of clients. Defaults to 50.
+        requests (int, optional): the requests each client sends. Defaults
+            to 200.
+        write_ratio (float, optional): the share of requests that upload or
+            delete a song. Defaults to 0.1.
+        host, port, path: where the server listens (see
+            PlaylistClient.connect).
+        seed (int, optional): seeds the choice of requests. Defaults to 0.
+
+    Returns:
+        dict: the requests sent, errors, seconds taken, requests per second,
+            p50 and p99 latency in milliseconds and the server's group
+            commits.
+    """
+    async with await PlaylistClient.connect(host, port, path) as client:
+        titles = await client.call('view') or ["Hotel"]
+    latencies = []
+    errors = 0
+
+    async def run_client(number):
+        nonlocal errors
+        rng = random.Random(seed * 1000003 + number)
+        uploaded = []
+        async with await PlaylistClient.connect(host, port, path) as client:
+            for i in range(requests):
+                choice = rng.random()
+                if choice < write_ratio and uploaded and rng.random() < 0.3:
+                    command = ('delete', uploaded.pop())
+                elif choice < write_ratio:
+                    uploaded.append(f"Load {number}-{i}")
+                    command = ('upload', uploaded[-1], f"Client {number}", \
+                        "Load", "3:00")
+                elif choice < 0.5:
+                    command = ('play', rng.choice(titles))
+                elif choice < 0.75:
+                    command = ('search', rng.choice(titles)[:6])
+                elif choice < 0.9:
+                    command = ('view', "Alphabetical", 20)
+                else:
+                    command = ('stats',)
+                start = time.perf_counter()
+                response = await client.request(*command)
+                latencies.append((time.perf_counter() - start) * 1000)
+                errors += not response['ok']
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run_client(n) for n in range(clients)))
+    elapsed = time.perf_counter() - start
+    async with await PlaylistClient.connect(host, port, path) as client:
+        server = await client.call('server_stats')
+
+    latencies.sort()
+    return {'requests': len(latencies), 'errors': errors, \
+        'seconds': elapsed, 'rps': len(latencies) / elapsed, \
+        'p50_ms': percentile(latencies, 0.5), \
+        'p99_ms': percentile(latencies, 0.99), \
+        'commits': server['commits'], 'writes': server['writes']}
+
+async def serve(playlist_path, host=DEFAULT_HOST, port=DEFAULT_PORT, \
+        path=None):
+    """Serves a playlist until interrupted.
+
+    Side effects:
+        prints where the server is listening, and closes the playlist on
+            SIGINT or SIGTERM.
+    """
+    playlist = Playlist(playlist_path)
+    server = PlaylistServer(playlist)
+    await server.start(host, port, path)
+    print(f"Serving {len(playlist.catalog)} songs on "
+        f"{path or f'{host}:{port}'}", flush=True)
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+    await stop.wait()
+    await server.close()
+    if path and os.path.exists(path):
+        os.remove(path)
+
+def main():
+    """Parses command line arguments and serves a playlist or generates load
+        against a server.
+
+    Side effects:
+        prints the load generator's results.
+    """
+    parser = ArgumentParser(description="Serve the iPod library to clients.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    serve_parser = subparsers.add_parser("serve", help="Serve a playlist.")
+    serve_parser.add_argument("--playlist_path", default="songs.csv")
+    load_parser = subparsers.add_parser("load", \
+        help="Measure a running server's throughput and latency.")
+    load_parser.add_argument("--clients", type=int, default=50)
+    load_parser.add_argument("--requests", type=int, default=200)
+    load_parser.add_argument("--write_ratio", type=float, default=0.1)
+    load_parser.add_argument("--seed", type=int, default=0)
+    for subparser in (serve_parser, load_parser):
+        subparser.add_argument("--host", default=DEFAULT_HOST)
+        subparser.add_argument("--port", type=int, default=DEFAULT_PORT)
+        subparser.add_argument("--socket", default=None, \
+            help="Use this Unix socket instead of TCP.")
+    args = parser.parse_args()
+
+    if args.command == "serve":
+        asyncio.run(serve(args.playlist_path, args.host, args.port, \
+            args.socket))
+    else:
+        results = asyncio.run(generate_load(args.clients, args.requests, \
+            args.write_ratio, args.host, args.port, args.socket, args.seed))
+        print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()